@@ -17,13 +17,15 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 from channels.auth import AuthMiddlewareStack
 from pong.middleware import jwt_auth_middleware_stack
+from pong.startup import StartupMiddleware
+from pong.tournament.tournament_session_handler import TournamentSessionHandler
 
 import live_chat.routing
 import pong.routing
 
 django_asgi_app = get_asgi_application()
 
-application = ProtocolTypeRouter({
+application = StartupMiddleware(ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": jwt_auth_middleware_stack(
         AuthMiddlewareStack(
@@ -33,4 +35,4 @@ application = ProtocolTypeRouter({
             )
         )
     ),
-})
+}), TournamentSessionHandler.start_resume_loop)
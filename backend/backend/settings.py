@@ -108,6 +108,10 @@ with open(PONG_CONFIG_FILE_PATH, 'r') as config_file:
 GAME_CONFIG = config['game']
 MATCH_CONFIG = config['match']
 TOURNAMENT_CONFIG = config['tournament']
+REGISTRY_CONFIG = config['registry']
+MATCHMAKING_CONFIG = config['matchmaking']
+RATING_CONFIG = config['rating']
+LEADERBOARD_CONFIG = config['leaderboard']
 
 SECRET_KEY = get_secret('secret_key')
 
@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from . import views
 from usermanagement.views import CreateUserView
+from pong.views import LeaderboardView, LeaderboardUserView
 from django.contrib.auth.models import User
 from rest_framework import routers, serializers, viewsets
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -33,4 +34,6 @@ urlpatterns = [
     path('api/', include('usermanagement.urls')),
     path('api/42auth/', include('auth42.urls')),
     path('api/chat/', include('live_chat.urls')),
+    path('api/leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('api/leaderboard/<int:id>/', LeaderboardUserView.as_view(), name='leaderboard-user'),
 ]
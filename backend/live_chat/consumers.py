@@ -15,14 +15,14 @@ import uuid
 from pong.data_managment.user import User as PongUser
 from pong.match.match_session_handler import MatchSessionHandler
 from pong.data_managment.matches import Matches
+from pong.data_managment.user_connections import UserConnections
 
 RelationshipStatus = Relationship.RelationshipStatus
 User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
     
-    online_users = set()
-    active_connections = {}
+    connections = UserConnections("chat") # Open connections of every user on every node, users with one are online
 
     async def send_message_to_user(self, receiver_id, message_info, value = False):
         print (f"Message type: {message_info.get('message_type')}")
@@ -68,15 +68,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
 
     async def broadcast_user_list(self):
-        users_info = await self.get_user_list()
+        online_users = await ChatConsumer.connections.get_users()
+        users_info = await self.get_user_list(online_users)
     
         all_blocked_users = {}
-        for user_id in list(ChatConsumer.online_users):
+        for user_id in online_users:
             friends_list = await self.get_friends_list(user_id)
             blocked_users = [friend['id'] for friend in friends_list if friend['status'] == RelationshipStatus.BLOCKED]
             all_blocked_users[user_id] = blocked_users
     
-        for user_id in list(ChatConsumer.online_users):
+        for user_id in online_users:
             blocked_users = all_blocked_users.get(user_id, [])
     
             blocked_by_users = {blocker for blocker, blocked in all_blocked_users.items() if user_id in blocked}
@@ -86,7 +87,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'id': user['id'],
                     'name': user['displayname'],
                     'profile_picture_url': user['profile_picture'],
-                    'is_online': user['id'] in ChatConsumer.online_users
+                    'is_online': user['id'] in online_users
                 }
                 for user in users_info 
                 if user['id'] != user_id and user['id'] not in blocked_users and user['id'] not in blocked_by_users
@@ -167,9 +168,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         })
 
     async def check_users_registered(self, user_id):
-        if PongUser.is_user_registered(int(self.user_id)):
+        if await PongUser.is_user_registered(int(self.user_id)):
             raise ValueError("You are already registered for a match or a tournament. Cancel your current registration to start a new one.")
-        if PongUser.is_user_registered(int(user_id)):
+        if await PongUser.is_user_registered(int(user_id)):
             raise ValueError("The other user is already registered for a match or a tournament. Please try again later.")
 
     async def connect(self):
@@ -182,23 +183,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.context = None
         self.user_group_name = f"chat_{self.user_id}"
 
-        # Check if the user already has active connections
-        is_new_connection = self.user_id not in ChatConsumer.active_connections
-
-        # Add the channel to the user's active connections
-        if self.user_id in ChatConsumer.active_connections:
-            ChatConsumer.active_connections[self.user_id].add(self.channel_name)
-        else:
-            ChatConsumer.active_connections[self.user_id] = {self.channel_name}
+        # Add the channel to the user's active connections, the user is online from the first one on
+        await ChatConsumer.connections.add(self.user_id, self.channel_name)
 
         await self.channel_layer.group_add(
             self.user_group_name,
             self.channel_name
         )
 
-        if is_new_connection:
-            ChatConsumer.online_users.add(self.user_id)
-
     async def disconnect(self, close_code):
         if hasattr(self, 'user_group_name'):
             await self.channel_layer.group_discard(
@@ -207,12 +199,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
         if hasattr(self, 'user_id'):
             # Remove the channel from the user's active connections
-            if self.user_id in ChatConsumer.active_connections:
-                ChatConsumer.active_connections[self.user_id].discard(self.channel_name)
-                if not ChatConsumer.active_connections[self.user_id]:
-                    del ChatConsumer.active_connections[self.user_id]
-                    ChatConsumer.online_users.remove(self.user_id)
-                    await self.broadcast_user_list()
+            if await ChatConsumer.connections.remove(self.user_id, self.channel_name):
+                await self.broadcast_user_list()
 
     async def receive(self, text_data):
         data = json.loads(text_data)
@@ -557,8 +545,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def get_user_list(self):
-        users = User.objects.filter(id__in=ChatConsumer.online_users)
+    def get_user_list(self, user_ids):
+        users = User.objects.filter(id__in=user_ids)
         user_list = []
         for user in users:
             user_list.append({
@@ -1,3 +1,8 @@
 from django.contrib import admin
+from .models import Tournament, TournamentPlayer, TournamentMatch
 
 # Register your models here.
+
+admin.site.register(Tournament)
+admin.site.register(TournamentPlayer)
+admin.site.register(TournamentMatch)
@@ -1,8 +1,14 @@
 import json
 import asyncio
 from channels.generic.websocket import AsyncWebsocketConsumer
+from typing import Optional
 from ..match.match_session import MatchSession
+from ..match import match_relay
+from ..match.match_relay import MatchRelay
 from ..data_managment.matches import Matches
+from ..data_managment.match_consumers import MatchConsumers
+from .outbound_mailbox import OutboundMailbox
+from ..match.protocol import get_sequence, is_newer_sequence, merge_state_frames
 from ..data_managment.user import User
 from jsonschema import ValidationError
 from django.conf import settings
@@ -22,6 +28,10 @@ class MatchConsumer(AsyncWebsocketConsumer):
         self._group_name: str = None
         self._match_session: MatchSession = None
         self._connection_established: bool = False
+        self._relay_channel: Optional[str] = None # Relay of the node that owns the match, if it is another node
+        self._is_closed_by_relay: bool = False # The owner ended the relayed connection, no disconnect to forward
+        self._mailbox: OutboundMailbox = OutboundMailbox(self.safe_send, merge_state_frames)
+        self._last_state_sequence: Optional[int] = None # Sequence of the newest position update queued so far
 
     async def connect(self) -> None:
         '''Establish the WebSocket connection'''
@@ -35,6 +45,11 @@ class MatchConsumer(AsyncWebsocketConsumer):
         # Group name for the match
         self._group_name = f"match_{self._match_id}"
 
+        # The match runs on another node, connect through its relay
+        if self._user_id is not None and self._match_id is not None and not Matches.is_match_registered(self._match_id):
+            await self._connect_through_relay()
+            return
+
         # Check if the connection is valid
         if not await self.is_valid_connection(self._match_id, self._user_id):
             await self.close()
@@ -47,6 +62,8 @@ class MatchConsumer(AsyncWebsocketConsumer):
         # Accept the WebSocket connection
         await self.accept()
         self._connection_established = True
+        self._mailbox.start()
+        MatchConsumers.add_consumer(self._match_id, self._user_id, self)
 
         self._match_session = Matches.get_match(self._match_id)
         await self._match_session.connect_user(self._user_id, self._match_session_is_finished_callback)
@@ -63,6 +80,17 @@ class MatchConsumer(AsyncWebsocketConsumer):
             return
         self._connection_established = False
 
+        if self._relay_channel is not None:
+            await self._mailbox.close()
+            await self.channel_layer.group_discard(self._match_id, self.channel_name)
+            if not self._is_closed_by_relay:
+                await self._send_to_relay(match_relay.DISCONNECT)
+            return
+
+        MatchConsumers.remove_consumer(self._match_id, self)
+        await self._mailbox.close()
+        if self._mailbox.get_dropped_frames() > 0:
+            logger.info(f"User {self._user_id} in match {self._match_id}: {self._mailbox.get_dropped_frames()} of {self._mailbox.get_sent_frames() + self._mailbox.get_dropped_frames()} frames dropped")
         await self.channel_layer.group_discard(self._match_id, self.channel_name)
         if self._match_session:
             asyncio.create_task(self._match_session.disconnect_user(self._user_id))
@@ -83,7 +111,10 @@ class MatchConsumer(AsyncWebsocketConsumer):
             if message_type == await PlayerInput.get_type():
                 try:
                     msg = PlayerInput(**data)
-                    await self._match_session.update_player_direction(self._user_id, msg.direction, msg.player_id)
+                    if self._relay_channel is not None:
+                        await self._send_to_relay(match_relay.INPUT, direction=msg.direction, player_id=msg.player_id)
+                    else:
+                        await self._match_session.update_player_direction(self._user_id, msg.direction, msg.player_id)
                 except ValidationError as e:
                     logger.error(f"Invalid message data: {e}")
                 except Exception as e:
@@ -129,20 +160,52 @@ class MatchConsumer(AsyncWebsocketConsumer):
 
         return True
     
+    #############################
+    #          Relay            #
+    #############################
+
+    async def _connect_through_relay(self) -> None:
+        '''Accept a connection to a match of another node and announce it to the owner'''
+        self._relay_channel = await MatchRelay.get_owner_channel(await Matches.get_owner(self._match_id))
+
+        # The match index is shared, the owner checks the rest and can still reject the connection
+        if self._relay_channel is None or await User.get_user_match_id(self._user_id) != self._match_id:
+            logger.debug(f"User {self._user_id} cannot reach match {self._match_id} through a relay")
+            self._relay_channel = None
+            await self.close()
+            return
+
+        # The state and control frames of the match reach every node through the group
+        await self.channel_layer.group_add(self._match_id, self.channel_name)
+        await self.accept()
+        self._connection_established = True
+        self._mailbox.start()
+        await self._send_to_relay(match_relay.CONNECT, reply_channel=self.channel_name)
+        logger.debug(f"User {self._user_id} connected to match {self._match_id} through a relay")
+
+    async def _send_to_relay(self, message_type: str, **fields) -> None:
+        '''Send a message to the relay of the node that owns the match'''
+        try:
+            await self.channel_layer.send(self._relay_channel, {
+                "type": message_type,
+                "match_id": self._match_id,
+                "user_id": self._user_id,
+                **fields
+            })
+        except Exception as e:
+            logger.error(f"Failed to reach the relay of match {self._match_id}: {e}")
+
     async def _match_session_is_finished_callback(self, winner: int, loser: int) -> None:
         '''Callback function for when the match session is finished'''
         await self._send_game_over_message(winner, loser)
+        await self._mailbox.drain()
         self._match_session = None
         await self.close()
 
     async def _send_game_over_message(self, winner: int, loser: int) -> None:
         '''Send a game over message to the users'''
         logger.debug(f"Sending game over message to users")
-        await self.send(text_data=json.dumps({
-            "type": "game_over",
-            "winner": winner,
-            "loser": loser
-        }))
+        self._mailbox.put_control(bytes_data=self._match_session.pack_game_over_message(winner, loser))
 
 
     ### Channel Layer Callbacks ###
@@ -150,36 +213,46 @@ class MatchConsumer(AsyncWebsocketConsumer):
     async def user_mapping(self, event) -> None:
         '''Send the user mapping to the user'''
         logger.info(f"User mapping: {event}")
-        await self.safe_send(text_data=json.dumps(event))
+        self._mailbox.put_control(bytes_data=event["data"])
 
     async def position_update(self, event) -> None:
         '''Send the position update to the user'''
         game_state_bytes = event.get("data")
         if game_state_bytes:
-            await self.safe_send(bytes_data=game_state_bytes)
-
-    async def user_connected(self, event) -> None:
-        '''Send the user connected message to the user'''
-        logger.debug(f"User {event} connected")
-        if event.get("user_id") != self._user_id:
-            return
-        await self.safe_send(text_data=json.dumps(event))
+            sequence = get_sequence(game_state_bytes)
+            if self._last_state_sequence is not None and not is_newer_sequence(sequence, self._last_state_sequence):
+                return # Overtaken by a newer update on the other delivery path, which starts with a keyframe
+            self._last_state_sequence = sequence
+            self._mailbox.put_snapshot(game_state_bytes)
 
     async def user_disconnected(self, event) -> None:
         '''Send the user disconnected message to the user'''
         logger.debug(f"User {event} disconnected")
-        await self.safe_send(text_data=json.dumps(event))
+        self._mailbox.put_control(bytes_data=event["data"])
 
     async def start_timer_update(self, event) -> None:
         '''Send the start timer update to the user'''
-        await self.safe_send(text_data=json.dumps(event))
+        self._mailbox.put_control(bytes_data=event["data"])
 
     async def player_scores(self, event) -> None:
         '''Send the player scores to the user'''
-        await self.safe_send(text_data=json.dumps(event))
+        self._mailbox.put_control(bytes_data=event["data"])
+
+    async def relay_game_over(self, event) -> None:
+        '''Send the game over message of a relayed match and close the connection'''
+        self._is_closed_by_relay = True
+        self._mailbox.put_control(bytes_data=event["data"])
+        await self._mailbox.drain()
+        await self.close()
+
+    async def relay_rejected(self, event) -> None:
+        '''The owner of the match did not accept the relayed connection'''
+        logger.debug(f"Relayed connection of user {self._user_id} to match {self._match_id} rejected")
+        self._is_closed_by_relay = True
+        await self.close()
 
     async def safe_send(self, text_data: str = None, bytes_data: bytes = None) -> None:
-        '''Send a message only if the connection is established'''
+        '''Send a message only if the connection is established, used by the mailbox writer'''
         if self._connection_established:
             try:
                 if text_data is not None:
@@ -1,9 +1,10 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 from ..match.match_session_handler import MatchSessionHandler
-from ..tournament.tournament_session_handler import TournamentSessionHandler
+from ..tournament.tournament_session_handler import TournamentSessionHandler, DEFAULT_FORMAT
 from ..data_managment.tournaments import Tournaments
 from ..data_managment.user import User
 from ..data_managment.matchmaking_queue import MatchmakingQueue
+from ..data_managment.user_connections import UserConnections
 import asyncio
 import json
 import logging
@@ -27,7 +28,7 @@ from pong.schemas.matchmaking_schema import (
 logger = logging.getLogger("matchmaking_consumer")
 
 class MatchmakingConsumer(AsyncWebsocketConsumer):
-    _user_connections: dict = {} # Keep track of user connections the active connection(browser tab) for each user
+    _user_connections: UserConnections = UserConnections("pong:matchmaking") # Connections and the active connection(browser tab) of each user, on every node
     _last_request_time: dict = {} # Keep track of the last request time for each user
 
     def __init__(self, *args, **kwargs):
@@ -58,7 +59,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         await self._update_active_connection()
 
         # Check if the user is already connected to a match and offer to reconnect
-        current_match_id = User.get_user_match_id(self.user_id)
+        current_match_id = await User.get_user_match_id(self.user_id)
         if current_match_id and not User.is_user_connected_to_match(self.user_id, current_match_id):
             opponent = User.get_opponent_user_id(self.user_id, current_match_id)
             await self.send(text_data=json.dumps({
@@ -74,12 +75,12 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
             return
         
         # Remove the connection from the user's active connections
-        await self._remove_connection()
+        is_last_connection = await self._remove_connection()
 
-        if self.user_id in self._user_connections and len(self._user_connections[self.user_id]["connections"]) == 0:
+        if is_last_connection:
             logger.info(f"User {self.user_id} has no open connections")
             try:
-                MatchSessionHandler.remove_from_matchmaking_queue(self.user_id)
+                await MatchSessionHandler.remove_from_matchmaking_queue(self.user_id)
             except ValueError as e:
                 pass # Ignore errors when removing user from matchmaking queue
             try:
@@ -93,7 +94,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
         else:
-            logger.info(f"User {self.user_id} has {self._user_connections[self.user_id]} open connections")
+            logger.info(f"User {self.user_id} has {await self._user_connections.get_count(self.user_id)} open connections")
 
 
     async def receive(self, text_data: str) -> None:
@@ -152,31 +153,13 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     ###################################################################
 
     async def _update_active_connection(self) -> None:
-        '''Add a connection to the user's active connections'''
-        # Create a new entry for the user if it does not exist yet
-        if self.user_id not in self._user_connections:
-            self._user_connections[self.user_id] = {
-                "connections": set(),  # To store all connections
-                "active": None         # To store the active connection
-            }
-
-        # Add this connection to the set of connections
-        self._user_connections[self.user_id]["connections"].add(self.channel_name)
-        self._user_connections[self.user_id]["active"] = self.channel_name
+        '''Add a connection to the user's active connections and make it the active one'''
+        await self._user_connections.add(self.user_id, self.channel_name)
     
-    async def _remove_connection(self) -> None:
-        '''Remove a connection from the user's active connections'''
-
-        # Remove this connection from the set of connections
-        self._user_connections[self.user_id]["connections"].discard(self.channel_name)
-
-        # Set the active connection to None if it is the active connection
-        if self._user_connections[self.user_id]["active"] == self.channel_name:
-            # Set the active connection to an arbitrary connection in the set if there are any connections left
-            if len(self._user_connections[self.user_id]["connections"]) > 0:
-                self._user_connections[self.user_id]["active"] = next(iter(self._user_connections[self.user_id]["connections"]))
-            else:
-                self._user_connections[self.user_id]["active"] = None
+    async def _remove_connection(self) -> bool:
+        '''Remove a connection from the user's active connections, returns True if it was the last one'''
+        # If it was the active connection, one of the remaining connections becomes the active one
+        return await self._user_connections.remove(self.user_id, self.channel_name)
 
     ##############################
     #    Message Handlers        #
@@ -185,16 +168,16 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     #    the channel layer       #
     ##############################
 
-    def _is_active_connection(self) -> bool:
+    async def _is_active_connection(self) -> bool:
         '''Check if the current connection is the active connection (Current tab in the browser)'''
-        return self._user_connections[self.user_id]["active"] == self.channel_name
+        return await self._user_connections.is_active(self.user_id, self.channel_name)
 
     async def remote_match_ready(self, event: dict) -> None:
         '''Handle the remote_match_ready message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
         logger.debug(f"Received remote_match_ready event: {event}")
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         match_id = event['match_id']
@@ -208,7 +191,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
 
         # Check if the current connection is the active connection (Current tab in the browser)
         logger.debug(f"Received local_match_ready event: {event}")
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         match_id = event['match_id']
@@ -229,7 +212,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         '''Handle the tournament_starting message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         logger.debug(f"Received tournament_starting event: {event}")
@@ -241,7 +224,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         '''Handle the tournament_canceled message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         logger.debug(f"Received tournament_canceled event: {event}")
@@ -253,7 +236,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         '''Handle the tournament_finished message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         logger.debug(f"Received tournament_finished event: {event}")
@@ -263,7 +246,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         '''Handle the tournament_schedule message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         logger.debug(f"Received tournament_schedule event: {event}")
@@ -273,7 +256,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
         '''Handle the tournament_drop_out message'''
 
         # Check if the current connection is the active connection (Current tab in the browser)
-        if not self._is_active_connection():
+        if not await self._is_active_connection():
             return
 
         logger.debug(f"Received tournament_drop_out event: {event}")
@@ -295,7 +278,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     async def _queue_unregister(self) -> None:
         '''Unregister user from matchmaking'''
         try:
-            MatchSessionHandler.remove_from_matchmaking_queue(self.user_id)
+            await MatchSessionHandler.remove_from_matchmaking_queue(self.user_id)
             await self._send_success_message('queue_unregistered')
         except ValueError as e:
             logger.error(f"Failed to unregister from matchmaking: {e}")
@@ -303,7 +286,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
 
     async def _queue_is_registered(self) -> None:
         '''Check if user is registered for matchmaking'''
-        is_registered = MatchmakingQueue.is_user_registered(self.user_id)
+        is_registered = await MatchmakingQueue.is_user_registered(self.user_id)
         if is_registered:
             await self._send_success_message('queue_is_registered')
         else:
@@ -326,7 +309,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     async def _tournament_create(self, msg: TournamentCreate) -> None:
         '''Create a tournament'''
         try:
-            tournament_id = TournamentSessionHandler.create_online_tournament_session(self.user_id, msg.name, msg.max_players)
+            tournament_id = await TournamentSessionHandler.create_online_tournament_session(self.user_id, msg.name, msg.max_players, msg.format or DEFAULT_FORMAT)
             self.send(text_data=json.dumps({
                 'tournament_created': True,
                 'tournament_id': tournament_id.get_id()
@@ -338,7 +321,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
     async def _tournament_register(self, msg: TournamentRegister) -> None:
         '''Register for a tournament'''
         try:
-            TournamentSessionHandler.add_user_to_tournament(msg.tournament_id, self.user_id)
+            await TournamentSessionHandler.add_user_to_tournament(msg.tournament_id, self.user_id)
             await self._send_success_message('tournament_registered')
         except ValueError as e:
             logger.error(f"Failed to register for tournament: {e}")
@@ -393,6 +376,7 @@ class MatchmakingConsumer(AsyncWebsocketConsumer):
                 'id': tournament.get_id(),
                 'name': tournament.get_name(),
                 'max_players': tournament.get_max_players(),
+                'format': tournament.get_format(),
                 'owner': tournament.get_owner_user_id(),
                 'users': list(tournament.get_users()),
                 'is_owner': self.user_id == tournament.get_owner_user_id()
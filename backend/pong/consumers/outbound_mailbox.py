@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+logger = logging.getLogger("match_consumer")
+
+class OutboundMailbox:
+    '''Outgoing messages of one connection, written by a single writer task
+
+    State snapshots overwrite each other, so a slow client always gets the latest state and no backlog
+    of stale frames builds up. Snapshots that depend on the previous one are combined with merge_snapshots
+    instead of being replaced. Control messages are kept in order and are never dropped.'''
+
+    def __init__(self, send: Callable[..., Awaitable[None]], merge_snapshots: Optional[Callable[[bytes, bytes], bytes]] = None) -> None:
+        self._send = send # send(text_data=..., bytes_data=...)
+        self._merge_snapshots = merge_snapshots # merge_snapshots(older, newer) -> snapshot
+        self._snapshot: Optional[bytes] = None
+        self._control: Deque[Tuple[Optional[str], Optional[bytes]]] = deque()
+        self._wakeup = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._sent_frames: int = 0
+        self._dropped_frames: int = 0
+        self._sent_control_messages: int = 0
+
+    def start(self) -> None:
+        '''Start the writer task'''
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    async def close(self) -> None:
+        '''Stop the writer task, messages that were not written yet are discarded'''
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+        self._drained.set() # Release anyone still waiting in drain()
+
+    def put_snapshot(self, bytes_data: bytes) -> None:
+        '''Queue a state snapshot, replacing the one that was not written yet'''
+        if self._snapshot is not None:
+            self._dropped_frames += 1
+            if self._merge_snapshots is not None:
+                bytes_data = self._merge_snapshots(self._snapshot, bytes_data)
+        self._snapshot = bytes_data
+        self._notify()
+
+    def put_control(self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> None:
+        '''Queue a control message behind the ones that were not written yet'''
+        self._control.append((text_data, bytes_data))
+        self._notify()
+
+    async def drain(self) -> None:
+        '''Wait until every queued message has been written'''
+        if self._writer_task is not None:
+            await self._drained.wait()
+
+    def _notify(self) -> None:
+        '''Wake up the writer'''
+        self._drained.clear()
+        self._wakeup.set()
+
+    async def _writer(self) -> None:
+        '''Write the control messages in order, then the latest snapshot'''
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._control or self._snapshot is not None:
+                if self._control:
+                    text_data, bytes_data = self._control.popleft()
+                    await self._send(text_data=text_data, bytes_data=bytes_data)
+                    self._sent_control_messages += 1
+                else:
+                    bytes_data = self._snapshot
+                    self._snapshot = None
+                    await self._send(bytes_data=bytes_data)
+                    self._sent_frames += 1
+            self._drained.set()
+
+    #############################
+    #         Metrics           #
+    #############################
+
+    def get_sent_frames(self) -> int:
+        '''Get the number of snapshots written to the connection'''
+        return self._sent_frames
+
+    def get_dropped_frames(self) -> int:
+        '''Get the number of snapshots replaced before they were written'''
+        return self._dropped_frames
+
+    def get_sent_control_messages(self) -> int:
+        '''Get the number of control messages written to the connection'''
+        return self._sent_control_messages
@@ -0,0 +1,125 @@
+import asyncio
+from typing import Optional
+from urllib.parse import parse_qs
+from uuid import UUID
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from ..match.match_recorder import MatchRecording, get_recording_path
+from ..match.protocol import FrameEncoder, merge_state_frames
+from .outbound_mailbox import OutboundMailbox
+
+import logging
+logger = logging.getLogger("match_consumer")
+
+SIMULATION_RATE = settings.MATCH_CONFIG['simulation_rate']
+SEND_RATE = settings.MATCH_CONFIG['send_rate']
+MAX_REPLAY_SPEED = 16
+
+class ReplayConsumer(AsyncWebsocketConsumer):
+    '''Streams a recorded match with the same frames as a MatchConsumer, re-simulated from its inputs'''
+
+    def __init__(self):
+        super().__init__()
+        self._match_id: str = None
+        self._user_id: int = None
+        self._speed: float = 1.0
+        self._mailbox: OutboundMailbox = OutboundMailbox(self.safe_send, merge_state_frames)
+        self._stream_task: Optional[asyncio.Task] = None
+        self._connection_established: bool = False
+
+    async def connect(self) -> None:
+        '''Establish the WebSocket connection and start streaming'''
+        self._match_id = self.scope['url_route']['kwargs']['match_id']
+        self._user_id = self.scope["user"].id
+        if self._user_id is None:
+            logger.debug("User not authenticated")
+            await self.close()
+            return
+
+        # Playback speed from the query string, e.g. ?speed=4
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            self._speed = min(max(float(query.get("speed", ["1"])[0]), 1.0), MAX_REPLAY_SPEED)
+        except ValueError:
+            self._speed = 1.0
+
+        recording = await self._load_recording()
+        if recording is None:
+            logger.debug(f"No recording for match {self._match_id}")
+            await self.close()
+            return
+        if not recording.is_viewable_by(self.scope["user"]):
+            logger.debug(f"User {self._user_id} is not allowed to replay match {self._match_id}")
+            await self.close()
+            return
+
+        await self.accept()
+        self._connection_established = True
+        self._mailbox.start()
+        self._stream_task = asyncio.create_task(self._stream(recording))
+
+    async def disconnect(self, close_code: int) -> None:
+        '''Stop streaming'''
+        if not self._connection_established:
+            return
+        self._connection_established = False
+        if self._stream_task is not None:
+            self._stream_task.cancel()
+        await self._mailbox.close()
+
+    async def receive(self, text_data: str = None, bytes_data: bytes = None) -> None:
+        '''A replay does not take any input'''
+        pass
+
+    async def _load_recording(self) -> Optional[MatchRecording]:
+        '''Read the recording without blocking the event loop'''
+        try:
+            UUID(self._match_id)
+            return await asyncio.get_running_loop().run_in_executor(None, MatchRecording.load, get_recording_path(self._match_id))
+        except (ValueError, OSError):
+            return None
+
+    async def _stream(self, recording: MatchRecording) -> None:
+        '''Re-simulate the match and send its frames paced at the playback speed'''
+        encoder = FrameEncoder()
+        self._mailbox.put_control(bytes_data=encoder.user_mapping(0, recording.user_id_2 is None, recording.user_id_1, recording.user_id_2,
+                                                                         SIMULATION_RATE * self._speed))
+        self._mailbox.put_control(bytes_data=encoder.player_scores(0, 0, 0))
+
+        score = [0, 0]
+        steps_per_frame = max(SIMULATION_RATE / SEND_RATE, 1)
+        next_frame_tick = 0.0
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        try:
+            for tick, state, scored in recording.replay():
+                if scored is not None:
+                    score[scored] += 1
+                    self._mailbox.put_control(bytes_data=encoder.player_scores(tick, score[0], score[1]))
+                if tick < next_frame_tick:
+                    encoder.skip_state(state)
+                    continue
+                next_frame_tick += steps_per_frame
+                self._mailbox.put_snapshot(encoder.state(tick, state))
+                # Sleep until the frame is due, measured from the start so the pace does not drift
+                delay = start_time + tick / SIMULATION_RATE / self._speed - loop.time()
+                await asyncio.sleep(max(delay, 0))
+        except ValueError as e:
+            logger.error(f"Cannot replay match {self._match_id}: {e}")
+
+        end = recording.get_end()
+        end_tick, winner = (end[0], end[2]) if end is not None else (0, None)
+        self._mailbox.put_control(bytes_data=encoder.game_over(end_tick, winner, None if winner is None else 1 - winner))
+        await self._mailbox.drain()
+        await self.close()
+
+    async def safe_send(self, text_data: str = None, bytes_data: bytes = None) -> None:
+        '''Send a message only if the connection is established, used by the mailbox writer'''
+        if self._connection_established:
+            try:
+                if text_data is not None:
+                    await self.send(text_data=text_data)
+                elif bytes_data is not None:
+                    await self.send(bytes_data=bytes_data)
+            except Exception as e:
+                logger.error(f"Failed to send message: {e}")
@@ -0,0 +1,92 @@
+from typing import Optional
+from channels.generic.websocket import AsyncWebsocketConsumer
+from ..match.match_session import MatchSession
+from ..match.protocol import STATE, STATE_DELTA, GAME_OVER, merge_state_frames
+from ..data_managment.matches import Matches
+from .outbound_mailbox import OutboundMailbox
+
+import logging
+logger = logging.getLogger("match_consumer")
+
+class SpectatorConsumer(AsyncWebsocketConsumer):
+    '''Watches a running match, receives the shared spectator stream of its MatchSession'''
+
+    def __init__(self):
+        super().__init__()
+        self._match_id: str = None
+        self._user_id: int = None
+        self._group_name: str = None
+        self._match_session: Optional[MatchSession] = None
+        self._connection_established: bool = False
+        self._has_keyframe: bool = False
+        self._mailbox: OutboundMailbox = OutboundMailbox(self.safe_send, merge_state_frames)
+
+    async def connect(self) -> None:
+        '''Establish the WebSocket connection and join the spectators of the match'''
+        self._match_id = self.scope['url_route']['kwargs']['match_id']
+        self._user_id = self.scope["user"].id
+
+        if self._user_id is None:
+            logger.debug("User not authenticated")
+            await self.close()
+            return
+        if not Matches.is_match_registered(self._match_id):
+            logger.debug(f"Match {self._match_id} not found")
+            await self.close()
+            return
+
+        self._match_session = Matches.get_match(self._match_id)
+        self._group_name = self._match_session.get_spectator_group()
+        await self.channel_layer.group_add(self._group_name, self.channel_name)
+        await self.accept()
+        self._connection_established = True
+        self._mailbox.start()
+        self._match_session.add_spectator()
+        logger.debug(f"User {self._user_id} spectates match {self._match_id}")
+
+    async def disconnect(self, close_code: int) -> None:
+        '''Leave the spectators of the match'''
+        if not self._connection_established:
+            return
+        self._connection_established = False
+        await self._mailbox.close()
+        await self.channel_layer.group_discard(self._group_name, self.channel_name)
+        if self._match_session is not None:
+            self._match_session.remove_spectator()
+            self._match_session = None
+
+    async def receive(self, text_data: str = None, bytes_data: bytes = None) -> None:
+        '''Spectators do not send any input'''
+        pass
+
+    ### Channel Layer Callbacks ###
+
+    async def spectator_frame(self, event) -> None:
+        '''Queue a frame of the spectator stream'''
+        frame = event.get("data")
+        if not frame:
+            return
+        message_type = frame[1]
+        if message_type == STATE:
+            self._has_keyframe = True
+            self._mailbox.put_snapshot(frame)
+        elif message_type == STATE_DELTA:
+            # Deltas sent before this spectator joined have nothing to apply to
+            if self._has_keyframe:
+                self._mailbox.put_snapshot(frame)
+        else:
+            self._mailbox.put_control(bytes_data=frame)
+            if message_type == GAME_OVER:
+                await self._mailbox.drain()
+                await self.close()
+
+    async def safe_send(self, text_data: str = None, bytes_data: bytes = None) -> None:
+        '''Send a message only if the connection is established, used by the mailbox writer'''
+        if self._connection_established:
+            try:
+                if text_data is not None:
+                    await self.send(text_data=text_data)
+                elif bytes_data is not None:
+                    await self.send(bytes_data=bytes_data)
+            except Exception as e:
+                logger.error(f"Failed to send message: {e}")
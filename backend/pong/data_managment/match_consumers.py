@@ -0,0 +1,38 @@
+from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+import logging
+
+if TYPE_CHECKING:
+    from ..consumers.match_consumer import MatchConsumer
+
+logger = logging.getLogger("data_managment")
+
+class MatchConsumers:
+    '''MatchConsumers that live in this process, used to deliver match updates without the channel layer'''
+    consumers: Dict[str, Dict['MatchConsumer', int]] = {} # match_id -> {consumer: user_id}
+
+    @classmethod
+    def add_consumer(cls, match_id: str, user_id: int, consumer: 'MatchConsumer') -> None:
+        '''Register a connected consumer of a match'''
+        cls.consumers.setdefault(match_id, {})[consumer] = user_id
+
+    @classmethod
+    def remove_consumer(cls, match_id: str, consumer: 'MatchConsumer') -> None:
+        '''Unregister a consumer of a match'''
+        match_consumers = cls.consumers.get(match_id)
+        if match_consumers is None:
+            return
+        match_consumers.pop(consumer, None)
+        if not match_consumers:
+            del cls.consumers[match_id]
+
+    @classmethod
+    def get_local_consumers(cls, match_id: str, user_ids: Iterable[int]) -> Optional[List['MatchConsumer']]:
+        '''Get the local consumers of a match if every given user is connected through one, otherwise None'''
+        match_consumers = cls.consumers.get(match_id)
+        if match_consumers is None:
+            return None
+        local_users = set(match_consumers.values())
+        for user_id in user_ids:
+            if user_id not in local_users:
+                return None
+        return list(match_consumers)
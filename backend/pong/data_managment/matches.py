@@ -1,61 +1,103 @@
 from typing import Dict, Optional
 from ..match.match_session import MatchSession
+from ..match.match_relay import MatchRelay
+from .registry_backend import NODE_ID, get_registry_backend, is_node_alive, start_heartbeat
 import logging
 import sys
 
 logger = logging.getLogger("data_managment")
 
+USER_MATCH = "pong:user_match"      # user_id -> match_id
+MATCH_OWNER = "pong:match_owner"    # match_id -> node that runs the match
+
 class Matches:
-    matches: Dict[str, MatchSession] = {}
+    '''Matches of every node, the sessions themselves live in the node that owns them'''
+    matches: Dict[str, MatchSession] = {} # Sessions owned by this node
 
     @classmethod
-    def add_match(cls, match: MatchSession) -> None:
+    async def add_match(cls, match: MatchSession) -> None:
         match_id = match.get_id()
+        backend = get_registry_backend()
         cls.matches[match_id] = match
+        await start_heartbeat()
+        MatchRelay.get_instance().start() # Lets the consumers of other nodes reach the match
+        # The owner is set before the users, so a user entry never points to a match without one
+        await backend.hash_set(MATCH_OWNER, match_id, NODE_ID)
+        for user_id in match.get_assigned_users():
+            previous_match_id = await backend.hash_get(USER_MATCH, str(user_id))
+            if previous_match_id is not None and previous_match_id != match_id:
+                logger.warning(f"User {user_id} is still assigned to match {previous_match_id}")
+            await backend.hash_set(USER_MATCH, str(user_id), match_id)
 
     @classmethod
     def get_match(cls, match_id: str) -> MatchSession:
         return cls.matches.get(match_id)
 
     @classmethod
-    def remove_match(cls, match_id: str) -> bool:
-        if match_id in cls.matches:
-            logger.debug(f"Removing match {match_id}")
-            logger.debug(f"Match refcount: {sys.getrefcount(cls.matches[match_id])}")
-            del cls.matches[match_id]
-            logger.info(f"Match {match_id} removed")
-            return True
-        return False
+    async def remove_match(cls, match_id: str) -> bool:
+        match = cls.matches.pop(match_id, None)
+        if match is None:
+            return False
+        logger.debug(f"Removing match {match_id}")
+        logger.debug(f"Match refcount: {sys.getrefcount(match)}")
+        backend = get_registry_backend()
+        for user_id in match.get_assigned_users():
+            await backend.hash_delete(USER_MATCH, str(user_id), expected=match_id)
+        await backend.hash_delete(MATCH_OWNER, match_id, expected=NODE_ID)
+        logger.info(f"Match {match_id} removed")
+        return True
 
     @classmethod
     def get_matches(cls) -> Dict[str, MatchSession]:
         return cls.matches
-    
-    @classmethod
-    def get_user_match_id(cls, user_id: int) -> Optional[str]:
-        '''Get the match id of a user'''
-        for match in cls.matches.values():
-            if match.is_user_assigned(user_id):
-                return match.get_id()
-        return None
-    
-    @classmethod
-    def is_user_registered(cls, user_id: int) -> bool:
-        '''Check if a user is registered to a match or the matchmaking queue'''
-        for match in cls.matches.values():
-            if match.is_user_assigned(user_id):
-                return True
-        return False
-    
+
+    @classmethod
+    async def get_user_match_id(cls, user_id: int) -> Optional[str]:
+        '''Get the match id of a user, on any node'''
+        backend = get_registry_backend()
+        match_id = await backend.hash_get(USER_MATCH, str(user_id))
+        if match_id is None:
+            return None
+        if not await is_node_alive(await cls.get_owner(match_id)):
+            # The node that ran the match is gone, the match went with it
+            logger.warning(f"Dropping match {match_id} of user {user_id}, its node is gone")
+            await backend.hash_delete(USER_MATCH, str(user_id), expected=match_id)
+            return None
+        return match_id
+
+    @classmethod
+    async def is_user_registered(cls, user_id: int) -> bool:
+        '''Check if a user is registered to a match, on any node'''
+        return await cls.get_user_match_id(user_id) is not None
+
     @classmethod
     def is_match_registered(cls, match_id: str) -> bool:
-        '''Check if a match is registered'''
+        '''Check if a match is registered on this node'''
         return match_id in cls.matches
 
+    @classmethod
+    async def get_owner(cls, match_id: str) -> Optional[str]:
+        '''Get the node that runs a match, None if the match does not exist'''
+        return await get_registry_backend().hash_get(MATCH_OWNER, match_id)
+
     @classmethod
     def is_user_assigned_to_match(cls, match_id: str, user_id: int) -> bool:
         '''Check if a user is assigned to a match'''
         match = cls.get_match(match_id)
         if match:
             return match.is_user_assigned(user_id)
-        return False
\ No newline at end of file
+        return False
+
+    @classmethod
+    async def is_index_consistent(cls) -> bool:
+        '''Check that the shared entries of this node match the assigned users of its matches'''
+        backend = get_registry_backend()
+        owned = {match_id for match_id, node_id in (await backend.hash_items(MATCH_OWNER)).items() if node_id == NODE_ID}
+        if owned != set(cls.matches):
+            return False
+        expected = {}
+        for match_id, match in cls.matches.items():
+            for user_id in match.get_assigned_users():
+                expected[str(user_id)] = match_id
+        actual = {user_id: match_id for user_id, match_id in (await backend.hash_items(USER_MATCH)).items() if match_id in owned}
+        return expected == actual
@@ -1,43 +1,143 @@
-from typing import Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
+from django.conf import settings
+from .registry_backend import get_registry_backend
 import logging
 
 logger = logging.getLogger("data_managment")
 
+BUCKET_SIZE = settings.MATCHMAKING_CONFIG['bucket_size']
+INITIAL_WINDOW = settings.MATCHMAKING_CONFIG['initial_window']
+WINDOW_GROWTH = settings.MATCHMAKING_CONFIG['window_growth']
+MAX_WINDOW = settings.MATCHMAKING_CONFIG['max_window']
+
+USERS = "pong:matchmaking_users"        # user_id -> "rating:queued since"
+BUCKETS = "pong:matchmaking_buckets"    # ids of the buckets that were used
+BUCKET = "pong:matchmaking_bucket:"     # + bucket id, sorted set of user ids by the time they were queued
+
+# A queued user: user id, rating, queued since
+QueueEntry = Tuple[int, float, float]
+
 class MatchmakingQueue:
-    queue: Set[str] = set()
+    '''Users waiting for a remote match, shared by every node
+
+    Users are kept in buckets of similar rating, each in the order they were queued. A user accepts
+    opponents within a rating window that widens the longer they wait. Only the two oldest users of
+    every bucket are compared, so finding a pair costs the number of buckets, not the number of users.'''
 
     @classmethod
-    def add_to_queue(cls, user_id: int) -> None:
+    async def add_to_queue(cls, user_id: int, rating: float, now: float) -> None:
         '''Add a user to the matchmaking queue'''
-        cls.queue.add(user_id)
-        logger.info(f"User {user_id} added to matchmaking queue")
+        backend = get_registry_backend()
+        bucket = cls._get_bucket(rating)
+        await backend.hash_set(USERS, str(user_id), f"{rating}:{now}")
+        await backend.set_add(BUCKETS, str(bucket))
+        await backend.sorted_set_add(BUCKET + str(bucket), str(user_id), now)
+        logger.info(f"User {user_id} with rating {rating} added to matchmaking queue")
 
     @classmethod
-    def remove_from_queue(cls, user_id: int) -> bool:
+    async def remove_from_queue(cls, user_id: int) -> bool:
         '''Remove a user from the matchmaking queue'''
-        if user_id in cls.queue:
-            cls.queue.remove(user_id)
-            return True
-        return False
+        backend = get_registry_backend()
+        entry = await backend.hash_get(USERS, str(user_id))
+        if entry is None:
+            return False
+        rating, _ = cls._parse_entry(entry)
+        await backend.sorted_set_remove(BUCKET + str(cls._get_bucket(rating)), str(user_id))
+        return await backend.hash_delete(USERS, str(user_id), expected=entry)
 
     @classmethod
-    def get_queue(cls) -> set:
+    async def get_queue(cls) -> Set[int]:
         '''Get the matchmaking queue'''
-        return cls.queue
-    
+        return {int(user_id) for user_id in await get_registry_backend().hash_items(USERS)}
+
     @classmethod
-    def get_queue_length(cls) -> int:
+    async def get_queue_length(cls) -> int:
         '''Get the length of the matchmaking queue'''
-        return len(cls.queue)
-    
+        return await get_registry_backend().hash_size(USERS)
+
     @classmethod
-    def is_user_registered(cls, user_id: int) -> bool:
+    async def is_user_registered(cls, user_id: int) -> bool:
         '''Check if a user is registered for the matchmaking queue'''
-        return user_id in cls.queue
-    
-    @classmethod
-    def pop_next_user(cls) -> Optional[str]:
-        '''Pop the next user from the queue'''
-        if cls.queue:
-            return cls.queue.pop()
-        return None
\ No newline at end of file
+        return await get_registry_backend().hash_get(USERS, str(user_id)) is not None
+
+    @classmethod
+    def get_window(cls, queued_since: float, now: float) -> float:
+        '''Get the accepted rating gap of a user that waits since queued_since'''
+        return min(INITIAL_WINDOW + WINDOW_GROWTH * max(now - queued_since, 0), MAX_WINDOW)
+
+    @classmethod
+    async def pop_pairs(cls, now: float) -> List[Tuple[int, int]]:
+        '''Take every pair of users that can play each other, the users that waited longest are served first'''
+        backend = get_registry_backend()
+        heads = {int(bucket): await cls._get_bucket_head(int(bucket)) for bucket in await backend.set_members(BUCKETS)}
+        pairs = []
+        while True:
+            pair = cls._find_pair(heads, now)
+            if pair is None:
+                break
+            user, opponent = pair
+            if await cls._take(user, opponent):
+                pairs.append((user[0], opponent[0]))
+            # Taken or changed by another node in the meantime, reload the buckets either way
+            for bucket in {cls._get_bucket(user[1]), cls._get_bucket(opponent[1])}:
+                heads[bucket] = await cls._get_bucket_head(bucket)
+        return pairs
+
+    @classmethod
+    def _find_pair(cls, heads: Dict[int, List[QueueEntry]], now: float) -> Optional[Tuple[QueueEntry, QueueEntry]]:
+        '''Find an opponent for the oldest user that has one within their window'''
+        oldest_users = sorted((entries[0] for entries in heads.values() if entries), key=lambda entry: entry[2])
+        for user in oldest_users:
+            _, rating, queued_since = user
+            window = cls.get_window(queued_since, now)
+            best = None
+            for bucket in range(cls._get_bucket(rating - window), cls._get_bucket(rating + window) + 1):
+                entries = heads.get(bucket)
+                if not entries:
+                    continue
+                # The oldest user of another bucket, or the next one in the own bucket
+                candidate = entries[0] if entries[0] is not user else (entries[1] if len(entries) > 1 else None)
+                if candidate is None:
+                    continue
+                gap = abs(candidate[1] - rating)
+                if gap <= window and (best is None or (gap, candidate[2]) < (abs(best[1] - rating), best[2])):
+                    best = candidate
+            if best is not None:
+                return user, best
+        return None
+
+    @classmethod
+    async def _take(cls, user: QueueEntry, opponent: QueueEntry) -> bool:
+        '''Remove both users from the queue, fails without change if another node took one of them first'''
+        backend = get_registry_backend()
+        user_bucket = BUCKET + str(cls._get_bucket(user[1]))
+        if not await backend.sorted_set_remove(user_bucket, str(user[0])):
+            return False
+        if not await backend.sorted_set_remove(BUCKET + str(cls._get_bucket(opponent[1])), str(opponent[0])):
+            await backend.sorted_set_add(user_bucket, str(user[0]), user[2]) # Back to its place in the bucket
+            return False
+        await backend.hash_delete(USERS, str(user[0]))
+        await backend.hash_delete(USERS, str(opponent[0]))
+        return True
+
+    @classmethod
+    async def _get_bucket_head(cls, bucket: int) -> List[QueueEntry]:
+        '''Get the two users of a bucket that were queued first'''
+        backend = get_registry_backend()
+        head = []
+        for user_id, queued_since in await backend.sorted_set_first(BUCKET + str(bucket), 2):
+            entry = await backend.hash_get(USERS, user_id)
+            if entry is not None:
+                head.append((int(user_id), cls._parse_entry(entry)[0], queued_since))
+        return head
+
+    @staticmethod
+    def _get_bucket(rating: float) -> int:
+        '''Get the bucket of a rating'''
+        return int(rating // BUCKET_SIZE)
+
+    @staticmethod
+    def _parse_entry(entry: str) -> Tuple[float, float]:
+        '''Get the rating and the queue time of a user entry'''
+        rating, queued_since = entry.split(":")
+        return float(rating), float(queued_since)
@@ -0,0 +1,608 @@
+'''Storage behind the registries that have to be shared by every node (daphne process)
+
+The sessions themselves stay in the process that runs them, the backend only holds the indexes
+(which user is in which match, who owns a match, the matchmaking queue, the open connections).
+Keys and values are strings. Every operation is atomic on its own, the compare-and-delete runs
+as a Lua script on Redis.
+
+The registries run on the event loop, so they use the awaitable AsyncRegistryBackend. The blocking
+RegistryBackend is left to the synchronous code, e.g. the leaderboard of the views and commands.'''
+
+import asyncio
+import bisect
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+from django.conf import settings
+
+logger = logging.getLogger("data_managment")
+
+REGISTRY_BACKEND = settings.REGISTRY_CONFIG['backend']
+NODE_TIMEOUT = settings.REGISTRY_CONFIG['node_timeout']
+HEARTBEAT_INTERVAL = NODE_TIMEOUT / 3
+
+# Identifies this process, set NODE_ID to keep it stable across restarts
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+NODE_KEY = "registry:node:"
+
+
+class RegistryBackend(ABC):
+    '''Hashes, sets and sorted sets of strings'''
+
+    is_shared: bool = False # True if other nodes see the same data
+
+    @abstractmethod
+    def hash_get(self, name: str, key: str) -> Optional[str]:
+        '''Get a field of a hash'''
+
+    @abstractmethod
+    def hash_set(self, name: str, key: str, value: str) -> None:
+        '''Set a field of a hash'''
+
+    @abstractmethod
+    def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        '''Set a field of a hash if it does not exist yet, returns True if it was set'''
+
+    @abstractmethod
+    def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        '''Delete a field of a hash, only if it still has the expected value if one is given'''
+
+    @abstractmethod
+    def hash_increment(self, name: str, key: str, amount: int) -> int:
+        '''Add to an integer field of a hash, returns the new value'''
+
+    @abstractmethod
+    def hash_items(self, name: str) -> Dict[str, str]:
+        '''Get every field of a hash'''
+
+    @abstractmethod
+    def hash_size(self, name: str) -> int:
+        '''Get the number of fields of a hash'''
+
+    @abstractmethod
+    def hash_get_many(self, name: str, keys: List[str]) -> List[Optional[str]]:
+        '''Get several fields of a hash, None for the missing ones'''
+
+    @abstractmethod
+    def hash_set_many(self, name: str, fields: Dict[str, str]) -> None:
+        '''Set several fields of a hash'''
+
+    @abstractmethod
+    def set_add(self, name: str, member: str) -> bool:
+        '''Add a member to a set, returns True if it was not in the set'''
+
+    @abstractmethod
+    def set_remove(self, name: str, member: str) -> bool:
+        '''Remove a member from a set, returns True if it was in the set'''
+
+    @abstractmethod
+    def set_members(self, name: str) -> Set[str]:
+        '''Get the members of a set'''
+
+    @abstractmethod
+    def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        '''Add a member to a sorted set or change its score'''
+
+    @abstractmethod
+    def sorted_set_remove(self, name: str, member: str) -> bool:
+        '''Remove a member from a sorted set, returns True if it was in the set'''
+
+    @abstractmethod
+    def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        '''Get the count members with the lowest scores, lowest first'''
+
+    @abstractmethod
+    def sorted_set_add_many(self, name: str, scores: Dict[str, float]) -> None:
+        '''Add several members to a sorted set or change their scores'''
+
+    @abstractmethod
+    def sorted_set_size(self, name: str) -> int:
+        '''Get the number of members of a sorted set'''
+
+    @abstractmethod
+    def sorted_set_rank(self, name: str, member: str, reverse: bool = False) -> Optional[int]:
+        '''Get the 0 based position of a member, counted from the highest score if reverse, None if it is not in the set'''
+
+    @abstractmethod
+    def sorted_set_range(self, name: str, start: int, count: int, reverse: bool = False) -> List[Tuple[str, float]]:
+        '''Get count members from position start on, counted from the highest score if reverse'''
+
+    @abstractmethod
+    def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        '''Set a key that expires after ttl seconds'''
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        '''Check if a key set with set_expiring exists'''
+
+    @abstractmethod
+    def delete(self, name: str) -> None:
+        '''Delete a hash, set or sorted set'''
+
+    @abstractmethod
+    def rename(self, name: str, new_name: str) -> None:
+        '''Replace new_name with the hash, set or sorted set name, atomically'''
+
+
+class MemoryRegistryBackend(RegistryBackend):
+    '''Backend for a single process'''
+
+    def __init__(self) -> None:
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._sets: Dict[str, Set[str]] = {}
+        self._sorted_sets: Dict[str, Tuple[Dict[str, float], List[Tuple[float, str]]]] = {} # name -> (scores, ordered entries)
+        self._expiring: Dict[str, float] = {} # key -> expiry time
+
+    def hash_get(self, name: str, key: str) -> Optional[str]:
+        return self._hashes.get(name, {}).get(key)
+
+    def hash_set(self, name: str, key: str, value: str) -> None:
+        self._hashes.setdefault(name, {})[key] = value
+
+    def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        fields = self._hashes.setdefault(name, {})
+        if key in fields:
+            return False
+        fields[key] = value
+        return True
+
+    def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        fields = self._hashes.get(name)
+        if fields is None or key not in fields or (expected is not None and fields[key] != expected):
+            return False
+        del fields[key]
+        if not fields:
+            del self._hashes[name]
+        return True
+
+    def hash_increment(self, name: str, key: str, amount: int) -> int:
+        fields = self._hashes.setdefault(name, {})
+        value = int(fields.get(key, 0)) + amount
+        fields[key] = str(value)
+        return value
+
+    def hash_items(self, name: str) -> Dict[str, str]:
+        return dict(self._hashes.get(name, {}))
+
+    def hash_size(self, name: str) -> int:
+        return len(self._hashes.get(name, ()))
+
+    def hash_get_many(self, name: str, keys: List[str]) -> List[Optional[str]]:
+        fields = self._hashes.get(name, {})
+        return [fields.get(key) for key in keys]
+
+    def hash_set_many(self, name: str, fields: Dict[str, str]) -> None:
+        if fields:
+            self._hashes.setdefault(name, {}).update(fields)
+
+    def set_add(self, name: str, member: str) -> bool:
+        members = self._sets.setdefault(name, set())
+        if member in members:
+            return False
+        members.add(member)
+        return True
+
+    def set_remove(self, name: str, member: str) -> bool:
+        members = self._sets.get(name)
+        if members is None or member not in members:
+            return False
+        members.remove(member)
+        if not members:
+            del self._sets[name]
+        return True
+
+    def set_members(self, name: str) -> Set[str]:
+        return set(self._sets.get(name, ()))
+
+    def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        self.sorted_set_remove(name, member)
+        scores, entries = self._sorted_sets.setdefault(name, ({}, []))
+        scores[member] = score
+        bisect.insort(entries, (score, member))
+
+    def sorted_set_remove(self, name: str, member: str) -> bool:
+        sorted_set = self._sorted_sets.get(name)
+        if sorted_set is None or member not in sorted_set[0]:
+            return False
+        scores, entries = sorted_set
+        del entries[bisect.bisect_left(entries, (scores.pop(member), member))]
+        if not scores:
+            del self._sorted_sets[name]
+        return True
+
+    def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        sorted_set = self._sorted_sets.get(name)
+        if sorted_set is None:
+            return []
+        return [(member, score) for score, member in sorted_set[1][:count]]
+
+    def sorted_set_add_many(self, name: str, scores: Dict[str, float]) -> None:
+        for member, score in scores.items():
+            self.sorted_set_add(name, member, score)
+
+    def sorted_set_size(self, name: str) -> int:
+        sorted_set = self._sorted_sets.get(name)
+        return len(sorted_set[0]) if sorted_set is not None else 0
+
+    def sorted_set_rank(self, name: str, member: str, reverse: bool = False) -> Optional[int]:
+        sorted_set = self._sorted_sets.get(name)
+        if sorted_set is None or member not in sorted_set[0]:
+            return None
+        scores, entries = sorted_set
+        rank = bisect.bisect_left(entries, (scores[member], member))
+        return len(entries) - 1 - rank if reverse else rank
+
+    def sorted_set_range(self, name: str, start: int, count: int, reverse: bool = False) -> List[Tuple[str, float]]:
+        sorted_set = self._sorted_sets.get(name)
+        if sorted_set is None or count <= 0:
+            return []
+        entries = sorted_set[1]
+        if reverse:
+            selected = reversed(entries[max(len(entries) - start - count, 0):max(len(entries) - start, 0)])
+        else:
+            selected = entries[start:start + count]
+        return [(member, score) for score, member in selected]
+
+    def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        self._expiring[key] = time.monotonic() + ttl
+
+    def exists(self, key: str) -> bool:
+        return self._expiring.get(key, 0) > time.monotonic()
+
+    def delete(self, name: str) -> None:
+        for store in (self._hashes, self._sets, self._sorted_sets):
+            store.pop(name, None)
+
+    def rename(self, name: str, new_name: str) -> None:
+        self.delete(new_name)
+        for store in (self._hashes, self._sets, self._sorted_sets):
+            if name in store:
+                store[new_name] = store.pop(name)
+
+
+class RedisRegistryBackend(RegistryBackend):
+    '''Backend shared by every node through the Redis server of the cache'''
+
+    is_shared = True
+
+    _HASH_DELETE_IF_EQUAL = """
+        if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+            return redis.call('HDEL', KEYS[1], ARGV[1])
+        end
+        return 0
+    """
+
+    def __init__(self) -> None:
+        from django_redis import get_redis_connection
+        self._redis = get_redis_connection("default")
+        self._hash_delete_if_equal = self._redis.register_script(self._HASH_DELETE_IF_EQUAL)
+
+    @staticmethod
+    def _decode(value: Optional[bytes]) -> Optional[str]:
+        return value.decode() if value is not None else None
+
+    def hash_get(self, name: str, key: str) -> Optional[str]:
+        return self._decode(self._redis.hget(name, key))
+
+    def hash_set(self, name: str, key: str, value: str) -> None:
+        self._redis.hset(name, key, value)
+
+    def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        return bool(self._redis.hsetnx(name, key, value))
+
+    def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        if expected is None:
+            return bool(self._redis.hdel(name, key))
+        return bool(self._hash_delete_if_equal(keys=[name], args=[key, expected]))
+
+    def hash_increment(self, name: str, key: str, amount: int) -> int:
+        return int(self._redis.hincrby(name, key, amount))
+
+    def hash_items(self, name: str) -> Dict[str, str]:
+        return {key.decode(): value.decode() for key, value in self._redis.hgetall(name).items()}
+
+    def hash_size(self, name: str) -> int:
+        return int(self._redis.hlen(name))
+
+    def hash_get_many(self, name: str, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return [self._decode(value) for value in self._redis.hmget(name, keys)]
+
+    def hash_set_many(self, name: str, fields: Dict[str, str]) -> None:
+        if fields:
+            self._redis.hset(name, mapping=fields)
+
+    def set_add(self, name: str, member: str) -> bool:
+        return bool(self._redis.sadd(name, member))
+
+    def set_remove(self, name: str, member: str) -> bool:
+        return bool(self._redis.srem(name, member))
+
+    def set_members(self, name: str) -> Set[str]:
+        return {member.decode() for member in self._redis.smembers(name)}
+
+    def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        self._redis.zadd(name, {member: score})
+
+    def sorted_set_remove(self, name: str, member: str) -> bool:
+        return bool(self._redis.zrem(name, member))
+
+    def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        return [(member.decode(), score) for member, score in self._redis.zrange(name, 0, count - 1, withscores=True)]
+
+    def sorted_set_add_many(self, name: str, scores: Dict[str, float]) -> None:
+        if scores:
+            self._redis.zadd(name, scores)
+
+    def sorted_set_size(self, name: str) -> int:
+        return int(self._redis.zcard(name))
+
+    def sorted_set_rank(self, name: str, member: str, reverse: bool = False) -> Optional[int]:
+        return self._redis.zrevrank(name, member) if reverse else self._redis.zrank(name, member)
+
+    def sorted_set_range(self, name: str, start: int, count: int, reverse: bool = False) -> List[Tuple[str, float]]:
+        if count <= 0:
+            return []
+        entries = self._redis.zrange(name, start, start + count - 1, desc=reverse, withscores=True)
+        return [(member.decode(), score) for member, score in entries]
+
+    def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        self._redis.set(key, value, px=int(ttl * 1000))
+
+    def exists(self, key: str) -> bool:
+        return bool(self._redis.exists(key))
+
+    def delete(self, name: str) -> None:
+        self._redis.delete(name)
+
+    def rename(self, name: str, new_name: str) -> None:
+        # RENAME fails on a missing key, an empty hash or set does not exist in Redis
+        if self._redis.exists(name):
+            self._redis.rename(name, new_name)
+        else:
+            self._redis.delete(new_name)
+
+
+class AsyncRegistryBackend(ABC):
+    '''The operations of a RegistryBackend that the registries use, awaited instead of blocking the event loop'''
+
+    is_shared: bool = False # True if other nodes see the same data
+
+    @abstractmethod
+    async def hash_get(self, name: str, key: str) -> Optional[str]:
+        '''Get a field of a hash'''
+
+    @abstractmethod
+    async def hash_set(self, name: str, key: str, value: str) -> None:
+        '''Set a field of a hash'''
+
+    @abstractmethod
+    async def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        '''Set a field of a hash if it does not exist yet, returns True if it was set'''
+
+    @abstractmethod
+    async def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        '''Delete a field of a hash, only if it still has the expected value if one is given'''
+
+    @abstractmethod
+    async def hash_increment(self, name: str, key: str, amount: int) -> int:
+        '''Add to an integer field of a hash, returns the new value'''
+
+    @abstractmethod
+    async def hash_items(self, name: str) -> Dict[str, str]:
+        '''Get every field of a hash'''
+
+    @abstractmethod
+    async def hash_size(self, name: str) -> int:
+        '''Get the number of fields of a hash'''
+
+    @abstractmethod
+    async def set_add(self, name: str, member: str) -> bool:
+        '''Add a member to a set, returns True if it was not in the set'''
+
+    @abstractmethod
+    async def set_remove(self, name: str, member: str) -> bool:
+        '''Remove a member from a set, returns True if it was in the set'''
+
+    @abstractmethod
+    async def set_members(self, name: str) -> Set[str]:
+        '''Get the members of a set'''
+
+    @abstractmethod
+    async def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        '''Add a member to a sorted set or change its score'''
+
+    @abstractmethod
+    async def sorted_set_remove(self, name: str, member: str) -> bool:
+        '''Remove a member from a sorted set, returns True if it was in the set'''
+
+    @abstractmethod
+    async def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        '''Get the count members with the lowest scores, lowest first'''
+
+    @abstractmethod
+    async def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        '''Set a key that expires after ttl seconds'''
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        '''Check if a key set with set_expiring exists'''
+
+
+class AsyncMemoryRegistryBackend(AsyncRegistryBackend):
+    '''Backend for a single process, nothing to wait for'''
+
+    def __init__(self) -> None:
+        self._backend = MemoryRegistryBackend()
+
+    async def hash_get(self, name: str, key: str) -> Optional[str]:
+        return self._backend.hash_get(name, key)
+
+    async def hash_set(self, name: str, key: str, value: str) -> None:
+        self._backend.hash_set(name, key, value)
+
+    async def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        return self._backend.hash_set_if_absent(name, key, value)
+
+    async def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        return self._backend.hash_delete(name, key, expected)
+
+    async def hash_increment(self, name: str, key: str, amount: int) -> int:
+        return self._backend.hash_increment(name, key, amount)
+
+    async def hash_items(self, name: str) -> Dict[str, str]:
+        return self._backend.hash_items(name)
+
+    async def hash_size(self, name: str) -> int:
+        return self._backend.hash_size(name)
+
+    async def set_add(self, name: str, member: str) -> bool:
+        return self._backend.set_add(name, member)
+
+    async def set_remove(self, name: str, member: str) -> bool:
+        return self._backend.set_remove(name, member)
+
+    async def set_members(self, name: str) -> Set[str]:
+        return self._backend.set_members(name)
+
+    async def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        self._backend.sorted_set_add(name, member, score)
+
+    async def sorted_set_remove(self, name: str, member: str) -> bool:
+        return self._backend.sorted_set_remove(name, member)
+
+    async def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        return self._backend.sorted_set_first(name, count)
+
+    async def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        self._backend.set_expiring(key, value, ttl)
+
+    async def exists(self, key: str) -> bool:
+        return self._backend.exists(key)
+
+
+class AsyncRedisRegistryBackend(AsyncRegistryBackend):
+    '''Backend shared by every node through the Redis server of the cache, with the asyncio client of redis-py'''
+
+    is_shared = True
+
+    def __init__(self) -> None:
+        from redis.asyncio import Redis
+        self._redis = Redis.from_url(settings.CACHES["default"]["LOCATION"])
+        self._hash_delete_if_equal = self._redis.register_script(RedisRegistryBackend._HASH_DELETE_IF_EQUAL)
+
+    @staticmethod
+    def _decode(value: Optional[bytes]) -> Optional[str]:
+        return value.decode() if value is not None else None
+
+    async def hash_get(self, name: str, key: str) -> Optional[str]:
+        return self._decode(await self._redis.hget(name, key))
+
+    async def hash_set(self, name: str, key: str, value: str) -> None:
+        await self._redis.hset(name, key, value)
+
+    async def hash_set_if_absent(self, name: str, key: str, value: str) -> bool:
+        return bool(await self._redis.hsetnx(name, key, value))
+
+    async def hash_delete(self, name: str, key: str, expected: Optional[str] = None) -> bool:
+        if expected is None:
+            return bool(await self._redis.hdel(name, key))
+        return bool(await self._hash_delete_if_equal(keys=[name], args=[key, expected]))
+
+    async def hash_increment(self, name: str, key: str, amount: int) -> int:
+        return int(await self._redis.hincrby(name, key, amount))
+
+    async def hash_items(self, name: str) -> Dict[str, str]:
+        return {key.decode(): value.decode() for key, value in (await self._redis.hgetall(name)).items()}
+
+    async def hash_size(self, name: str) -> int:
+        return int(await self._redis.hlen(name))
+
+    async def set_add(self, name: str, member: str) -> bool:
+        return bool(await self._redis.sadd(name, member))
+
+    async def set_remove(self, name: str, member: str) -> bool:
+        return bool(await self._redis.srem(name, member))
+
+    async def set_members(self, name: str) -> Set[str]:
+        return {member.decode() for member in await self._redis.smembers(name)}
+
+    async def sorted_set_add(self, name: str, member: str, score: float) -> None:
+        await self._redis.zadd(name, {member: score})
+
+    async def sorted_set_remove(self, name: str, member: str) -> bool:
+        return bool(await self._redis.zrem(name, member))
+
+    async def sorted_set_first(self, name: str, count: int) -> List[Tuple[str, float]]:
+        return [(member.decode(), score) for member, score in await self._redis.zrange(name, 0, count - 1, withscores=True)]
+
+    async def set_expiring(self, key: str, value: str, ttl: float) -> None:
+        await self._redis.set(key, value, px=int(ttl * 1000))
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self._redis.exists(key))
+
+
+# Blocking backends, for the leaderboard
+BACKENDS = {
+    "memory": MemoryRegistryBackend,
+    "redis": RedisRegistryBackend,
+}
+
+# Awaitable backends, for the registries
+ASYNC_BACKENDS = {
+    "memory": AsyncMemoryRegistryBackend,
+    "redis": AsyncRedisRegistryBackend,
+}
+
+_backend: Optional[AsyncRegistryBackend] = None
+_heartbeat_task: Optional[asyncio.Task] = None
+
+def get_registry_backend() -> AsyncRegistryBackend:
+    '''Get the configured backend, created on first use'''
+    global _backend
+    if _backend is None:
+        if REGISTRY_BACKEND not in ASYNC_BACKENDS:
+            raise ValueError(f"Unknown registry backend {REGISTRY_BACKEND}")
+        _backend = ASYNC_BACKENDS[REGISTRY_BACKEND]()
+        logger.info(f"Registry backend {REGISTRY_BACKEND} on node {NODE_ID}")
+    return _backend
+
+def set_registry_backend(backend: AsyncRegistryBackend) -> None:
+    '''Replace the backend, e.g. with a fresh one in tests'''
+    global _backend
+    _backend = backend
+
+#############################
+#      Node liveness        #
+#############################
+
+async def start_heartbeat() -> None:
+    '''Keep announcing this node while it owns sessions, so other nodes can tell its entries are not stale'''
+    global _heartbeat_task
+    if not get_registry_backend().is_shared or _heartbeat_task is not None:
+        return
+    _heartbeat_task = asyncio.get_running_loop().create_task(_heartbeat())
+    await get_registry_backend().set_expiring(NODE_KEY + NODE_ID, str(time.time()), NODE_TIMEOUT)
+
+async def _heartbeat() -> None:
+    '''Refresh the liveness key of this node'''
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            await get_registry_backend().set_expiring(NODE_KEY + NODE_ID, str(time.time()), NODE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Failed to send the heartbeat of node {NODE_ID}: {e}")
+
+async def is_node_alive(node_id: Optional[str]) -> bool:
+    '''Check if a node still sends its heartbeat'''
+    if node_id is None:
+        return False
+    if node_id == NODE_ID:
+        return True
+    return await get_registry_backend().exists(NODE_KEY + node_id)
@@ -1,17 +1,43 @@
 from typing import Dict, Optional
 from ..tournament.tournament_session import TournamentSession
+from .registry_backend import NODE_ID, get_registry_backend, is_node_alive, start_heartbeat
 import logging
 
 logger = logging.getLogger("data_managment")
 
+USER_TOURNAMENT = "pong:user_tournament"        # user_id -> tournament_id
+TOURNAMENT_NAME = "pong:tournament_name"        # name -> tournament_id
+TOURNAMENT_OWNER = "pong:tournament_owner"      # tournament_id -> node that runs the tournament
+
 class Tournaments:
-    tournaments: Dict[str, TournamentSession] = {} 
+    '''Tournaments of every node, the sessions themselves live in the node that owns them'''
+    tournaments: Dict[str, TournamentSession] = {} # Sessions owned by this node
 
     @classmethod
-    def add(cls, tournament: TournamentSession) -> None:
-        '''Add a tournament to the registered tournaments'''
+    async def add(cls, tournament: TournamentSession) -> None:
+        '''Add a tournament to the registered tournaments, raises ValueError if the name is taken'''
         tournament_id = tournament.get_id()
+        backend = get_registry_backend()
+        await start_heartbeat()
+        await backend.hash_set(TOURNAMENT_OWNER, tournament_id, NODE_ID)
+        if not await cls._claim_name(tournament.get_name(), tournament_id):
+            await backend.hash_delete(TOURNAMENT_OWNER, tournament_id, expected=NODE_ID)
+            raise ValueError(f"tournament with name exists")
         cls.tournaments[tournament_id] = tournament
+        for user_id in tournament.get_users():
+            await backend.hash_set(USER_TOURNAMENT, str(user_id), tournament_id)
+
+    @classmethod
+    async def _claim_name(cls, name: str, tournament_id: str) -> bool:
+        '''Reserve a name for a tournament, names of tournaments whose node is gone are taken over'''
+        backend = get_registry_backend()
+        if await backend.hash_set_if_absent(TOURNAMENT_NAME, name, tournament_id):
+            return True
+        holder_id = await backend.hash_get(TOURNAMENT_NAME, name)
+        if holder_id is not None and not await is_node_alive(await cls.get_owner(holder_id)):
+            await backend.hash_delete(TOURNAMENT_NAME, name, expected=holder_id)
+            return await backend.hash_set_if_absent(TOURNAMENT_NAME, name, tournament_id)
+        return False
 
     @classmethod
     def get(cls, tournament_id: str) -> TournamentSession:
@@ -19,12 +45,31 @@ class Tournaments:
         return cls.tournaments.get(tournament_id)
 
     @classmethod
-    def remove(cls, tournament_id: str) -> bool:
+    async def remove(cls, tournament_id: str) -> bool:
         '''Remove a tournament from registered tournaments'''
-        if tournament_id in cls.tournaments:
-            del cls.tournaments[tournament_id]
-            return True
-        return False
+        tournament = cls.tournaments.pop(tournament_id, None)
+        if tournament is None:
+            return False
+        backend = get_registry_backend()
+        await backend.hash_delete(TOURNAMENT_NAME, tournament.get_name(), expected=tournament_id)
+        for user_id in tournament.get_users():
+            await backend.hash_delete(USER_TOURNAMENT, str(user_id), expected=tournament_id)
+        await backend.hash_delete(TOURNAMENT_OWNER, tournament_id, expected=NODE_ID)
+        return True
+
+    @classmethod
+    async def add_user(cls, tournament_id: str, user_id: int) -> None:
+        '''Add a user to a registered tournament'''
+        tournament = cls.tournaments[tournament_id]
+        tournament.add_user(user_id)
+        await get_registry_backend().hash_set(USER_TOURNAMENT, str(user_id), tournament_id)
+
+    @classmethod
+    async def remove_user(cls, tournament_id: str, user_id: int) -> None:
+        '''Remove a user from a registered tournament'''
+        tournament = cls.tournaments[tournament_id]
+        tournament.remove_user(user_id)
+        await get_registry_backend().hash_delete(USER_TOURNAMENT, str(user_id), expected=tournament_id)
 
     @classmethod
     def get_all(cls) -> dict[str, TournamentSession]:
@@ -33,7 +78,7 @@ class Tournaments:
     
     @classmethod
     def get_open_tournaments(cls) -> dict[str, TournamentSession]:
-        '''Get all open tournaments'''
+        '''Get all open tournaments of this node'''
         open_tournaments = {}
         for tournament_id, tournament in cls.tournaments.items():
             if not tournament.is_running() and not tournament.is_finished():
@@ -41,12 +86,23 @@ class Tournaments:
         return open_tournaments
 
     @classmethod
-    def get_user_tournament_id(cls, user_id: int) -> Optional[str]:
-        '''Get the tournament id of a user'''
-        for tournament in cls.tournaments.values():
-            if user_id in tournament.get_users():
-                return tournament.get_id()
-        return None
+    async def get_user_tournament_id(cls, user_id: int) -> Optional[str]:
+        '''Get the tournament id of a user, on any node'''
+        backend = get_registry_backend()
+        tournament_id = await backend.hash_get(USER_TOURNAMENT, str(user_id))
+        if tournament_id is None:
+            return None
+        if not await is_node_alive(await cls.get_owner(tournament_id)):
+            # The node that ran the tournament is gone, the tournament went with it
+            logger.warning(f"Dropping tournament {tournament_id} of user {user_id}, its node is gone")
+            await backend.hash_delete(USER_TOURNAMENT, str(user_id), expected=tournament_id)
+            return None
+        return tournament_id
+
+    @classmethod
+    async def get_owner(cls, tournament_id: str) -> Optional[str]:
+        '''Get the node that runs a tournament, None if the tournament does not exist'''
+        return await get_registry_backend().hash_get(TOURNAMENT_OWNER, tournament_id)
     
     @classmethod
     def get_tournament_players(cls, tournament_id: str) -> set:
@@ -57,20 +113,23 @@ class Tournaments:
         return set()
     
     @classmethod
-    def is_user_registered(cls, user_id: int) -> bool:
-        '''Check if a user is registered to a tournament'''
-        for tournament in cls.tournaments.values():
-            if tournament.has_user(user_id):
-                return True
-        return False
+    async def is_user_registered(cls, user_id: int) -> bool:
+        '''Check if a user is registered to a tournament, on any node'''
+        return await cls.get_user_tournament_id(user_id) is not None
     
     @classmethod
-    def get_by_name(cls, tournament_name: str) -> Optional[TournamentSession]:
-        '''Get a tournament by name'''
-        for tournament in cls.tournaments.values():
-            if tournament.get_name() == tournament_name:
-                return tournament
-        return None
+    async def get_by_name(cls, tournament_name: str) -> Optional[TournamentSession]:
+        '''Get a tournament of this node by name'''
+        tournament_id = await get_registry_backend().hash_get(TOURNAMENT_NAME, tournament_name)
+        if tournament_id is None:
+            return None
+        return cls.tournaments.get(tournament_id)
+
+    @classmethod
+    async def is_name_registered(cls, tournament_name: str) -> bool:
+        '''Check if a tournament with the name exists, on any node'''
+        tournament_id = await get_registry_backend().hash_get(TOURNAMENT_NAME, tournament_name)
+        return tournament_id is not None and await is_node_alive(await cls.get_owner(tournament_id))
     
     @classmethod
     def get_name_by_id(cls, tournament_id: str) -> Optional[str]:
@@ -78,4 +137,21 @@ class Tournaments:
         tournament = cls.get(tournament_id)
         if tournament:
             return tournament.get_name()
-        return None
\ No newline at end of file
+        return None
+
+    @classmethod
+    async def is_index_consistent(cls) -> bool:
+        '''Check that the shared entries of this node match the users and names of its tournaments'''
+        backend = get_registry_backend()
+        owned = {tournament_id for tournament_id, node_id in (await backend.hash_items(TOURNAMENT_OWNER)).items() if node_id == NODE_ID}
+        if owned != set(cls.tournaments):
+            return False
+        expected_users = {}
+        expected_names = {}
+        for tournament_id, tournament in cls.tournaments.items():
+            expected_names[tournament.get_name()] = tournament_id
+            for user_id in tournament.get_users():
+                expected_users[str(user_id)] = tournament_id
+        actual_users = {user_id: tournament_id for user_id, tournament_id in (await backend.hash_items(USER_TOURNAMENT)).items() if tournament_id in owned}
+        actual_names = {name: tournament_id for name, tournament_id in (await backend.hash_items(TOURNAMENT_NAME)).items() if tournament_id in owned}
+        return expected_users == actual_users and expected_names == actual_names
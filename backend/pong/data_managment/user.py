@@ -9,9 +9,10 @@ logger = logging.getLogger("data_managment")
 class User:
 
     @classmethod
-    def is_user_registered(self, user_id: int) -> bool:
+    async def is_user_registered(self, user_id: int) -> bool:
         '''Check if a user is registered for the matchmaking queue, a match or a tournament'''
-        return MatchmakingQueue.is_user_registered(user_id) or Matches.is_user_registered(user_id) or Tournaments.is_user_registered(user_id)
+        return (await MatchmakingQueue.is_user_registered(user_id) or await Matches.is_user_registered(user_id)
+                or await Tournaments.is_user_registered(user_id))
 
     @classmethod
     def is_user_connected_to_match(self, user_id: int, match_id: str) -> bool:
@@ -22,9 +23,9 @@ class User:
         return False
 
     @classmethod
-    def get_user_match_id(self, user_id: int) -> Optional[str]:
+    async def get_user_match_id(self, user_id: int) -> Optional[str]:
         '''Get the match id of a user'''
-        return Matches.get_user_match_id(user_id)
+        return await Matches.get_user_match_id(user_id)
     
     @classmethod
     def is_user_blocked(cls, user_id: int, match_id: str) -> bool:
@@ -35,13 +36,13 @@ class User:
         return False
     
     @classmethod
-    def check_if_user_is_registered_somewhere(cls, user_id: int) -> None:
+    async def check_if_user_is_registered_somewhere(cls, user_id: int) -> None:
         '''Check if a user is registered for the matchmaking queue, a match or a tournament and raise an error if so'''
-        if Matches.is_user_registered(user_id):
+        if await Matches.is_user_registered(user_id):
             raise ValueError(f"registered to match")
-        elif Tournaments.is_user_registered(user_id):
+        elif await Tournaments.is_user_registered(user_id):
             raise ValueError(f"registered to tournament")
-        elif MatchmakingQueue.is_user_registered(user_id):
+        elif await MatchmakingQueue.is_user_registered(user_id):
             raise ValueError(f"registered to queue")
         
     @classmethod
@@ -0,0 +1,65 @@
+from typing import Optional, Set
+from .registry_backend import get_registry_backend
+import logging
+
+logger = logging.getLogger("data_managment")
+
+class UserConnections:
+    '''Open WebSocket connections (channel names) of the users of one consumer, shared by every node
+
+    Channel names are reachable from every node through the channel layer,
+    so the active connection of a user can live on any node.'''
+
+    def __init__(self, name: str) -> None:
+        self._counts = f"{name}:connection_count"   # user_id -> number of open connections
+        self._active = f"{name}:active_connection"  # user_id -> channel name of the active connection
+        self._connections = f"{name}:connections:"  # + user_id, set of channel names
+
+    async def add(self, user_id: int, channel_name: str) -> bool:
+        '''Add a connection and make it the active one, returns True if it is the first of the user'''
+        backend = get_registry_backend()
+        is_new = await backend.set_add(self._connections + str(user_id), channel_name)
+        await backend.hash_set(self._active, str(user_id), channel_name)
+        if not is_new:
+            return False
+        return await backend.hash_increment(self._counts, str(user_id), 1) == 1
+
+    async def set_active(self, user_id: int, channel_name: str) -> None:
+        '''Make a connection the active one (e.g. the browser tab in use)'''
+        await get_registry_backend().hash_set(self._active, str(user_id), channel_name)
+
+    async def remove(self, user_id: int, channel_name: str) -> bool:
+        '''Remove a connection, returns True if it was the last of the user'''
+        backend = get_registry_backend()
+        if not await backend.set_remove(self._connections + str(user_id), channel_name):
+            return False
+        # Hand the active connection to one of the remaining ones
+        if await backend.hash_delete(self._active, str(user_id), expected=channel_name):
+            remaining = await backend.set_members(self._connections + str(user_id))
+            if remaining:
+                await backend.hash_set_if_absent(self._active, str(user_id), next(iter(remaining)))
+        if await backend.hash_increment(self._counts, str(user_id), -1) > 0:
+            return False
+        # Only deleted if no connection was added in the meantime
+        await backend.hash_delete(self._counts, str(user_id), expected="0")
+        return True
+
+    async def is_active(self, user_id: int, channel_name: str) -> bool:
+        '''Check if a connection is the active connection of its user'''
+        return await get_registry_backend().hash_get(self._active, str(user_id)) == channel_name
+
+    async def get_active(self, user_id: int) -> Optional[str]:
+        '''Get the channel name of the active connection of a user'''
+        return await get_registry_backend().hash_get(self._active, str(user_id))
+
+    async def get_count(self, user_id: int) -> int:
+        '''Get the number of open connections of a user'''
+        return int(await get_registry_backend().hash_get(self._counts, str(user_id)) or 0)
+
+    async def is_connected(self, user_id: int) -> bool:
+        '''Check if a user has an open connection'''
+        return await self.get_count(user_id) > 0
+
+    async def get_users(self) -> Set[str]:
+        '''Get the ids of the users with an open connection'''
+        return {user_id for user_id, count in (await get_registry_backend().hash_items(self._counts)).items() if int(count) > 0}
@@ -2,10 +2,16 @@ from django.conf import settings
 from .utils.vector2 import Vector2
 from .utils.vector_utils import degree_to_vector
 import logging
+import math
+from typing import Optional
 
 logger = logging.getLogger("Ball")
 
 SPEED_MULTIPLIER = settings.GAME_CONFIG['ball']['speed_multiplier']
+RESET_DIRECTION = degree_to_vector(45)
+MAX_IMPACTS_PER_STEP = 4 # Upper bound of bounces resolved within a single step
+
+WALL = object() # Marks an impact with the top or bottom wall
 
 class Ball:
     def __init__(self,
@@ -15,8 +21,9 @@ class Ball:
                 size: int = 0.2,
                 canvas_size: Vector2 = Vector2(10000, 10000),
                 collider_list: list = None):
-        self._position: Vector2 = position
-        self._direction: Vector2 = direction
+        # Copied because both vectors are updated in place
+        self._position: Vector2 = position.copy()
+        self._direction: Vector2 = direction.copy()
         self._base_speed: float = speed
         self._current_speed: float = speed
         self._wall_collision = False
@@ -30,66 +37,116 @@ class Ball:
 
         # List of colliders that the ball can collide with
         self._collider_list: list = collider_list if collider_list is not None else []
-        self._collided_with_list: list = []
+
+        # Scratch vector reused by move() so that a step does not allocate
+        self._movement: Vector2 = Vector2(0, 0)
 
     def move(self, delta_time: float) -> None:
-        """Update the ball's position based on its speed and direction."""
+        """Update the ball's position based on its speed and direction.
+
+        Collisions are swept: the ball's path during the step is cast against the walls and colliders,
+        the ball is moved to the earliest time of impact, bounced there, and travels on for the rest
+        of the step. A fast ball can therefore not pass through a paddle between two steps."""
         self._wall_collision = False
         self._paddle_collision = False
         # Update the ball's speed based on how long it has been alive
         self._current_speed = self._base_speed + self._time_alive * SPEED_MULTIPLIER
-        movement_vector = self._direction * self._current_speed * delta_time
-        new_position = self._position + movement_vector
-
-        if self._is_colliding_with_wall(new_position):
-            movement_vector.y *= -1
-            self._direction.y *= -1
-            self._wall_collision = True
-        elif self._is_colliding(new_position):
-            for collider in self._collided_with_list:
-                self._redirect_based_on_collider(collider)
-            movement_vector = self._direction * self._current_speed * delta_time
-            new_position = self._position + movement_vector
-            self._paddle_collision = True
-            if self._is_colliding_with_wall(new_position):
-                movement_vector.y *= -1
+
+        remaining_time = delta_time
+        ignored_collider = None
+        for _ in range(MAX_IMPACTS_PER_STEP):
+            movement_vector = self._update_movement(remaining_time)
+            impact_time, collider = self._find_first_impact(movement_vector, ignored_collider)
+            if collider is None:
+                self._position.iadd(movement_vector)
+                break
+
+            # Move to the point of impact and bounce there
+            self._position.x += movement_vector.x * impact_time
+            self._position.y += movement_vector.y * impact_time
+            remaining_time -= remaining_time * impact_time
+            if collider is WALL:
                 self._direction.y *= -1
                 self._wall_collision = True
+                ignored_collider = None
+            else:
+                self._redirect_based_on_collider(collider)
+                self._paddle_collision = True
+                ignored_collider = collider
+        else:
+            # Out of bounces, e.g. caught in a corner: travel the rest of the step in a straight line clamped
+            # to the walls, so no distance is lost, but stop at a paddle so the ball cannot pass through it
+            movement_vector = self._update_movement(remaining_time)
+            impact_time, collider = self._find_first_impact(movement_vector, ignored_collider, include_walls=False)
+            if collider is None:
+                impact_time = 1.0
+            self._position.x += movement_vector.x * impact_time
+            self._position.y = min(max(self._position.y + movement_vector.y * impact_time, 0.0), self._canvas_size.y - self._size)
 
-        self._position += movement_vector
         self._time_alive += delta_time
 
+    def _update_movement(self, delta_time: float) -> Vector2:
+        """Write the movement for this step into the scratch movement vector."""
+        return self._movement.set(self._direction.x * self._current_speed * delta_time,
+                                  self._direction.y * self._current_speed * delta_time)
+
     def reset(self):
         """Reset the ball to its starting position."""
-        self._position = self._start_pos.copy()
-        self._direction = degree_to_vector(45) * (-1 if self._direction.x < 0 else 1)
+        self._position.set_from(self._start_pos)
+        side = -1 if self._direction.x < 0 else 1
+        self._direction.set(RESET_DIRECTION.x * side, RESET_DIRECTION.y * side)
         self._current_speed = self._base_speed
         self._time_alive = 0
         self._wall_collision = False
         self._paddle_collision = False
 
-    def _is_colliding(self, position: Vector2) -> bool:
-        """Check if the ball is colliding with a collider object."""
+    def _find_first_impact(self, movement: Vector2, ignored_collider: object, include_walls: bool = True) -> tuple:
+        """Find the earliest impact along the movement as (fraction of the movement, WALL or collider)."""
+        impact_time = self._wall_impact_time(movement) if include_walls else None
+        hit = WALL if impact_time is not None else None
         for collider in self._collider_list:
-            collider_position = collider.get_position()
-            collider_size = collider.get_size()
-            if (collider_position.x < position.x + self._size and
-                collider_position.x + collider_size.x > position.x and
-                collider_position.y < position.y + self._size and
-                collider_position.y + collider_size.y > position.y):
-                if collider not in self._collided_with_list:
-                    self._collided_with_list.append(collider)
-                return True
-            elif collider in self._collided_with_list:
-                self._collided_with_list.remove(collider)
-        return False
-
-    def _is_colliding_with_wall(self, position: Vector2) -> bool:
-        """Check if the ball is colliding with the top or bottom wall."""
-        if position is None:
-            position = self._position
-        return (position.y < 0 or
-                position.y + self._size > self._canvas_size.y)
+            if collider is ignored_collider:
+                continue
+            collider_time = self._collider_impact_time(collider, movement)
+            if collider_time is not None and (impact_time is None or collider_time < impact_time):
+                impact_time = collider_time
+                hit = collider
+        return impact_time, hit
+
+    def _wall_impact_time(self, movement: Vector2) -> Optional[float]:
+        """Time of impact with the top or bottom wall as a fraction of the movement."""
+        if movement.y < 0:
+            impact_time = -self._position.y / movement.y
+        elif movement.y > 0:
+            impact_time = (self._canvas_size.y - self._size - self._position.y) / movement.y
+        else:
+            return None
+        if impact_time > 1:
+            return None
+        return max(impact_time, 0.0)
+
+    def _collider_impact_time(self, collider: object, movement: Vector2) -> Optional[float]:
+        """Time of impact with a collider as a fraction of the movement.
+
+        Casts a ray from the ball's corner against the collider's box expanded by the ball size."""
+        collider_position = collider.get_position()
+        collider_size = collider.get_size()
+        enter_x, exit_x = _slab(self._position.x, movement.x, collider_position.x - self._size, collider_position.x + collider_size.x)
+        enter_y, exit_y = _slab(self._position.y, movement.y, collider_position.y - self._size, collider_position.y + collider_size.y)
+        enter = max(enter_x, enter_y)
+        exit = min(exit_x, exit_y)
+        if enter >= exit or enter > 1 or exit <= 0:
+            return None
+        if enter < 0:
+            # Already overlapping (the collider moved into the ball), only bounce if the ball moves towards it
+            center_of_mass = collider.get_center_of_mass()
+            half_size = self._size / 2
+            towards_x = (collider_position.x + center_of_mass.x) - (self._position.x + half_size)
+            towards_y = (collider_position.y + center_of_mass.y) - (self._position.y + half_size)
+            if movement.x * towards_x + movement.y * towards_y <= 0:
+                return None
+            return 0.0
+        return enter
 
     def _is_colliding_with_goal(self, position: Vector2) -> bool:
         """Check if the ball is colliding with the left or right wall."""
@@ -100,10 +157,13 @@ class Ball:
 
     def _redirect_based_on_collider(self, collider: object) -> None:
         """Redirect the ball based on the center of mass of the collider."""
-        collider_center = collider.get_position() + collider.get_center_of_mass()
-        ball_center = self._position + Vector2(self._size / 2, self._size / 2)
-        direction_vector = ball_center - collider_center
-        self._direction = direction_vector.normalized()
+        collider_position = collider.get_position()
+        center_of_mass = collider.get_center_of_mass()
+        half_size = self._size / 2
+        self._direction.set(
+            (self._position.x + half_size) - (collider_position.x + center_of_mass.x),
+            (self._position.y + half_size) - (collider_position.y + center_of_mass.y)
+        ).normalize_into(self._direction)
 
     def get_position(self) -> Vector2:
         '''Get the position of the ball'''
@@ -133,4 +193,14 @@ class Ball:
         return {
             "x": self._position.x,
             "y": self._position.y
-        }
\ No newline at end of file
+        }
+
+def _slab(start: float, movement: float, low: float, high: float) -> tuple:
+    """Entry and exit time of a moving point in the open interval (low, high) along one axis."""
+    if movement == 0:
+        if low < start < high:
+            return -math.inf, math.inf
+        return math.inf, -math.inf
+    time_low = (low - start) / movement
+    time_high = (high - start) / movement
+    return min(time_low, time_high), max(time_low, time_high)
\ No newline at end of file
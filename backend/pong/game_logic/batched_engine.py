@@ -0,0 +1,425 @@
+import asyncio
+import logging
+import weakref
+import numpy as np
+from typing import List, Optional, Tuple
+from django.conf import settings
+from .ball import MAX_IMPACTS_PER_STEP
+from .game_session import InputAppliedCallback, PlayerScoredCallback
+from .utils.vector_utils import degree_to_vector
+from ..match.clock import REAL_CLOCK, Clock
+from ..match.protocol import GameState
+
+logger = logging.getLogger("game_session")
+
+WORLD_SIZE = np.array(settings.GAME_CONFIG['world_size'], dtype=np.float64)
+PADDLE_SIZE = np.array(settings.GAME_CONFIG['paddle']['size'], dtype=np.float64)
+PADDLE_X_OFFSET = settings.GAME_CONFIG['paddle']['x_offset']
+PADDLE_SPEED = settings.GAME_CONFIG['paddle']['speed']
+PADDLE_CENTER_OF_MASS = settings.GAME_CONFIG['paddle']['center_of_mass']
+BALL_SPEED = settings.GAME_CONFIG['ball']['speed']
+BALL_SIZE = settings.GAME_CONFIG['ball']['size']
+SPEED_MULTIPLIER = settings.GAME_CONFIG['ball']['speed_multiplier']
+
+PHYSICS_STEP = 1 / settings.MATCH_CONFIG['simulation_rate']
+MAX_CATCH_UP_STEPS = settings.MATCH_CONFIG['max_catch_up_steps']
+
+# Static layout shared by every match: x position and center of mass of the left (0) and right (1) paddle
+PADDLE_X = np.array([PADDLE_X_OFFSET, WORLD_SIZE[0] - PADDLE_SIZE[0] - PADDLE_X_OFFSET])
+PADDLE_CENTER_X = PADDLE_X + np.array([-PADDLE_CENTER_OF_MASS[0], PADDLE_CENTER_OF_MASS[0]])
+PADDLE_START_Y = WORLD_SIZE[1] / 2 - PADDLE_SIZE[1] / 2
+PADDLE_MAX_Y = WORLD_SIZE[1] - PADDLE_SIZE[1]
+
+BALL_START_POSITION = WORLD_SIZE / 2
+BALL_START_DIRECTION = degree_to_vector(55)
+BALL_RESET_DIRECTION = degree_to_vector(45)
+
+NO_HIT = -1
+WALL_HIT = 2 # Paddle hits are marked with the paddle side (0 or 1)
+
+INITIAL_CAPACITY = 64
+
+
+class BatchedPhysicsEngine:
+    '''Keeps the paddles and balls of every batched game session in struct-of-arrays buffers
+    and advances all of them with vectorized fixed steps each tick
+
+    The sessions that request a step in the same round of the event loop, i.e. the matches of one
+    scheduler phase, are stepped together before any of them continues, so a match sends the state
+    of its own tick like it does with the Python engine.'''
+
+    _instance: Optional['BatchedPhysicsEngine'] = None
+    _clock_instances: 'weakref.WeakKeyDictionary[Clock, BatchedPhysicsEngine]' = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_instance(cls, clock: Optional[Clock] = None) -> 'BatchedPhysicsEngine':
+        '''Get the process wide engine, or the one batching the sessions of a clock other than the real one'''
+        if clock is not None and clock is not REAL_CLOCK:
+            if clock not in cls._clock_instances:
+                cls._clock_instances[clock] = cls()
+            return cls._clock_instances[clock]
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY) -> None:
+        self._capacity: int = 0
+        self._sessions: List[Optional['BatchedGameSession']] = []
+        self._free_slots: List[int] = []
+        self._active_count: int = 0
+        self._step_done: Optional[asyncio.Future] = None # Resolved once the pending step requests are simulated
+
+        self.paddle_y = np.zeros((0, 2))
+        self.paddle_direction = np.zeros((0, 2))
+        self.ball_position = np.zeros((0, 2))
+        self.ball_direction = np.zeros((0, 2))
+        self.ball_time_alive = np.zeros(0)
+        self.accumulator = np.zeros(0) # Elapsed time per session that has not been simulated yet
+        self.tick_count = np.zeros(0, dtype=np.int64)
+        self.wall_collision = np.zeros(0, dtype=bool)
+        self.paddle_collision = np.zeros(0, dtype=bool)
+        self.step_requested = np.zeros(0, dtype=bool)
+        self.scored_by = np.zeros(0, dtype=np.int8) # -1 if nobody scored during the last step
+
+        self._grow(capacity)
+
+    #############################
+    #     Slot management       #
+    #############################
+
+    def allocate(self, session: 'BatchedGameSession') -> int:
+        '''Reserve a slot for a game session and put it into its starting state'''
+        if not self._free_slots:
+            self._grow(self._capacity * 2)
+        slot = self._free_slots.pop()
+        self._sessions[slot] = session
+        self._active_count += 1
+
+        self.paddle_y[slot] = PADDLE_START_Y
+        self.paddle_direction[slot] = 0
+        self.ball_position[slot] = BALL_START_POSITION
+        self.ball_direction[slot] = (BALL_START_DIRECTION.x, BALL_START_DIRECTION.y)
+        self.ball_time_alive[slot] = 0
+        self.accumulator[slot] = 0
+        self.tick_count[slot] = 0
+        self.wall_collision[slot] = False
+        self.paddle_collision[slot] = False
+        self.step_requested[slot] = False
+        self.scored_by[slot] = -1
+        return slot
+
+    def release(self, slot: int) -> None:
+        '''Free the slot of a finished game session'''
+        if self._sessions[slot] is None:
+            return
+        self._sessions[slot] = None
+        self.step_requested[slot] = False
+        self._free_slots.append(slot)
+        self._active_count -= 1
+
+    def _grow(self, capacity: int) -> None:
+        '''Resize every buffer to the new capacity, keeping the existing slots'''
+        old_capacity = self._capacity
+
+        def resized(array: np.ndarray, fill=0) -> np.ndarray:
+            new_array = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+            new_array[:old_capacity] = array
+            return new_array
+
+        self.paddle_y = resized(self.paddle_y)
+        self.paddle_direction = resized(self.paddle_direction)
+        self.ball_position = resized(self.ball_position)
+        self.ball_direction = resized(self.ball_direction)
+        self.ball_time_alive = resized(self.ball_time_alive)
+        self.accumulator = resized(self.accumulator)
+        self.tick_count = resized(self.tick_count)
+        self.wall_collision = resized(self.wall_collision)
+        self.paddle_collision = resized(self.paddle_collision)
+        self.step_requested = resized(self.step_requested)
+        self.scored_by = resized(self.scored_by, -1)
+
+        self._sessions.extend([None] * (capacity - old_capacity))
+        # Reversed so that pop() hands out the lowest slot first
+        self._free_slots = list(range(capacity - 1, old_capacity - 1, -1)) + self._free_slots
+        self._capacity = capacity
+
+    #############################
+    #           Tick            #
+    #############################
+
+    async def request_step(self, slot: int, delta_time: float) -> None:
+        '''Add the elapsed time of a session and wait until it is simulated together with the other requests of this round'''
+        self.accumulator[slot] += delta_time
+        self.step_requested[slot] = True
+        if self._step_done is None:
+            loop = asyncio.get_running_loop()
+            self._step_done = loop.create_future()
+            # Runs after the tasks that are already scheduled, so they can request their step first
+            loop.call_soon(self._run_step)
+        await asyncio.shield(self._step_done)
+
+    def _run_step(self) -> None:
+        '''Simulate the pending requests and wake up their sessions'''
+        step_done, self._step_done = self._step_done, None
+        try:
+            self.advance()
+        except Exception as error:
+            step_done.set_exception(error)
+        else:
+            step_done.set_result(None)
+
+    #############################
+    #          Physics          #
+    #############################
+
+    def advance(self) -> None:
+        '''Simulate the fixed steps that fit into the accumulated time for every session
+        that requested a step, using the same accumulator rules as GameSession'''
+        slots = np.flatnonzero(self.step_requested)
+        self.step_requested[slots] = False
+        self.wall_collision[slots] = False
+        self.paddle_collision[slots] = False
+
+        for _ in range(MAX_CATCH_UP_STEPS):
+            # A goal ends the tick of its session until the score has been reported
+            slots = slots[(self.accumulator[slots] >= PHYSICS_STEP) & (self.scored_by[slots] == -1)]
+            if slots.size == 0:
+                break
+            self.accumulator[slots] -= PHYSICS_STEP
+            self.step(slots)
+
+        stalled = slots[(self.accumulator[slots] >= PHYSICS_STEP) & (self.scored_by[slots] == -1)]
+        if stalled.size > 0:
+            logger.debug(f"Dropping simulation time of {stalled.size} sessions after a stall")
+            self.accumulator[stalled] %= PHYSICS_STEP
+
+    def step(self, slots: np.ndarray) -> None:
+        '''Simulate one fixed step for the given slots
+
+        Mirrors Paddle.move, Ball.move and GameSession.step with the same order of operations,
+        so a batched match plays out like a Python one.'''
+        self._move_paddles(slots, PHYSICS_STEP)
+        wall_collision, paddle_collision = self._move_balls(slots, PHYSICS_STEP)
+        scored = self._check_goals(slots)
+        self.wall_collision[slots] |= wall_collision & ~scored
+        self.paddle_collision[slots] |= paddle_collision & ~scored
+        self.tick_count[slots] += 1
+
+    def _move_paddles(self, slots: np.ndarray, delta_time: float) -> None:
+        '''Move the paddles and keep them inside the world'''
+        direction = self.paddle_direction[slots]
+        moved = self.paddle_y[slots] + direction * PADDLE_SPEED * delta_time
+        moved = np.maximum(0, np.minimum(moved, PADDLE_MAX_Y))
+        self.paddle_y[slots] = np.where(direction != 0, moved, self.paddle_y[slots])
+
+    def _move_balls(self, slots: np.ndarray, delta_time: float) -> Tuple[np.ndarray, np.ndarray]:
+        '''Move the balls with swept collisions against the walls and the paddles, like Ball.move'''
+        position = self.ball_position[slots]
+        direction = self.ball_direction[slots]
+        speed = BALL_SPEED + self.ball_time_alive[slots] * SPEED_MULTIPLIER
+        paddle_y = self.paddle_y[slots]
+
+        count = slots.size
+        remaining_time = np.full(count, delta_time)
+        ignored_paddle = np.full(count, NO_HIT)
+        wall_collision = np.zeros(count, dtype=bool)
+        paddle_collision = np.zeros(count, dtype=bool)
+        moving = np.arange(count)
+
+        for _ in range(MAX_IMPACTS_PER_STEP):
+            movement = direction[moving] * speed[moving, None] * remaining_time[moving, None]
+            impact_time, hit = self._find_first_impact(position[moving], movement, paddle_y[moving], ignored_paddle[moving])
+
+            # Balls without an impact travel the rest of the step
+            free = hit == NO_HIT
+            position[moving[free]] += movement[free]
+            impacted = ~free
+            moving = moving[impacted]
+            if moving.size == 0:
+                break
+            impact_time = impact_time[impacted]
+            hit = hit[impacted]
+
+            # Move to the point of impact and bounce there
+            position[moving] += movement[impacted] * impact_time[:, None]
+            remaining_time[moving] -= remaining_time[moving] * impact_time
+
+            wall = moving[hit == WALL_HIT]
+            direction[wall, 1] *= -1
+            wall_collision[wall] = True
+            ignored_paddle[wall] = NO_HIT
+
+            paddle = hit != WALL_HIT
+            bounced = moving[paddle]
+            side = hit[paddle]
+            direction[bounced] = self._redirect(position[bounced], paddle_y[bounced, side], side)
+            paddle_collision[bounced] = True
+            ignored_paddle[bounced] = side
+        else:
+            # Out of bounces, travel the rest of the step clamped to the walls and up to a paddle like Ball.move
+            movement = direction[moving] * speed[moving, None] * remaining_time[moving, None]
+            impact_time, hit = self._find_first_impact(position[moving], movement, paddle_y[moving], ignored_paddle[moving], include_walls=False)
+            position[moving] += movement * np.where(hit == NO_HIT, 1.0, impact_time)[:, None]
+            position[moving, 1] = np.clip(position[moving, 1], 0.0, WORLD_SIZE[1] - BALL_SIZE)
+
+        self.ball_position[slots] = position
+        self.ball_direction[slots] = direction
+        self.ball_time_alive[slots] += delta_time
+        return wall_collision, paddle_collision
+
+    @classmethod
+    def _find_first_impact(cls, position: np.ndarray, movement: np.ndarray, paddle_y: np.ndarray, ignored_paddle: np.ndarray,
+                           include_walls: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        '''Earliest impact per ball as (fraction of the movement, WALL_HIT, paddle side or NO_HIT)'''
+        impact_time = cls._wall_impact_time(position, movement) if include_walls else np.full(len(position), np.inf)
+        hit = np.where(np.isfinite(impact_time), WALL_HIT, NO_HIT)
+        for side in (0, 1):
+            paddle_time = cls._paddle_impact_time(position, movement, paddle_y[:, side], side)
+            paddle_time[ignored_paddle == side] = np.inf
+            closer = paddle_time < impact_time
+            impact_time = np.where(closer, paddle_time, impact_time)
+            hit = np.where(closer, side, hit)
+        return impact_time, hit
+
+    @staticmethod
+    def _wall_impact_time(position: np.ndarray, movement: np.ndarray) -> np.ndarray:
+        '''Time of impact with the top or bottom wall, infinite if there is none during the movement'''
+        y = position[:, 1]
+        movement_y = movement[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            impact_time = np.where(movement_y < 0, -y / movement_y,
+                          np.where(movement_y > 0, (WORLD_SIZE[1] - BALL_SIZE - y) / movement_y, np.inf))
+        return np.where(impact_time > 1, np.inf, np.maximum(impact_time, 0.0))
+
+    @staticmethod
+    def _paddle_impact_time(position: np.ndarray, movement: np.ndarray, paddle_y: np.ndarray, side: int) -> np.ndarray:
+        '''Time of impact with a paddle, infinite if there is none during the movement
+
+        Casts a ray from the ball's corner against the paddle box expanded by the ball size.'''
+        paddle_x = PADDLE_X[side]
+        enter_x, exit_x = _slab(position[:, 0], movement[:, 0], paddle_x - BALL_SIZE, paddle_x + PADDLE_SIZE[0])
+        enter_y, exit_y = _slab(position[:, 1], movement[:, 1], paddle_y - BALL_SIZE, paddle_y + PADDLE_SIZE[1])
+        enter = np.maximum(enter_x, enter_y)
+        exit = np.minimum(exit_x, exit_y)
+        hit = (enter < exit) & (enter <= 1) & (exit > 0)
+
+        # Already overlapping (the paddle moved into the ball), only bounce if the ball moves towards it
+        half_size = BALL_SIZE / 2
+        towards_x = PADDLE_CENTER_X[side] - (position[:, 0] + half_size)
+        towards_y = (paddle_y + PADDLE_CENTER_OF_MASS[1]) - (position[:, 1] + half_size)
+        approaching = movement[:, 0] * towards_x + movement[:, 1] * towards_y > 0
+        overlapping = enter < 0
+        hit &= ~overlapping | approaching
+        return np.where(hit, np.where(overlapping, 0.0, enter), np.inf)
+
+    @staticmethod
+    def _redirect(position: np.ndarray, paddle_y: np.ndarray, side: np.ndarray) -> np.ndarray:
+        '''Direction away from the center of mass of the paddle that was hit'''
+        half_size = BALL_SIZE / 2
+        away_x = (position[:, 0] + half_size) - PADDLE_CENTER_X[side]
+        away_y = (position[:, 1] + half_size) - (paddle_y + PADDLE_CENTER_OF_MASS[1])
+        magnitude = np.sqrt(away_x ** 2 + away_y ** 2)
+        safe_magnitude = np.where(magnitude == 0, 1, magnitude)
+        direction = np.column_stack((away_x / safe_magnitude, away_y / safe_magnitude))
+        direction[magnitude == 0] = 0
+        return direction
+
+    def _check_goals(self, slots: np.ndarray) -> np.ndarray:
+        '''Record who scored and put the ball back to the center, returns the goal mask'''
+        x = self.ball_position[slots, 0]
+        right_scored = x < 0
+        left_scored = ~right_scored & (x + BALL_SIZE > WORLD_SIZE[0])
+        goal = right_scored | left_scored
+        self.scored_by[slots] = np.where(right_scored, 1, np.where(left_scored, 0, -1))
+
+        scored = slots[goal]
+        if scored.size == 0:
+            return goal
+        side = np.where(self.ball_direction[scored, 0] < 0, -1.0, 1.0)
+        self.ball_position[scored] = BALL_START_POSITION
+        self.ball_direction[scored, 0] = BALL_RESET_DIRECTION.x * side
+        self.ball_direction[scored, 1] = BALL_RESET_DIRECTION.y * side
+        self.ball_time_alive[scored] = 0
+        return goal
+
+
+def _slab(start: np.ndarray, movement: np.ndarray, low, high) -> Tuple[np.ndarray, np.ndarray]:
+    '''Entry and exit time of moving points in the open interval (low, high) along one axis'''
+    inside = (low < start) & (start < high)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        time_low = (low - start) / movement
+        time_high = (high - start) / movement
+    still = movement == 0
+    enter = np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(time_low, time_high))
+    exit = np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(time_low, time_high))
+    return enter, exit
+
+
+class BatchedGameSession:
+    '''GameSession counterpart whose state lives in a slot of the BatchedPhysicsEngine'''
+
+    def __init__(self, on_player_scored: PlayerScoredCallback, on_input_applied: Optional[InputAppliedCallback] = None,
+                 clock: Optional[Clock] = None) -> None:
+        self._on_player_scored: PlayerScoredCallback = on_player_scored
+        self._on_input_applied: Optional[InputAppliedCallback] = on_input_applied
+        self._engine: BatchedPhysicsEngine = BatchedPhysicsEngine.get_instance(clock)
+        self._slot: Optional[int] = self._engine.allocate(self)
+        self._final_state: Optional[GameState] = None
+        self._final_tick: int = 0
+
+    def __del__(self):
+        logger.debug(f"Deleted batched game session {self}")
+
+    def close(self) -> None:
+        '''Give the slot back to the engine'''
+        if self._slot is not None:
+            self._final_state = self.get_state()
+            self._final_tick = self.get_tick()
+            self._engine.release(self._slot)
+            self._slot = None
+
+    def update_player_direction(self, player_id: int, direction: int) -> None:
+        '''Direction is -1(up), 0(stop), or 1(down)'''
+        if self._slot is not None and player_id in (0, 1):
+            self._engine.paddle_direction[self._slot, player_id] = direction
+            if self._on_input_applied is not None:
+                self._on_input_applied(self.get_tick(), player_id, direction)
+
+    async def calculate_game_state(self, delta_time: float) -> None:
+        '''Advance the game by the elapsed time in the engine's next batched step and report a goal'''
+        if self._slot is None:
+            return
+        engine = self._engine
+        await engine.request_step(self._slot, delta_time)
+        if self._slot is None:
+            return # Closed while waiting for the step
+        scored_by = int(engine.scored_by[self._slot])
+        engine.scored_by[self._slot] = -1
+        if scored_by != -1:
+            await self._on_player_scored(scored_by, self.get_tick()) # Call the callback function
+
+    def get_tick(self) -> int:
+        '''Get the number of simulated steps'''
+        if self._slot is None:
+            return self._final_tick
+        return int(self._engine.tick_count[self._slot])
+
+    def get_state(self) -> GameState:
+        '''Get the positions of the paddles and the ball and the collisions of the last tick'''
+        if self._slot is None:
+            return self._final_state
+        engine = self._engine
+        slot = self._slot
+        return (float(PADDLE_X[0]), float(engine.paddle_y[slot, 0]),
+                float(PADDLE_X[1]), float(engine.paddle_y[slot, 1]),
+                float(engine.ball_position[slot, 0]), float(engine.ball_position[slot, 1]),
+                bool(engine.wall_collision[slot]), bool(engine.paddle_collision[slot]))
+
+    def to_dict(self):
+        # From get_state, which keeps the last state after close
+        paddle_left_x, paddle_left_y, paddle_right_x, paddle_right_y, ball_x, ball_y, _, _ = self.get_state()
+        return {
+            "paddle_left": {"x": paddle_left_x, "y": paddle_left_y},
+            "paddle_right": {"x": paddle_right_x, "y": paddle_right_y},
+            "ball": {"x": ball_x, "y": ball_y}
+        }
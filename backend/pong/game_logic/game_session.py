@@ -1,11 +1,12 @@
 import logging
-import struct
 import asyncio
 from .ball import Ball
 from .paddle import Paddle
 from .utils.vector2 import Vector2
 from .utils.vector_utils import degree_to_vector
-from typing import Callable
+from ..match.protocol import GameState
+from ..match.clock import Clock
+from typing import Awaitable, Callable, Optional
 from django.conf import settings
 
 logger = logging.getLogger("game_session")
@@ -17,59 +18,118 @@ PADDLE_SPEED = settings.GAME_CONFIG['paddle']['speed']
 PADDLE_CENTER_OF_MASS = Vector2(settings.GAME_CONFIG['paddle']['center_of_mass'][0], settings.GAME_CONFIG['paddle']['center_of_mass'][1])
 BALL_SPEED = settings.GAME_CONFIG['ball']['speed']
 BALL_SIZE = settings.GAME_CONFIG['ball']['size']
+GAME_ENGINE = settings.GAME_CONFIG.get('engine', 'python')
+PHYSICS_STEP = 1 / settings.MATCH_CONFIG['simulation_rate']
+MAX_CATCH_UP_STEPS = settings.MATCH_CONFIG['max_catch_up_steps']
+SIMULATION_WORKERS = settings.MATCH_CONFIG.get('simulation_workers', 0)
+
+# Called with the player that scored and the tick of the goal
+PlayerScoredCallback = Callable[[int, int], Awaitable[None]]
+# Called with the tick a direction change is applied at (before the step after it), the player and the direction
+InputAppliedCallback = Callable[[int, int, int], None]
+
+def create_game_session(on_player_scored: PlayerScoredCallback, on_input_applied: Optional[InputAppliedCallback] = None,
+                        on_failed: Optional[Callable[[], Awaitable[None]]] = None, clock: Optional[Clock] = None) -> 'GameSession':
+    '''Create a game session for the configured physics engine, on_failed is called if it can no longer be simulated
+
+    The batched engine steps the sessions of one clock together, whenever their matches tick.'''
+    if SIMULATION_WORKERS > 0:
+        # The simulation runs in a worker process, the web process only relays inputs and snapshots
+        from .simulation_workers import RemoteGameSession
+        return RemoteGameSession(on_player_scored, on_input_applied, on_failed)
+    if GAME_ENGINE == "batched":
+        # Imported lazily so NumPy is only loaded when the batched engine is used
+        from .batched_engine import BatchedGameSession
+        return BatchedGameSession(on_player_scored, on_input_applied, clock)
+    return GameSession(on_player_scored, on_input_applied)
 
 class GameSession:
-    def __init__(self, on_player_scored: Callable[[str], None]) -> None:
-        self._on_player_scored: Callable[[int], None] = on_player_scored
+    def __init__(self, on_player_scored: PlayerScoredCallback, on_input_applied: Optional[InputAppliedCallback] = None) -> None:
+        self._on_player_scored: PlayerScoredCallback = on_player_scored
+        self._on_input_applied: Optional[InputAppliedCallback] = on_input_applied
         paddle_left_position = Vector2(PADDLE_X_OFFSET, WORLD_SIZE.y / 2 - PADDLE_SIZE.y / 2)
         paddle_right_position = Vector2(WORLD_SIZE.x - PADDLE_SIZE.x - PADDLE_X_OFFSET, WORLD_SIZE.y / 2 - PADDLE_SIZE.y / 2)
         self.paddle_left = Paddle(position=paddle_left_position, size=PADDLE_SIZE, speed=PADDLE_SPEED, world_size=WORLD_SIZE, center_of_mass=Vector2(PADDLE_CENTER_OF_MASS.x * -1, PADDLE_CENTER_OF_MASS.y))
         self.paddle_right = Paddle(position=paddle_right_position, size=PADDLE_SIZE, speed=PADDLE_SPEED, world_size=WORLD_SIZE, center_of_mass=PADDLE_CENTER_OF_MASS)
         self.ball = Ball(Vector2(WORLD_SIZE.x / 2, WORLD_SIZE.y / 2), direction=degree_to_vector(55), speed=BALL_SPEED, size=BALL_SIZE, canvas_size=WORLD_SIZE, collider_list=[self.paddle_left, self.paddle_right])
+        self._accumulator: float = 0.0 # Elapsed time that has not been simulated yet
+        self._tick: int = 0 # Number of fixed steps simulated so far
+        self._wall_collision: bool = False
+        self._paddle_collision: bool = False
 
     def __del__(self):
         logger.debug(f"Deleted game session {self}")
 
+    def close(self) -> None:
+        '''Release the resources of the game session'''
+        pass
+
     def update_player_direction(self, player_id: int, direction: int) -> None:
         '''Direction is -1(up), 0(stop), or 1(down)'''
         if player_id == 0:
             self.paddle_left.direction = direction
         elif player_id == 1:
             self.paddle_right.direction = direction
+        else:
+            return
+        if self._on_input_applied is not None:
+            self._on_input_applied(self._tick, player_id, direction)
 
     async def calculate_game_state(self, delta_time: float) -> None:
-        '''Calculate the game state for the next frame'''
+        '''Advance the game by the elapsed time in fixed simulation steps
+
+        The elapsed time is collected in an accumulator and simulated in steps of PHYSICS_STEP,
+        so the outcome only depends on the inputs and not on how the ticks were timed.
+        After a stall at most MAX_CATCH_UP_STEPS are simulated and the remaining time is dropped.'''
+
+        self._accumulator += delta_time
+        self._wall_collision = False
+        self._paddle_collision = False
+        steps = 0
+        while self._accumulator >= PHYSICS_STEP and steps < MAX_CATCH_UP_STEPS:
+            self._accumulator -= PHYSICS_STEP
+            steps += 1
+            scored = self.step()
+            self._wall_collision |= self.ball.get_wall_collision()
+            self._paddle_collision |= self.ball.get_paddle_collision()
+            if scored is not None:
+                # A goal ends the tick so the score is handled before the next rally is simulated
+                await self._on_player_scored(scored, self._tick) # Call the callback function
+                return
+
+        if self._accumulator >= PHYSICS_STEP:
+            logger.debug(f"Dropping {self._accumulator:.3f}s of simulation time after a stall")
+            self._accumulator %= PHYSICS_STEP
+
+    def step(self) -> Optional[int]:
+        '''Simulate one fixed step, returns the player that scored or None'''
 
-        self.paddle_left.move(delta_time)
-        self.paddle_right.move(delta_time)
-        self.ball.move(delta_time)
+        self.paddle_left.move(PHYSICS_STEP)
+        self.paddle_right.move(PHYSICS_STEP)
+        self.ball.move(PHYSICS_STEP)
+        self._tick += 1
 
         if self.ball.get_position().x < 0:
-            await self._on_player_scored(1) # Call the callback function
             self.ball.reset()
+            return 1
         elif self.ball.get_position().x + self.ball.get_size() > WORLD_SIZE.x:
-            await self._on_player_scored(0) # Call the callback function
             self.ball.reset()
+            return 0
+        return None
 
-    def to_bytearray(self):
-        '''Convert the game state to a bytearray and pack it into a struct'''
+    def get_tick(self) -> int:
+        '''Get the number of simulated steps'''
+        return self._tick
 
+    def get_state(self) -> GameState:
+        '''Get the positions of the paddles and the ball and the collisions of the last tick'''
         left_paddle_position = self.paddle_left.get_position()
         right_paddle_position = self.paddle_right.get_position()
         ball_position = self.ball.get_position()
-        wall_collision = self.ball.get_wall_collision()
-        paddle_collision = self.ball.get_paddle_collision()
-        byte_array = bytearray(26)
-        struct.pack_into('<f', byte_array, 0, left_paddle_position.x)
-        struct.pack_into('<f', byte_array, 4, left_paddle_position.y)
-        struct.pack_into('<f', byte_array, 8, right_paddle_position.x)
-        struct.pack_into('<f', byte_array, 12, right_paddle_position.y)
-        struct.pack_into('<f', byte_array, 16, ball_position.x)
-        struct.pack_into('<f', byte_array, 20, ball_position.y)
-# Pack the boolean values as bytes
-        struct.pack_into('<B', byte_array, 24, int(wall_collision))
-        struct.pack_into('<B', byte_array, 25, int(paddle_collision))
-        return byte_array
+        return (left_paddle_position.x, left_paddle_position.y,
+                right_paddle_position.x, right_paddle_position.y,
+                ball_position.x, ball_position.y,
+                self._wall_collision, self._paddle_collision)
 
     def to_dict(self):
         return {
@@ -3,7 +3,7 @@ from .utils.vector2 import Vector2
 class Paddle:
     def __init__(self, position: Vector2 = Vector2(0, 0), size: Vector2 = Vector2(20, 100), speed: float = 10.0, world_size: Vector2 = Vector2(10000, 10000), center_of_mass = None) -> None:
         self._base_position: Vector2 = position.copy()
-        self._current_position: Vector2 = position
+        self._current_position: Vector2 = position.copy()
         self.size: Vector2 = size
         self.speed: float = speed
         self.direction: int = 0 # -1, 0, 1
@@ -26,7 +26,7 @@ class Paddle:
     
     def reset_position(self) -> None:
         print(f"Resetting paddle position to {self._base_position}")
-        self._current_position = self._base_position.copy()
+        self._current_position.set_from(self._base_position)
 
     def get_center_of_mass(self) -> Vector2:
         return self._center_of_mass
@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from django.conf import settings
+from ..match.protocol import GameState
+from .game_session import InputAppliedCallback, PlayerScoredCallback
+
+logger = logging.getLogger("game_session")
+
+SIMULATION_WORKERS = settings.MATCH_CONFIG.get('simulation_workers', 0)
+
+# Commands sent to a worker, every command is a tuple starting with its type and the session id
+CREATE = 0
+DIRECTION = 1
+ADVANCE = 2
+CLOSE = 3
+
+# Replies of a worker, every reply is a tuple starting with its type and the session id
+SNAPSHOT = 0        # tick, state, player that scored during the advance or -1
+INPUT_APPLIED = 1   # tick the direction change was applied at, player id, direction
+
+
+def run_worker(connection) -> None:
+    '''Entry point of a simulation worker process'''
+    import django
+    django.setup() # The process is spawned, so settings and logging have to be loaded again
+    asyncio.run(_serve(connection))
+
+async def _serve(connection) -> None:
+    '''Simulate the sessions of this worker until the web process closes the pipe
+
+    The worker does nothing besides answering its pipe, so the blocking recv() does not stall anything.'''
+    from .game_session import GameSession
+
+    sessions: Dict[int, GameSession] = {}
+    goals: Dict[int, int] = {}
+    replies: List[tuple] = []
+
+    def on_player_scored(session_id: int) -> PlayerScoredCallback:
+        async def record_goal(player_id: int, tick: int) -> None:
+            goals[session_id] = player_id
+        return record_goal
+
+    def on_input_applied(session_id: int) -> InputAppliedCallback:
+        def echo_input(tick: int, player_id: int, direction: int) -> None:
+            # The web process records the input at the tick the simulation applied it at
+            replies.append((INPUT_APPLIED, session_id, tick, player_id, direction))
+        return echo_input
+
+    while True:
+        try:
+            batch = connection.recv()
+        except (EOFError, OSError):
+            break # The web process closed the pipe or exited
+        replies.clear()
+        for command in batch:
+            session_id = command[1]
+            if command[0] == CREATE:
+                sessions[session_id] = GameSession(on_player_scored(session_id), on_input_applied(session_id))
+            elif command[0] == DIRECTION:
+                session = sessions.get(session_id)
+                if session is not None:
+                    session.update_player_direction(command[2], command[3])
+            elif command[0] == ADVANCE:
+                session = sessions.get(session_id)
+                if session is not None:
+                    await session.calculate_game_state(command[2])
+                    # A goal ends the advance, so the tick of the snapshot is the tick of the goal
+                    replies.append((SNAPSHOT, session_id, session.get_tick(), session.get_state(), goals.pop(session_id, -1)))
+            elif command[0] == CLOSE:
+                sessions.pop(session_id, None)
+                goals.pop(session_id, None)
+        if replies:
+            try:
+                connection.send(replies)
+            except OSError:
+                break
+
+
+class SimulationWorker:
+    '''A worker process and the pipe to it
+
+    The batches are sent by a writer thread: the worker blocks while its replies are not read, so a send
+    on the event loop could wait for a worker that waits for the event loop.'''
+
+    def __init__(self, index: int, context, loop: asyncio.AbstractEventLoop,
+                 on_replies: Callable[[List[Tuple]], None], on_exit: Callable[['SimulationWorker'], None]) -> None:
+        self.index: int = index
+        self.session_ids: Set[int] = set()
+        self._loop = loop
+        self._on_replies = on_replies
+        self._on_exit = on_exit
+        self._is_alive = True
+
+        self._connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=run_worker, args=(worker_connection,), name=f"simulation-worker-{index}", daemon=True)
+        self.process.start()
+        worker_connection.close()
+        self._fileno = self._connection.fileno()
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue() # Batches for the writer thread, None stops it
+        threading.Thread(target=self._write, name=f"simulation-writer-{index}", daemon=True).start()
+        self._loop.add_reader(self._fileno, self._read)
+
+    def send(self, batch: List[Tuple]) -> None:
+        '''Hand a batch to the writer thread'''
+        if self._is_alive:
+            self._outbox.put(batch)
+
+    def close(self) -> None:
+        '''Stop reading and close the pipe, the worker exits once it reads the end of the pipe'''
+        if self._is_alive:
+            self._is_alive = False
+            self._loop.remove_reader(self._fileno)
+            self._outbox.put(None)
+
+    def _write(self) -> None:
+        '''Send the batches until the worker is closed, runs on the writer thread'''
+        is_broken = False
+        try:
+            while True:
+                batch = self._outbox.get()
+                if batch is None:
+                    return
+                if is_broken:
+                    continue
+                try:
+                    self._connection.send(batch)
+                except (OSError, ValueError):
+                    is_broken = True
+                    self._loop.call_soon_threadsafe(self._exited)
+        finally:
+            # Only closed here, so the pipe is never closed under a send
+            self._connection.close()
+
+    def _read(self) -> None:
+        '''Hand every complete reply batch of the worker to the pool'''
+        try:
+            while self._is_alive and self._connection.poll():
+                self._on_replies(self._connection.recv())
+        except (EOFError, OSError):
+            self._exited()
+
+    def _exited(self) -> None:
+        '''The worker process is gone'''
+        if self._is_alive:
+            self.close()
+            self._on_exit(self)
+
+
+class SimulationWorkerPool:
+    '''Runs the game sessions in a pool of worker processes, so the physics does not compete
+    with the rest of the web process for the GIL
+
+    Commands are collected per worker and sent as one batch at the end of the event loop iteration,
+    the workers answer every ADVANCE with the state of the session. A worker that exits takes the
+    state of its sessions with it: they are failed and the worker is replaced for new sessions.'''
+
+    _instance: Optional['SimulationWorkerPool'] = None
+
+    @classmethod
+    def get_instance(cls) -> 'SimulationWorkerPool':
+        '''Get the process wide pool, the workers are started on first use'''
+        if cls._instance is None:
+            cls._instance = cls(SIMULATION_WORKERS)
+        return cls._instance
+
+    def __init__(self, worker_count: int) -> None:
+        self._context = multiprocessing.get_context("spawn")
+        self._loop = asyncio.get_running_loop()
+        self._outboxes: List[List[Tuple]] = [[] for _ in range(worker_count)]
+        self._sessions: Dict[int, 'RemoteGameSession'] = {}
+        self._session_ids = count()
+        self._flush_scheduled = False
+        self._workers: List[SimulationWorker] = [self._start_worker(index) for index in range(worker_count)]
+        logger.info(f"Started {worker_count} simulation workers")
+
+    def _start_worker(self, index: int) -> SimulationWorker:
+        '''Start the worker process of an index'''
+        return SimulationWorker(index, self._context, self._loop, self._receive, self._worker_exited)
+
+    def close(self) -> None:
+        '''Stop every worker, their sessions are failed'''
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
+            self._fail_sessions(worker)
+
+    #############################
+    #     Session management    #
+    #############################
+
+    def add_session(self, session: 'RemoteGameSession') -> Tuple[int, int]:
+        '''Place a session on the least busy worker, returns the session id and the worker index'''
+        worker = min(self._workers, key=lambda worker: len(worker.session_ids))
+        session_id = next(self._session_ids)
+        worker.session_ids.add(session_id)
+        self._sessions[session_id] = session
+        self.send(worker.index, (CREATE, session_id))
+        return session_id, worker.index
+
+    def remove_session(self, session_id: int, worker: int) -> None:
+        '''Stop simulating a session'''
+        if self._sessions.pop(session_id, None) is not None:
+            self._workers[worker].session_ids.discard(session_id)
+            self.send(worker, (CLOSE, session_id))
+
+    def get_session_count(self) -> int:
+        '''Get the number of simulated sessions'''
+        return len(self._sessions)
+
+    def get_worker_processes(self) -> List[multiprocessing.Process]:
+        '''Get the running worker processes'''
+        return [worker.process for worker in self._workers]
+
+    def _worker_exited(self, worker: SimulationWorker) -> None:
+        '''Fail the sessions of a worker that exited and start a new one in its place'''
+        logger.error(f"Simulation worker {worker.index} exited, failing its {len(worker.session_ids)} sessions")
+        if self._workers[worker.index] is worker:
+            self._outboxes[worker.index] = [] # Only commands for the sessions of the exited worker
+            self._workers[worker.index] = self._start_worker(worker.index)
+        self._fail_sessions(worker)
+
+    def _fail_sessions(self, worker: SimulationWorker) -> None:
+        '''Tell the sessions of a worker that they are no longer simulated'''
+        session_ids, worker.session_ids = worker.session_ids, set()
+        for session_id in session_ids:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                session.on_worker_exit()
+
+    #############################
+    #       Communication       #
+    #############################
+
+    def send(self, worker: int, command: Tuple) -> None:
+        '''Queue a command for a worker'''
+        self._outboxes[worker].append(command)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self) -> None:
+        '''Hand the queued commands to the workers, one batch per worker'''
+        self._flush_scheduled = False
+        for worker, outbox in zip(self._workers, self._outboxes):
+            if outbox:
+                self._outboxes[worker.index] = []
+                worker.send(outbox)
+
+    def _receive(self, replies: List[Tuple]) -> None:
+        '''Hand the replies of a worker to their sessions'''
+        for reply in replies:
+            session = self._sessions.get(reply[1])
+            if session is None:
+                continue
+            if reply[0] == SNAPSHOT:
+                session.on_snapshot(*reply[2:])
+            elif reply[0] == INPUT_APPLIED:
+                session.on_input_applied(*reply[2:])
+
+
+class RemoteGameSession:
+    '''GameSession counterpart that is simulated by a SimulationWorkerPool process
+
+    The web process only relays: the inputs are forwarded to the worker and the last snapshot
+    the worker sent back is served, so the state is one tick behind the simulation. Inputs and goals
+    are reported with the ticks of the worker, which are ahead of the snapshot being served.
+    If the worker exits, the session is closed and on_failed is called.'''
+
+    _initial_state: Optional[GameState] = None
+
+    def __init__(self, on_player_scored: PlayerScoredCallback, on_input_applied: Optional[InputAppliedCallback] = None,
+                 on_failed: Optional[Callable[[], Awaitable[None]]] = None, pool: Optional[SimulationWorkerPool] = None) -> None:
+        self._on_player_scored: PlayerScoredCallback = on_player_scored
+        self._on_input_applied: Optional[InputAppliedCallback] = on_input_applied
+        self._on_failed: Optional[Callable[[], Awaitable[None]]] = on_failed
+        self._pool: SimulationWorkerPool = pool or SimulationWorkerPool.get_instance()
+        self._session_id, self._worker = self._pool.add_session(self)
+        self._is_closed = False
+        self._tick: int = 0
+        self._state: GameState = self._get_initial_state()
+        self._goals: List[Tuple[int, int]] = [] # Player and tick of the goals that were not reported yet
+
+    def __del__(self):
+        logger.debug(f"Deleted remote game session {self}")
+
+    @classmethod
+    def _get_initial_state(cls) -> GameState:
+        '''Starting state, served until the worker sends the first snapshot'''
+        if cls._initial_state is None:
+            from .game_session import GameSession
+            cls._initial_state = GameSession(None).get_state()
+        return cls._initial_state
+
+    def close(self) -> None:
+        '''Stop the simulation in the worker'''
+        if not self._is_closed:
+            self._is_closed = True
+            self._pool.remove_session(self._session_id, self._worker)
+
+    def update_player_direction(self, player_id: int, direction: int) -> None:
+        '''Direction is -1(up), 0(stop), or 1(down)'''
+        if not self._is_closed:
+            self._pool.send(self._worker, (DIRECTION, self._session_id, player_id, direction))
+
+    async def calculate_game_state(self, delta_time: float) -> None:
+        '''Report goals of the last snapshot and let the worker simulate the elapsed time'''
+        if self._is_closed:
+            return
+        goals, self._goals = self._goals, []
+        self._pool.send(self._worker, (ADVANCE, self._session_id, delta_time))
+        for scored_by, tick in goals:
+            await self._on_player_scored(scored_by, tick) # Call the callback function
+
+    def on_worker_exit(self) -> None:
+        '''The worker exited with the state of the session, the game cannot go on'''
+        if self._is_closed:
+            return
+        self._is_closed = True
+        if self._on_failed is not None:
+            asyncio.ensure_future(self._on_failed())
+
+    def on_snapshot(self, tick: int, state: GameState, scored_by: int) -> None:
+        '''Store a snapshot sent by the worker'''
+        self._tick = tick
+        self._state = state
+        if scored_by != -1:
+            self._goals.append((scored_by, tick))
+
+    def on_input_applied(self, tick: int, player_id: int, direction: int) -> None:
+        '''A direction change was applied by the worker'''
+        if self._on_input_applied is not None and not self._is_closed:
+            self._on_input_applied(tick, player_id, direction)
+
+    def get_tick(self) -> int:
+        '''Get the number of simulated steps'''
+        return self._tick
+
+    def get_state(self) -> GameState:
+        '''Get the last state sent by the worker'''
+        return self._state
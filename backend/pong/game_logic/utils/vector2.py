@@ -1,6 +1,8 @@
 import math
 
 class Vector2:
+    __slots__ = ("x", "y")
+
     def __init__(self, x: float, y: float) -> None:
         self.x: float = x
         self.y: float = y
@@ -42,4 +44,37 @@ class Vector2:
         return Vector2(self.x / mag, self.y / mag)
     
     def copy(self):
-        return Vector2(self.x, self.y)
\ No newline at end of file
+        return Vector2(self.x, self.y)
+
+    # In-place operations, used on the hot path to avoid allocating temporary vectors
+
+    def set(self, x: float, y: float) -> 'Vector2':
+        '''Overwrite both components'''
+        self.x = x
+        self.y = y
+        return self
+
+    def set_from(self, other: 'Vector2') -> 'Vector2':
+        '''Copy the components of another vector'''
+        self.x = other.x
+        self.y = other.y
+        return self
+
+    def iadd(self, other: 'Vector2') -> 'Vector2':
+        '''Add another vector in place'''
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def imul(self, scalar: float) -> 'Vector2':
+        '''Multiply by a scalar in place'''
+        self.x *= scalar
+        self.y *= scalar
+        return self
+
+    def normalize_into(self, out: 'Vector2') -> 'Vector2':
+        '''Write the normalized vector into out, which may be the vector itself'''
+        mag = self.magnitude()
+        if mag == 0:
+            return out.set(0, 0)
+        return out.set(self.x / mag, self.y / mag)
\ No newline at end of file
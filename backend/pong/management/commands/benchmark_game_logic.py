@@ -0,0 +1,82 @@
+import asyncio
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from pong.game_logic.game_session import GameSession
+from pong.game_logic.utils.vector2 import Vector2
+
+class Command(BaseCommand):
+    help = "Micro-benchmark of the game logic hot path: Vector2 allocations, transient memory and time per tick"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=100, help='Number of simulated matches')
+        parser.add_argument('--ticks', type=int, default=600, help='Number of ticks per match')
+        parser.add_argument('--delta-time', type=float, default=1 / 60, help='Elapsed time per tick in seconds')
+
+    def handle(self, *args, **options):
+        matches = options['matches']
+        ticks = options['ticks']
+        delta_time = options['delta_time']
+        total_ticks = matches * ticks
+
+        allocations = asyncio.run(self._count_vector_allocations(matches, ticks, delta_time))
+        peak_bytes = asyncio.run(self._measure_transient_memory(matches, ticks, delta_time))
+        elapsed = asyncio.run(self._measure_time(matches, ticks, delta_time))
+
+        self.stdout.write(f"Simulated {matches} matches for {ticks} ticks ({total_ticks} match ticks)")
+        self.stdout.write(f"Vector2 allocations per tick: {allocations / total_ticks:.3f}")
+        self.stdout.write(f"Peak transient memory: {peak_bytes} bytes")
+        self.stdout.write(f"Time per tick: {elapsed / total_ticks * 1e6:.2f} us")
+
+    @staticmethod
+    def _create_sessions(matches: int) -> list:
+        '''Create game sessions whose paddles keep moving so every code path is exercised'''
+        async def on_player_scored(player_id: int, tick: int) -> None:
+            pass
+
+        sessions = [GameSession(on_player_scored) for _ in range(matches)]
+        for i, session in enumerate(sessions):
+            session.update_player_direction(0, 1 if i % 2 else -1)
+            session.update_player_direction(1, -1 if i % 3 else 1)
+        return sessions
+
+    async def _run(self, sessions: list, ticks: int, delta_time: float) -> None:
+        for _ in range(ticks):
+            for session in sessions:
+                await session.calculate_game_state(delta_time)
+
+    async def _count_vector_allocations(self, matches: int, ticks: int, delta_time: float) -> int:
+        '''Count Vector2 constructions while the matches are simulated'''
+        sessions = self._create_sessions(matches)
+        count = 0
+        original_init = Vector2.__init__
+
+        def counting_init(vector, x, y):
+            nonlocal count
+            count += 1
+            original_init(vector, x, y)
+
+        Vector2.__init__ = counting_init
+        try:
+            await self._run(sessions, ticks, delta_time)
+        finally:
+            Vector2.__init__ = original_init
+        return count
+
+    async def _measure_transient_memory(self, matches: int, ticks: int, delta_time: float) -> int:
+        '''Highest amount of memory allocated on top of the live state while simulating'''
+        sessions = self._create_sessions(matches)
+        tracemalloc.start()
+        try:
+            baseline, _ = tracemalloc.get_traced_memory()
+            await self._run(sessions, ticks, delta_time)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak - baseline
+
+    async def _measure_time(self, matches: int, ticks: int, delta_time: float) -> float:
+        sessions = self._create_sessions(matches)
+        start = time.perf_counter()
+        await self._run(sessions, ticks, delta_time)
+        return time.perf_counter() - start
@@ -0,0 +1,93 @@
+import asyncio
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from pong.data_managment.matchmaking_queue import MatchmakingQueue
+from pong.data_managment.registry_backend import AsyncMemoryRegistryBackend, set_registry_backend
+
+MATCHMAKING_INTERVAL = settings.MATCHMAKING_CONFIG['interval']
+
+class Command(BaseCommand):
+    help = "Benchmark of the rating matchmaking queue: pairing cost, rating gaps and waiting times on a simulated clock"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of queued users')
+        parser.add_argument('--arrival-rate', type=float, default=200.0, help='Users joining the queue per second')
+        parser.add_argument('--rating-mean', type=float, default=1200.0, help='Mean rating of the users')
+        parser.add_argument('--rating-spread', type=float, default=300.0, help='Standard deviation of the ratings')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random ratings')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ratings = [max(rng.gauss(options['rating_mean'], options['rating_spread']), 0) for _ in range(options['users'])]
+
+        asyncio.run(self._run_burst(ratings))
+        asyncio.run(self._run_arrivals(ratings, options['arrival_rate']))
+
+    async def _run_burst(self, ratings: list) -> None:
+        '''Every user queued at once, then a single search pairs them'''
+        set_registry_backend(AsyncMemoryRegistryBackend())
+        start = time.perf_counter()
+        for user_id, rating in enumerate(ratings, 1):
+            await MatchmakingQueue.add_to_queue(user_id, rating, 0.0)
+        enqueue_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairs = await MatchmakingQueue.pop_pairs(0.0)
+        search_time = time.perf_counter() - start
+
+        self.stdout.write(f"Burst: {len(ratings)} users queued in {enqueue_time * 1e3:.1f} ms ({enqueue_time / len(ratings) * 1e6:.2f} us per user)")
+        self.stdout.write(f"Burst: {len(pairs)} pairs found in {search_time * 1e3:.1f} ms ({search_time / max(len(pairs), 1) * 1e6:.2f} us per pair), "
+                          f"{await MatchmakingQueue.get_queue_length()} users left waiting for a wider window")
+        self._write_gaps("Burst", pairs, ratings)
+
+    async def _run_arrivals(self, ratings: list, arrival_rate: float) -> None:
+        '''Users join one after another, every join and every interval searches like the MatchSessionHandler'''
+        set_registry_backend(AsyncMemoryRegistryBackend())
+        queued_at = {}
+        pairs = []
+        waits = []
+        search_time = 0.0
+        searches = 0
+        next_interval = MATCHMAKING_INTERVAL
+
+        async def search(now: float) -> None:
+            nonlocal search_time, searches
+            start = time.perf_counter()
+            found = await MatchmakingQueue.pop_pairs(now)
+            search_time += time.perf_counter() - start
+            searches += 1
+            for user_id_1, user_id_2 in found:
+                waits.append(now - queued_at[user_id_1])
+                waits.append(now - queued_at[user_id_2])
+            pairs.extend(found)
+
+        now = 0.0
+        for user_id, rating in enumerate(ratings, 1):
+            now = user_id / arrival_rate
+            while next_interval <= now:
+                await search(next_interval)
+                next_interval += MATCHMAKING_INTERVAL
+            queued_at[user_id] = now
+            await MatchmakingQueue.add_to_queue(user_id, rating, now)
+            await search(now)
+
+        # Let the windows of the remaining users widen until nobody can be paired anymore
+        while await MatchmakingQueue.get_queue_length() > 1 and next_interval < now + 3600:
+            await search(next_interval)
+            next_interval += MATCHMAKING_INTERVAL
+
+        self.stdout.write(f"Arrivals: {len(ratings)} users at {arrival_rate:g} per second, {searches} searches "
+                          f"averaging {search_time / searches * 1e6:.2f} us")
+        self.stdout.write(f"Arrivals: {len(pairs)} pairs, {await MatchmakingQueue.get_queue_length()} users left, "
+                          f"waited {sum(waits) / max(len(waits), 1):.2f} s on average and {max(waits, default=0):.2f} s at most")
+        self._write_gaps("Arrivals", pairs, ratings)
+
+    def _write_gaps(self, name: str, pairs: list, ratings: list) -> None:
+        '''Write the rating gaps of the pairs'''
+        gaps = sorted(abs(ratings[user_id_1 - 1] - ratings[user_id_2 - 1]) for user_id_1, user_id_2 in pairs)
+        if not gaps:
+            return
+        self.stdout.write(f"{name}: rating gap {sum(gaps) / len(gaps):.1f} on average, "
+                          f"{gaps[len(gaps) * 95 // 100]:.1f} at the 95th percentile, {gaps[-1]:.1f} at most")
@@ -0,0 +1,16 @@
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from pong.rating.leaderboard import Leaderboard
+
+class Command(BaseCommand):
+    help = "Rebuild the leaderboard from the stored ratings and games, read from the database in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.LEADERBOARD_CONFIG['rebuild_chunk_size'], help='Rows read from the database and written to the leaderboard at once')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        user_count, game_count = Leaderboard.rebuild_from_database(options['chunk_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"Leaderboard rebuilt with {user_count} users and {game_count} games in {elapsed:.2f} s")
@@ -0,0 +1,62 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from usermanagement.models import Games, PlayerRating
+from pong.rating.elo import get_game_scores, replay_games
+from pong.rating.leaderboard import Leaderboard
+from pong.rating.ratings import lock_ratings
+
+class Command(BaseCommand):
+    help = "Recompute every rating by replaying the saved games in chronological order, for backfills and rating formula changes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only print the recomputed ratings, do not save them')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Ratings written per query')
+        parser.add_argument('--top', type=int, default=10, help='Number of the best rated users printed')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not options['dry_run']:
+                # Games that finish meanwhile wait for the new ratings and are rated on top of them
+                lock_ratings()
+            user_ids, ratings, games_played = self._replay()
+            if not options['dry_run']:
+                self._save(user_ids, ratings, games_played, options['batch_size'])
+        if not options['dry_run']:
+            user_count, _ = Leaderboard.rebuild_from_database()
+            self.stdout.write(f"Leaderboard rebuilt with {user_count} users")
+
+        for index in np.argsort(-ratings, kind='stable')[:options['top']]:
+            self.stdout.write(f"User {user_ids[index]}: {ratings[index]:.0f} after {games_played[index]} games")
+
+    def _replay(self):
+        '''Replay every game between two existing users'''
+        games = (Games.objects
+                 .filter(home_id__isnull=False, visitor_id__isnull=False)
+                 .exclude(home_id=F('visitor_id'))
+                 .order_by('created_at', 'id')
+                 .values_list('home_id', 'visitor_id', 'home_score', 'visitor_score'))
+        rows = np.array(list(games), dtype=np.int64).reshape(-1, 4)
+        user_ids, users = np.unique(rows[:, :2], return_inverse=True)
+        users = users.reshape(-1, 2)
+
+        start = time.perf_counter()
+        ratings, games_played = replay_games(users[:, 0], users[:, 1], get_game_scores(rows[:, 2], rows[:, 3]), len(user_ids))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"{len(rows)} games of {len(user_ids)} users replayed in {elapsed * 1e3:.1f} ms")
+        return user_ids, ratings, games_played
+
+    def _save(self, user_ids: np.ndarray, ratings: np.ndarray, games_played: np.ndarray, batch_size: int) -> None:
+        '''Replace the stored ratings with the recomputed ones'''
+        PlayerRating.objects.exclude(user_id__in=user_ids.tolist()).delete()
+        PlayerRating.objects.bulk_create(
+            [PlayerRating(user_id=user_id, rating=rating, games_played=count)
+             for user_id, rating, count in zip(user_ids.tolist(), ratings.tolist(), games_played.tolist())],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['rating', 'games_played', 'updated_at']
+        )
+        self.stdout.write(f"{len(user_ids)} ratings saved")
@@ -0,0 +1,40 @@
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pong.match.match_recorder import MatchRecording, get_recording_path
+
+class Command(BaseCommand):
+    help = "Re-simulate a recorded match headlessly and check the recorded score"
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording', help='Match id or path of a recording file')
+        parser.add_argument('--verify', action='store_true', help='Fail if the simulated goals differ from the recorded ones')
+
+    def handle(self, *args, **options):
+        path = options['recording']
+        if not os.path.isfile(path):
+            path = get_recording_path(path)
+        try:
+            recording = MatchRecording.load(path)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot load recording {options['recording']}: {e}")
+
+        start = time.perf_counter()
+        try:
+            result = recording.verify()
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - start
+
+        simulated_time = result['ticks'] / settings.MATCH_CONFIG['simulation_rate']
+        self.stdout.write(f"Replayed {result['ticks']} ticks ({simulated_time:.1f}s of play) in {elapsed:.3f}s, "
+                          f"{simulated_time / elapsed if elapsed > 0 else float('inf'):.0f}x real time")
+        self.stdout.write(f"Simulated score: {result['score'][0]} - {result['score'][1]}")
+        self.stdout.write(f"Recorded score: {result['recorded_score'][0]} - {result['recorded_score'][1]}")
+        if result['is_consistent']:
+            self.stdout.write(self.style.SUCCESS("Replay matches the recording"))
+        elif options['verify']:
+            raise CommandError("Replay does not match the recording")
+        else:
+            self.stdout.write(self.style.WARNING("Replay does not match the recording"))
@@ -0,0 +1,41 @@
+import asyncio
+import time
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.layers import InMemoryChannelLayer, channel_layers
+from django.core.management.base import BaseCommand
+from pong.match.clock import VirtualClock
+from pong.match.match_session import MatchSession
+from pong.match.tick_scheduler import TickScheduler
+
+class Command(BaseCommand):
+    help = "Play complete local matches on a virtual clock, minutes of play pass in the time their ticks take to compute"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=1000, help='Number of matches played at the same time')
+        parser.add_argument('--first-user-id', type=int, default=1, help='User id of the first match, the others count up from it')
+
+    def handle(self, *args, **options):
+        # Nobody listens to the match groups, the messages do not have to leave the process
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+        clock = VirtualClock()
+
+        start = time.perf_counter()
+        durations = asyncio.run(clock.run(self._play(clock, options['matches'], options['first_user_id'])))
+        elapsed = time.perf_counter() - start
+
+        simulated = clock.now()
+        self.stdout.write(f"{len(durations)} matches played in {elapsed:.2f} s, {simulated:.0f} s of virtual time ({simulated / elapsed:.0f}x real time)")
+        self.stdout.write(f"Match duration: {min(durations):.1f} s min, {sum(durations) / len(durations):.1f} s mean, {max(durations):.1f} s max")
+        self.stdout.write(f"Max tick lag: {TickScheduler.get_instance(clock).get_max_tick_lag() * 1e3:.1f} ms")
+
+    async def _play(self, clock: VirtualClock, match_count: int, first_user_id: int) -> list:
+        '''Start every match at once and wait until all of them are over, returns their durations as they all start at 0'''
+        loop = asyncio.get_running_loop()
+        finished = [loop.create_future() for _ in range(match_count)]
+
+        for index, user_id in enumerate(range(first_user_id, first_user_id + match_count)):
+            def on_match_finished(match_id: str, winner: int, future: asyncio.Future = finished[index]) -> None:
+                future.set_result(clock.now())
+            match = MatchSession(user_id, None, on_match_finished, clock, is_recorded=False)
+            await match.connect_user(user_id)
+        return await asyncio.gather(*finished)
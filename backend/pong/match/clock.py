@@ -0,0 +1,112 @@
+import asyncio
+from abc import ABC, abstractmethod
+import heapq
+import itertools
+import time
+from typing import Awaitable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SETTLE_ROUNDS = 10      # Event loop rounds without progress after which a virtual clock counts as idle
+IDLE_REAL_WAIT = 0.01   # Real seconds a virtual clock waits when nothing sleeps on it, e.g. during a database call
+
+class Clock(ABC):
+    '''Source of the time and the sleeps of the match and tournament sessions'''
+
+    @abstractmethod
+    def now(self) -> float:
+        '''Get the current time in seconds, only differences between two calls are meaningful'''
+
+    @abstractmethod
+    async def sleep(self, seconds: float) -> None:
+        '''Sleep for a number of seconds'''
+
+    async def wait_for(self, awaitable: Awaitable[T], timeout: float) -> T:
+        '''Wait for an awaitable for at most timeout seconds, raises asyncio.TimeoutError after that'''
+        task = asyncio.ensure_future(awaitable)
+        timer = asyncio.ensure_future(self.sleep(timeout))
+        try:
+            await asyncio.wait({task, timer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            timer.cancel()
+            if not task.done():
+                task.cancel()
+        if task.done():
+            return task.result()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        raise asyncio.TimeoutError
+
+
+class RealClock(Clock):
+    '''The wall clock of the event loop'''
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def wait_for(self, awaitable: Awaitable[T], timeout: float) -> T:
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+class VirtualClock(Clock):
+    '''Time that only moves when everything waits for it
+
+    The sleepers are kept in a heap by deadline. While run drives an awaitable, the time jumps to the
+    next deadline as soon as the event loop has nothing else to do, so a match or a tournament takes
+    as long as its ticks take to compute instead of its real duration.'''
+
+    def __init__(self, start: float = 0.0, settle_rounds: int = SETTLE_ROUNDS) -> None:
+        self._now: float = start
+        self._settle_rounds: int = settle_rounds
+        self._sleepers: List[Tuple[float, int, asyncio.Future]] = [] # Heap of deadline, order of sleeping, waker
+        self._order = itertools.count()
+
+    def now(self) -> float:
+        return self._now
+
+    async def sleep(self, seconds: float) -> None:
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        waker = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + seconds, next(self._order), waker))
+        await waker
+
+    def advance(self) -> bool:
+        '''Jump to the next deadline and wake up its sleepers, False if nobody sleeps'''
+        while self._sleepers and self._sleepers[0][2].done():
+            heapq.heappop(self._sleepers) # Cancelled sleep
+        if not self._sleepers:
+            return False
+        self._now = max(self._now, self._sleepers[0][0])
+        while self._sleepers and self._sleepers[0][0] <= self._now:
+            _, _, waker = heapq.heappop(self._sleepers)
+            if not waker.done():
+                waker.set_result(None)
+        return True
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        '''Run an awaitable to its end, fast-forwarding whenever every task waits for the clock'''
+        task = asyncio.ensure_future(awaitable)
+        while not task.done():
+            for _ in range(self._settle_rounds):
+                await asyncio.sleep(0)
+                if task.done():
+                    break
+            else:
+                if not self.advance():
+                    # Nobody sleeps, the task waits for something else, e.g. the database
+                    await asyncio.wait({task}, timeout=IDLE_REAL_WAIT)
+        return task.result()
+
+
+REAL_CLOCK = RealClock()
+
+def get_clock(clock: Optional[Clock] = None) -> Clock:
+    '''Get the clock to use, the real one if none is given'''
+    return clock if clock is not None else REAL_CLOCK
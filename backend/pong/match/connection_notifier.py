@@ -0,0 +1,37 @@
+import asyncio
+from typing import Callable, Dict
+from .timeout_wheel import TimeoutWheel
+
+class ConnectionNotifier:
+    '''Wakes up the waits of a match for its users as soon as the connections change
+
+    A wait is a condition on the connected users with a future that is resolved by notify once the
+    condition holds, or by a timeout of the shared TimeoutWheel. Nothing runs while a wait is pending.'''
+
+    def __init__(self, timeouts: TimeoutWheel) -> None:
+        self._timeouts: TimeoutWheel = timeouts
+        self._waiters: Dict[asyncio.Future, Callable[[], bool]] = {}
+
+    async def wait_until(self, condition: Callable[[], bool], timeout: float) -> bool:
+        '''Wait until the condition holds, False if it did not within timeout seconds'''
+        if condition():
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[waiter] = condition
+        handle = self._timeouts.schedule(timeout, lambda: waiter.done() or waiter.set_result(False))
+        try:
+            return await waiter
+        finally:
+            handle.cancel()
+            self._waiters.pop(waiter, None)
+
+    def notify(self) -> None:
+        '''Resolve the waits whose condition holds now, called on every change of the connections'''
+        for waiter, condition in list(self._waiters.items()):
+            if not waiter.done() and condition():
+                waiter.set_result(True)
+                del self._waiters[waiter]
+
+    def get_waiter_count(self) -> int:
+        '''Get the number of pending waits'''
+        return len(self._waiters)
@@ -0,0 +1,262 @@
+'''Append-only binary log of a match, enough to replay it with the deterministic game session
+
+File layout, little-endian:
+    header: magic (4s), format version (B), seed (Q), user id 1 and 2 (II, 0 for a local match), config length (I)
+    config: JSON of the settings that influence the simulation
+    records: type (B), tick (I) and a payload depending on the type
+The tick of a record is the number of simulation steps done when it happened,
+so an input recorded at tick n is applied before step n + 1.'''
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from .protocol import GameState
+
+logger = logging.getLogger("match")
+
+RECORD_MATCHES = settings.MATCH_CONFIG.get('record_matches', False)
+RECORDINGS_DIR = os.path.join(settings.BASE_DIR, settings.MATCH_CONFIG.get('recordings_dir', 'recordings'))
+RETENTION_TIME = settings.MATCH_CONFIG.get('recordings_retention_days', 0) * 24 * 3600
+PRUNE_INTERVAL = 3600 # Seconds between two deletions of the expired recordings
+FLUSH_SIZE = 4096 # Bytes buffered before they are written
+
+MAGIC = b'PREC'
+FORMAT_VERSION = 1
+SEED = 0 # The simulation has no randomness, the seed is reserved for when it gets some
+
+HEADER = struct.Struct('<4sBQIII')
+RECORD_HEADER = struct.Struct('<BI')
+
+# Record types and their payload
+INPUT = 1   # player id (B), direction (b)
+SCORE = 2   # player that scored (B), score of player 1 and 2 (HH)
+END = 3     # end reason (B), winner player id (B, 255 if none)
+
+PAYLOADS = {
+    INPUT: struct.Struct('<Bb'),
+    SCORE: struct.Struct('<BHH'),
+    END: struct.Struct('<BB'),
+}
+RECORDS = {record_type: struct.Struct(RECORD_HEADER.format + payload.format[1:]) for record_type, payload in PAYLOADS.items()}
+
+NO_WINNER = 255
+
+# One thread for every recorder, so the writes of a file stay in order and the tick is never blocked by disk I/O
+_executor: Optional[ThreadPoolExecutor] = None
+_next_prune_time: float = 0.0
+
+def _get_executor() -> ThreadPoolExecutor:
+    '''Get the thread that writes the recordings'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="match-recorder")
+    return _executor
+
+def get_simulation_config() -> Dict:
+    '''Get the settings that change the outcome of a simulation'''
+    return {
+        "game": settings.GAME_CONFIG,
+        "simulation_rate": settings.MATCH_CONFIG['simulation_rate'],
+    }
+
+def get_recording_path(match_id: str) -> str:
+    '''Get the file a match is recorded to'''
+    return os.path.join(RECORDINGS_DIR, f"{match_id}.rec")
+
+def _append(path: str, data: bytes) -> None:
+    '''Append data to a file, runs on the recorder thread'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as file:
+        file.write(data)
+
+def prune_recordings(max_age: float, directory: str = RECORDINGS_DIR) -> int:
+    '''Delete the recordings that were last written more than max_age seconds ago, returns how many'''
+    expiry = time.time() - max_age
+    deleted = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.endswith('.rec') and entry.stat().st_mtime < expiry:
+                os.remove(entry.path)
+                deleted += 1
+        except OSError as e:
+            logger.error(f"Failed to delete expired recording {entry.path}: {e}")
+    if deleted:
+        logger.info(f"Deleted {deleted} expired match recordings")
+    return deleted
+
+def _schedule_prune() -> None:
+    '''Delete the expired recordings on the recorder thread, at most once per prune interval'''
+    global _next_prune_time
+    now = time.monotonic()
+    if RETENTION_TIME <= 0 or now < _next_prune_time:
+        return
+    _next_prune_time = now + PRUNE_INTERVAL
+    _get_executor().submit(prune_recordings, RETENTION_TIME)
+
+
+class MatchRecorder:
+    '''Records the inputs of a match into a buffered append-only file'''
+
+    def __init__(self, match_id: str, user_id_1: int, user_id_2: Optional[int], path: Optional[str] = None) -> None:
+        self._path = path or get_recording_path(match_id)
+        _schedule_prune()
+        self._buffer = bytearray()
+        self._is_closed = False
+        config = json.dumps(get_simulation_config()).encode()
+        self._buffer += HEADER.pack(MAGIC, FORMAT_VERSION, SEED, user_id_1, user_id_2 or 0, len(config))
+        self._buffer += config
+
+    def record_input(self, tick: int, player_id: int, direction: int) -> None:
+        '''Record a direction change of a player'''
+        self._record(RECORDS[INPUT].pack(INPUT, tick, player_id, direction))
+
+    def record_score(self, tick: int, player_id: int, score_1: int, score_2: int) -> None:
+        '''Record a goal, the scores let a replay be checked against the live match'''
+        self._record(RECORDS[SCORE].pack(SCORE, tick, player_id, score_1, score_2))
+        self.flush() # Never lose more than the current rally
+
+    def close(self, tick: int, reason: int, winner: Optional[int]) -> Optional[asyncio.Future]:
+        '''Record the end of the match and write everything that is still buffered, returns the write'''
+        if self._is_closed:
+            return None
+        self._record(RECORDS[END].pack(END, tick, reason, winner if winner is not None else NO_WINNER))
+        self._is_closed = True
+        return self.flush()
+
+    def _record(self, record: bytes) -> None:
+        '''Buffer a record'''
+        if self._is_closed:
+            return
+        self._buffer += record
+        if len(self._buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> Optional[asyncio.Future]:
+        '''Hand the buffered records to the recorder thread, returns the write'''
+        if not self._buffer:
+            return None
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        future = asyncio.get_running_loop().run_in_executor(_get_executor(), _append, self._path, data)
+        future.add_done_callback(self._on_flushed)
+        return future
+
+    def _on_flushed(self, future: asyncio.Future) -> None:
+        '''Log failed writes, the match itself goes on'''
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Failed to write match recording {self._path}: {future.exception()}")
+
+
+class MatchRecording:
+    '''A recording read back from its file'''
+
+    def __init__(self, user_id_1: int, user_id_2: Optional[int], seed: int, config: Dict, records: List[Tuple]) -> None:
+        self.user_id_1 = user_id_1
+        self.user_id_2 = user_id_2
+        self.seed = seed
+        self.config = config
+        self.records = records # (type, tick, *payload)
+
+    @classmethod
+    def load(cls, path: str) -> 'MatchRecording':
+        '''Read a recording, raises ValueError if the file is not a valid recording'''
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            raise ValueError("File too short for a match recording")
+        magic, version, seed, user_id_1, user_id_2, config_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a match recording")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording format version {version}")
+        offset = HEADER.size
+        config = json.loads(data[offset:offset + config_length])
+        offset += config_length
+
+        records = []
+        while offset < len(data):
+            record_type = data[offset]
+            record = RECORDS.get(record_type)
+            if record is None or offset + record.size > len(data):
+                # A crash can leave a truncated record at the end
+                logger.warning(f"Recording {path} ends with an incomplete record")
+                break
+            records.append(record.unpack_from(data, offset))
+            offset += record.size
+        return cls(user_id_1, user_id_2 or None, seed, config, records)
+
+    def get_inputs(self) -> Iterator[Tuple[int, int, int]]:
+        '''Get the inputs as (tick, player id, direction)'''
+        for record in self.records:
+            if record[0] == INPUT:
+                yield record[1], record[2], record[3]
+
+    def get_end(self) -> Optional[Tuple[int, int, Optional[int]]]:
+        '''Get the end of the match as (tick, reason, winner), None if the recording has no end'''
+        for record in reversed(self.records):
+            if record[0] == END:
+                return record[1], record[2], record[3] if record[3] != NO_WINNER else None
+        return None
+
+    def get_last_tick(self) -> int:
+        '''Get the tick the match ended at, or the tick of the last record if the recording has no end'''
+        end = self.get_end()
+        return end[0] if end is not None else max((record[1] for record in self.records), default=0)
+
+    def is_viewable_by(self, user) -> bool:
+        '''Check if a user may replay or verify the match, only its players and the staff can'''
+        return user.id is not None and (user.id in (self.user_id_1, self.user_id_2) or user.is_staff)
+
+    def get_scores(self) -> List[Tuple[int, int, int, int]]:
+        '''Get the goals as (tick, player id, score 1, score 2)'''
+        return [record[1:] for record in self.records if record[0] == SCORE]
+
+    def replay(self) -> Iterator[Tuple[int, GameState, Optional[int]]]:
+        '''Simulate the recorded match step by step, yields (tick, state, player that scored or None)
+
+        Raises ValueError if the recording was made with different simulation settings.'''
+        from ..game_logic.game_session import GameSession
+
+        if self.config != json.loads(json.dumps(get_simulation_config())):
+            raise ValueError("The recording was made with different simulation settings")
+        last_tick = self.get_last_tick()
+
+        session = GameSession(None)
+        inputs = list(self.get_inputs())
+        next_input = 0
+        while session.get_tick() < last_tick:
+            while next_input < len(inputs) and inputs[next_input][0] <= session.get_tick():
+                _, player_id, direction = inputs[next_input]
+                session.update_player_direction(player_id, direction)
+                next_input += 1
+            scored = session.step()
+            yield session.get_tick(), session.get_state(), scored
+
+    def verify(self) -> Dict:
+        '''Replay the match and check that the simulation scores the recorded goals at the recorded ticks'''
+        simulated_goals = []
+        ticks = 0
+        for tick, _, scored in self.replay():
+            ticks = tick
+            if scored is not None:
+                simulated_goals.append((tick, scored))
+        recorded_goals = [(tick, player_id) for tick, player_id, _, _ in self.get_scores()]
+        end = self.get_end()
+        return {
+            "ticks": ticks,
+            "score": [sum(1 for _, player_id in simulated_goals if player_id == player) for player in (0, 1)],
+            "recorded_score": [sum(1 for _, player_id in recorded_goals if player_id == player) for player in (0, 1)],
+            "end_reason": end[1] if end is not None else None,
+            "winner": end[2] if end is not None else None,
+            "is_consistent": simulated_goals == recorded_goals,
+        }
@@ -0,0 +1,99 @@
+'''Relay between the MatchConsumers of other nodes and the matches owned by this node
+
+Every node that owns matches listens on its own channel, announced in the registry backend.
+A MatchConsumer on another node joins the match group (groups span every node, so the state and
+control frames reach it as usual) and forwards connect, input and disconnect to the owner's channel.
+The owner answers on the consumer's channel, with the game over frame or a rejection.'''
+
+import asyncio
+import logging
+from typing import Optional
+from channels.layers import get_channel_layer
+from ..data_managment.registry_backend import NODE_ID, get_registry_backend, is_node_alive
+
+logger = logging.getLogger("match")
+
+NODE_CHANNEL = "pong:node_channel" # node_id -> channel the relay of the node listens on
+
+# Messages sent to the relay of the owner
+CONNECT = "relay.connect"
+INPUT = "relay.input"
+DISCONNECT = "relay.disconnect"
+
+# Messages sent back to the MatchConsumer
+GAME_OVER = "relay.game_over"
+REJECTED = "relay.rejected"
+
+class MatchRelay:
+    '''Serves the relayed connections to the matches of this node'''
+
+    _instance: Optional['MatchRelay'] = None
+
+    @classmethod
+    def get_instance(cls) -> 'MatchRelay':
+        '''Get the relay of this node'''
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self) -> None:
+        self._channel_layer = get_channel_layer()
+        self._channel_name: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        '''Start listening, only needed if other nodes share the registry'''
+        if self._task is None and get_registry_backend().is_shared:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        '''Announce the channel of this node and handle the relayed messages'''
+        self._channel_name = await self._channel_layer.new_channel("match_relay.")
+        await get_registry_backend().hash_set(NODE_CHANNEL, NODE_ID, self._channel_name)
+        logger.info(f"Match relay of node {NODE_ID} listening on {self._channel_name}")
+        while True:
+            message = await self._channel_layer.receive(self._channel_name)
+            try:
+                await self._handle(message)
+            except Exception as e:
+                logger.error(f"Failed to handle relayed message {message.get('type')}: {e}")
+
+    async def _handle(self, message: dict) -> None:
+        '''Apply a message of a relayed MatchConsumer to its match'''
+        from ..data_managment.matches import Matches
+
+        match = Matches.get_match(message["match_id"])
+        user_id = message["user_id"]
+        message_type = message["type"]
+        if message_type == CONNECT:
+            reply_channel = message["reply_channel"]
+            if match is None or not match.is_user_assigned(user_id) or match.is_user_blocked(user_id):
+                await self._channel_layer.send(reply_channel, {"type": REJECTED})
+                return
+            # Not awaited, ending the match on connect must not hold up the other relayed messages
+            asyncio.create_task(match.connect_user(user_id, self._game_over_callback(match, reply_channel)))
+        elif match is None:
+            return
+        elif message_type == INPUT:
+            await match.update_player_direction(user_id, message["direction"], message["player_id"])
+        elif message_type == DISCONNECT:
+            # Waits for the reconnect timeout
+            asyncio.create_task(match.disconnect_user(user_id))
+        else:
+            logger.error(f"Invalid relayed message type: {message_type}")
+
+    def _game_over_callback(self, match, reply_channel: str):
+        '''Get the on_match_finished callback of a relayed user, it sends the game over frame back'''
+        async def send_game_over(winner: Optional[int], loser: Optional[int]) -> None:
+            await self._channel_layer.send(reply_channel, {
+                "type": GAME_OVER,
+                "data": match.pack_game_over_message(winner, loser)
+            })
+        return send_game_over
+
+    @staticmethod
+    async def get_owner_channel(owner_node_id: Optional[str]) -> Optional[str]:
+        '''Get the relay channel of the node that owns a match, None if that node is gone or is this one'''
+        if owner_node_id is None or owner_node_id == NODE_ID or not await is_node_alive(owner_node_id):
+            return None
+        return await get_registry_backend().hash_get(NODE_CHANNEL, owner_node_id)
@@ -1,11 +1,18 @@
-from typing import Optional, Callable
-from ..game_logic.game_session import GameSession
+from typing import Optional, Callable, List
+from ..game_logic.game_session import create_game_session
+from .tick_scheduler import TickScheduler
+from .clock import Clock, get_clock
+from .timeout_wheel import TimeoutWheel
+from .connection_notifier import ConnectionNotifier
+from .protocol import FrameEncoder, merge_state_frames
+from .match_recorder import MatchRecorder, RECORD_MATCHES
+from ..data_managment.match_consumers import MatchConsumers
+from ..consumers.outbound_mailbox import OutboundMailbox
 from channels.layers import get_channel_layer
-from usermanagement.models import CustomUser, Games
+from ..rating.ratings import save_game
 from asgiref.sync import sync_to_async
 import asyncio
 import logging
-import time
 from enum import Enum, auto
 from uuid import uuid4
 from django.conf import settings
@@ -17,10 +24,22 @@ MATCH_CONNECT_TIMEOUT = settings.MATCH_CONFIG['match_connect_timeout']
 RECONNECT_TIMEOUT = settings.MATCH_CONFIG['reconnect_timeout']
 MATCH_START_TIMER = settings.MATCH_CONFIG['match_start_timer']
 
-TICK_RATE = settings.MATCH_CONFIG['tick_rate']
-
 SCORE_LIMIT = settings.MATCH_CONFIG['score_limit']
 
+SEND_INTERVAL = 1 / settings.MATCH_CONFIG['send_rate']
+SPECTATOR_SEND_INTERVAL = 1 / settings.MATCH_CONFIG['spectator_send_rate']
+SEND_TOLERANCE = 0.5 / settings.MATCH_CONFIG['tick_rate'] # Half a tick, absorbs the jitter of the scheduler wake-ups
+
+def advance_cadence(now: float, next_send_time: float, interval: float) -> Optional[float]:
+    '''Get the time of the following send if a send is due now, None if it is not due yet'''
+    if now + SEND_TOLERANCE < next_send_time:
+        return None
+    next_send_time += interval
+    if next_send_time < now:
+        # First send or fell behind, restart the cadence from now
+        next_send_time = now + interval
+    return next_send_time
+
 class EndReason(Enum):
     DISCONNECT_TIMEOUT = auto()
     DISCONNECTED_TOO_MANY_TIMES = auto()
@@ -28,60 +47,88 @@ class EndReason(Enum):
     DRAW = auto()
     SCORE = auto()
     LOCAL_MATCH_ABORTED = auto()
+    SIMULATION_FAILED = auto()
 
 class MatchSession:
-    def __init__(self, user_id_1: int, user_id_2: Optional[int], on_match_finished: Optional[Callable[[int, int], None]] = None):
-        '''Initialize and start a match between two users'''
+    def __init__(self, user_id_1: int, user_id_2: Optional[int], on_match_finished: Optional[Callable[[int, int], None]] = None,
+                 clock: Optional[Clock] = None, is_recorded: bool = RECORD_MATCHES):
+        '''Initialize and start a match between two users, every wait of the match runs on the clock'''
+        self._clock = get_clock(clock)
         self._match_id = str(uuid4())
         self._assigned_users = [user_id_1, user_id_2] if user_id_2 is not None else [user_id_1]
         self._blocked_users = set()
         self._connected_users = set()
+        self._connections = ConnectionNotifier(TimeoutWheel.get_instance(self._clock)) # Wakes up the waits for the users to (re)connect
         self._disconnect_count = {user_id_1: 0, user_id_2: 0} if user_id_2 is not None else {user_id_1: 0}
         self._player_mapping = {user_id_1: 0, user_id_2: 1} if user_id_2 is not None else {user_id_1: 0}
         self._is_local_match = user_id_2 is None
         self._score = {0: 0, 1: 0}
-        self._game_session = GameSession(self._user_scored)
-        self._main_loop_task: Optional[asyncio.Task] = asyncio.create_task(self._main_loop())
+        self._game_session = create_game_session(self._user_scored, self._input_applied, self._simulation_failed, self._clock)
+        self._encoder = FrameEncoder()
+        self._spectator_encoder = FrameEncoder() # Spectators get their own, lower rate delta stream
+        self._spectator_count = 0
+        self._spectators = OutboundMailbox(self._send_to_spectators, merge_state_frames)
+        self._recorder: Optional[MatchRecorder] = MatchRecorder(self._match_id, user_id_1, user_id_2) if is_recorded else None
         self._on_match_finished = on_match_finished
         self._on_match_finished_user_callbacks = {user_id_1: None, user_id_2: None} if user_id_2 is not None else {user_id_1: None}
-        self._tick_speed = 1 / TICK_RATE
         self._is_match_running = False
         self._stop_requested = False
         self._channel_layer = get_channel_layer()
         self._is_game_stopped = True
+        self._start_task: Optional[asyncio.Task] = None # Waits for the users and runs the start timer
+        self._end_task: Optional[asyncio.Task] = None
+        self._last_tick_time: Optional[float] = None
+        self._next_send_time: float = 0.0
+        self._next_spectator_send_time: float = 0.0
+        self._is_delivered_locally: Optional[bool] = None # Path of the last position update, None before the first one
+        self._scheduler = TickScheduler.get_instance(self._clock)
+        self._scheduler.register(self)
 
     def __del__(self):
         '''Destructor'''
         logger.debug(f"Deleted match session {self._match_id}")
 
-    async def _main_loop(self) -> None:
-        '''Main loop of the match'''
-        last_time = time.time()
-        while not self._stop_requested:
-            current_time = time.time()
-            delta_time = current_time - last_time
-            last_time = current_time
-
-            if not self._is_match_running:
-                await self._monitor_match_start()
-                self._is_match_running = True
-            if self._is_game_stopped:
-                await self._start_timer()
-                self._is_game_stopped = False
-                # Reset last_time after the timer to avoid large delta_time
-                last_time = time.time()
-            if self.is_every_user_connected() and not self._stop_requested:
-                await self._game_session.calculate_game_state(delta_time)
+    async def tick(self, now: float) -> None:
+        '''Advance the match by one tick of the TickScheduler'''
+        if self._stop_requested:
+            return
+        if not self._is_match_running or self._is_game_stopped:
+            # The waiting phases run in their own task so they do not hold up the scheduler
+            if self._start_task is None:
+                self._start_task = asyncio.create_task(self._prepare_game())
+            return
+
+        delta_time = now - self._last_tick_time if self._last_tick_time is not None else 0
+        self._last_tick_time = now
+        if self.is_every_user_connected():
+            await self._game_session.calculate_game_state(delta_time)
+            # The state is sent at the send rate, independent of the tick and simulation rate
+            next_send_time = advance_cadence(now, self._next_send_time, SEND_INTERVAL)
+            if next_send_time is not None:
+                self._next_send_time = next_send_time
                 await self._send_position_update()
-            if not self._stop_requested:
-                await asyncio.sleep(self._tick_speed)
+            else:
+                self._encoder.skip_state(self._game_session.get_state())
+            if self._spectator_count > 0:
+                self._update_spectators(now)
+
+    async def _prepare_game(self) -> None:
+        '''Wait for the users to connect and run the start timer before the game (re)starts'''
+        if not self._is_match_running:
+            await self._monitor_match_start()
+            self._is_match_running = True
+        await self._start_timer()
+        self._is_game_stopped = False
+        # Reset the tick time after the timer to avoid a large delta_time
+        self._last_tick_time = None
+        self._start_task = None
 
     async def _end_match(self, reason: EndReason) -> None:
         '''End the match'''
         self._stop_requested = True
         
         # Add a small delay to ensure all messages before the end message are sent
-        await asyncio.sleep(0.1)
+        await self._clock.sleep(0.1)
 
         logger.debug(f"Ending match {self._match_id}")
         winner = None
@@ -113,6 +160,10 @@ class MatchSession:
         elif reason == EndReason.LOCAL_MATCH_ABORTED:
             await self._match_finished(self._match_id, None, False)
             logger.debug("Match ended due to local match abort")
+        elif reason == EndReason.SIMULATION_FAILED:
+            # The game state is lost, the match has no result
+            await self._match_finished(self._match_id, None, False)
+            logger.debug("Match ended because its simulation failed")
         else:
             logger.error("Invalid end reason")
 
@@ -127,17 +178,28 @@ class MatchSession:
         else:
             loser = None
 
+        if self._recorder is not None:
+            self._recorder.close(self._game_session.get_tick(), reason.value, winner)
+
+        self._queue_spectator_message(lambda encoder: encoder.game_over(self._game_session.get_tick(), winner, loser))
+        await self._spectators.drain()
+        await self._spectators.close()
+
         # Call the MatchConsumer to disconnect the users
         for user_id, callback in self._on_match_finished_user_callbacks.items():
             if callback is not None:
                 await callback(winner, loser)
 
-        # Stop the main loop
-        self._main_loop_task.cancel()
-        try:
-            await self._main_loop_task
-        except asyncio.CancelledError:
-            pass
+        # Stop ticking and the waiting phases
+        self._scheduler.unregister(self)
+        if self._start_task is not None and self._start_task is not asyncio.current_task():
+            self._start_task.cancel()
+            try:
+                await self._start_task
+            except asyncio.CancelledError:
+                pass
+
+        self._game_session.close()
 
         # Delete itself
         del self
@@ -148,17 +210,8 @@ class MatchSession:
         if write_to_db and not self._is_local_match:
             try:
                 assigned_users = self._assigned_users
-                home_user = await sync_to_async(CustomUser.objects.get)(id=assigned_users[0])
-                visitor_user = await sync_to_async(CustomUser.objects.get)(id=assigned_users[1])
-
-                game = Games(
-                    home_id=home_user,
-                    visitor_id=visitor_user,
-                    home_score=self._score[0],
-                    visitor_score=self._score[1]
-                )
-
-                await sync_to_async(game.save)()
+                # The game and the new ratings of both users are saved together or not at all
+                game = await sync_to_async(save_game)(assigned_users[0], assigned_users[1], self._score[0], self._score[1])
                 logger.info(f"Game saved with ID: {game.id}")
             except Exception as e:
                 logger.error(f"Error saving game to database: {e}")
@@ -179,41 +232,29 @@ class MatchSession:
 
     async def _monitor_disconnect_timeout(self, user_id: int) -> None:
         '''Monitor the disconnect timeout'''
-        try:
-            await asyncio.wait_for(self._wait_for_user_reconnect(user_id), timeout=RECONNECT_TIMEOUT)
+        if await self._connections.wait_until(lambda: user_id in self._connected_users, RECONNECT_TIMEOUT):
             logger.debug(f"User {user_id} reconnected")
-        except asyncio.TimeoutError:
-            logger.debug(f"User {user_id} did not reconnect in time")
-            self._blocked_users.add(user_id)
-            if not self._is_local_match:
-                if self._connected_users: # If there is still a user connected he wins
-                    await self._end_match(EndReason.DISCONNECT_TIMEOUT)
-                elif len(self._assigned_users) == len(self._blocked_users): # If all users are blocked (Did not reconnect in time) it's a draw
-                    await self._end_match(EndReason.DRAW)
-            else:
-                await self._end_match(EndReason.LOCAL_MATCH_ABORTED) # If it's a local match, end it
-
-    async def _wait_for_user_reconnect(self, user_id: int) -> None:
-        '''Wait for a user to reconnect'''
-        while user_id not in self._connected_users:
-            await asyncio.sleep(0.1)
+            return
+        logger.debug(f"User {user_id} did not reconnect in time")
+        self._blocked_users.add(user_id)
+        if not self._is_local_match:
+            if self._connected_users: # If there is still a user connected he wins
+                await self._end_match(EndReason.DISCONNECT_TIMEOUT)
+            elif len(self._assigned_users) == len(self._blocked_users): # If all users are blocked (Did not reconnect in time) it's a draw
+                await self._end_match(EndReason.DRAW)
+        else:
+            await self._end_match(EndReason.LOCAL_MATCH_ABORTED) # If it's a local match, end it
 
     async def _monitor_match_start(self) -> None:
         '''Monitor the start of the match, will end the match if not all users connect in time'''
         if self._stop_requested:
             return
-        try:
-            await asyncio.wait_for(self._wait_for_users_to_connect(), timeout=MATCH_CONNECT_TIMEOUT)
+        if await self._connections.wait_until(self.is_every_user_connected, MATCH_CONNECT_TIMEOUT):
             logger.debug("All users connected, match starting.")
-        except asyncio.TimeoutError:
+        else:
             logger.debug("Match start timeout, not all users connected.")
             await self._end_match(EndReason.MATCH_CONNECT_TIMEOUT)
 
-    async def _wait_for_users_to_connect(self) -> None:
-        '''Wait until both users are connected'''
-        while len(self._connected_users) < len(self._assigned_users):
-            await asyncio.sleep(0.1)
-
     async def _send_initialisation_messages(self) -> None:
         '''Send the necessary messages to the users'''
         await self._send_user_mapping()
@@ -233,9 +274,12 @@ class MatchSession:
             logger.error(f"User {user_id} not assigned to the match")
             return
         self._connected_users.add(user_id)
+        self._connections.notify()
         self._on_match_finished_user_callbacks[user_id] = on_match_finished
         logger.debug(f"User {user_id} connected to match {self._match_id}")
 
+        # The new connection has no state to apply deltas to
+        self._encoder.request_keyframe()
         await self._send_initialisation_messages()
 
         # Check if a blocked user exists and end the match if only one user is left
@@ -267,6 +311,64 @@ class MatchSession:
         await self._monitor_disconnect_timeout(user_id)
         return True
 
+    #############################
+    #        Spectators         #
+    #############################
+
+    def get_spectator_group(self) -> str:
+        '''Get the channel group the spectators of the match listen to'''
+        return f"{self._match_id}.spectators"
+
+    def add_spectator(self) -> None:
+        '''Count a spectator that joined the spectator group and send it the state of the match'''
+        if self._stop_requested:
+            return
+        self._spectator_count += 1
+        self._spectators.start()
+        tick = self._game_session.get_tick()
+        user_id_2 = self._assigned_users[1] if not self._is_local_match else None
+        self._queue_spectator_message(lambda encoder: encoder.user_mapping(tick, self._is_local_match, self._assigned_users[0], user_id_2))
+        self._queue_spectator_message(lambda encoder: encoder.player_scores(tick, self._score[0], self._score[1]))
+        # The new spectator has no state to apply deltas to
+        self._spectator_encoder.request_keyframe()
+        self._spectators.put_snapshot(self._spectator_encoder.state(tick, self._game_session.get_state()))
+
+    def remove_spectator(self) -> None:
+        '''Count a spectator that left'''
+        self._spectator_count = max(self._spectator_count - 1, 0)
+
+    def get_spectator_count(self) -> int:
+        '''Get the number of spectators'''
+        return self._spectator_count
+
+    def _update_spectators(self, now: float) -> None:
+        '''Queue the state for the spectators at the spectator send rate
+
+        Only queued here, one group_send per frame reaches every spectator and runs in the writer task
+        of the spectator mailbox, so the tick of the players never waits for it.'''
+        state = self._game_session.get_state()
+        next_send_time = advance_cadence(now, self._next_spectator_send_time, SPECTATOR_SEND_INTERVAL)
+        if next_send_time is not None:
+            self._next_spectator_send_time = next_send_time
+            self._spectators.put_snapshot(self._spectator_encoder.state(self._game_session.get_tick(), state))
+        else:
+            self._spectator_encoder.skip_state(state)
+
+    def _queue_spectator_message(self, pack: Callable[[FrameEncoder], bytes]) -> None:
+        '''Queue a control message for the spectators, packed with their encoder'''
+        if self._spectator_count > 0:
+            self._spectators.put_control(bytes_data=pack(self._spectator_encoder))
+
+    async def _send_to_spectators(self, text_data: str = None, bytes_data: bytes = None) -> None:
+        '''Send a frame to the spectator group, used by the spectator mailbox writer'''
+        try:
+            await self._channel_layer.group_send(self.get_spectator_group(), {
+                "type": "spectator_frame",
+                "data": bytes_data
+            })
+        except Exception as e:
+            logger.error(f"Failed to send to the spectators of match {self._match_id}: {e}")
+
     #############################
     #    Game control functions #
     #############################
@@ -281,10 +383,12 @@ class MatchSession:
             return
         
         # Update the direction of the player, depending on the match type
-        if self._is_local_match:
-            self._game_session.update_player_direction(player_id, direction)
-        else:
-            self._game_session.update_player_direction(self._player_mapping[user_id], direction)
+        if not self._is_local_match:
+            player_id = self._player_mapping[user_id]
+        if player_id not in (0, 1) or direction not in (-1, 0, 1):
+            logger.error(f"Invalid player input: player {player_id}, direction {direction}")
+            return
+        self._game_session.update_player_direction(player_id, direction)
 
 
     async def _start_timer(self) -> None:
@@ -293,21 +397,38 @@ class MatchSession:
             return
         for seconds in range(MATCH_START_TIMER, -1, -1):
             await self._send_start_timer_update_message(seconds)
-            await asyncio.sleep(1)
+            await self._clock.sleep(1)
         logger.debug("Game timer ended, starting game")
 
     #############################
     # Callbacks from the game   #
     #############################
 
-    async def _user_scored(self, player_id: int) -> None:
-        '''Callback when a player scores'''
+    async def _user_scored(self, player_id: int, tick: int) -> None:
+        '''Callback when a player scores, tick is the simulation step of the goal'''
         logger.debug(f"Player {player_id} scored")
         self._score[player_id] += 1
+        if self._recorder is not None:
+            self._recorder.record_score(tick, player_id, self._score[0], self._score[1])
         await self._send_player_scores_message(self._score[0], self._score[1])
         
         if self._score[player_id] >= SCORE_LIMIT:
-            await self._end_match(EndReason.SCORE)
+            # Ended in its own task, this runs inside a tick and must not hold up the scheduler
+            self._stop_requested = True
+            self._end_task = asyncio.create_task(self._end_match(EndReason.SCORE))
+
+    def _input_applied(self, tick: int, player_id: int, direction: int) -> None:
+        '''Callback when the game applies a direction change, tick is the step it is applied before'''
+        if self._recorder is not None:
+            self._recorder.record_input(tick, player_id, direction)
+
+    async def _simulation_failed(self) -> None:
+        '''Callback when the game can no longer be simulated'''
+        if self._stop_requested:
+            return
+        logger.error(f"Simulation of match {self._match_id} failed, ending the match")
+        self._stop_requested = True
+        self._end_task = asyncio.create_task(self._end_match(EndReason.SIMULATION_FAILED))
 
     #############################
     #    Message sending        #
@@ -325,58 +446,66 @@ class MatchSession:
             logger.error(f"Error in _send_user_mapping: {e}")
             return
     
-        message = {
+        await self._channel_layer.group_send(self._match_id, {
             "type": "user_mapping",
-            "is_local_match": self._is_local_match,
-            "player1": user_id_1,
-        }
-    
-        if not self._is_local_match:
-            message["player2"] = user_id_2
-    
-        await self._channel_layer.group_send(self._match_id, message)
+            "data": self._encoder.user_mapping(self._game_session.get_tick(), self._is_local_match, user_id_1, user_id_2)
+        })
 
     async def _send_position_update(self) -> None:
         '''Send the position update to the users'''
-        current_positions = self._game_session.to_bytearray()
-        await self._channel_layer.group_send(self._match_id, {
+        # Hand the update straight to the consumers if every user is connected to this process
+        local_consumers = MatchConsumers.get_local_consumers(self._match_id, self._connected_users)
+        if (local_consumers is not None) != self._is_delivered_locally:
+            # A frame of the new path can overtake the last ones of the old path, the consumers drop
+            # whichever arrives late, so the first frame of the new path must not depend on them
+            self._is_delivered_locally = local_consumers is not None
+            self._encoder.request_keyframe()
+        message = {
             "type": "position_update",
-            "data": current_positions
-        })
+            "data": self._encoder.state(self._game_session.get_tick(), self._game_session.get_state())
+        }
+        if local_consumers is not None:
+            for consumer in local_consumers:
+                await consumer.position_update(message)
+        else:
+            await self._channel_layer.group_send(self._match_id, message)
 
     async def _send_user_disconnected_message(self, user_id: int) -> None:
         '''Send a disconnect message to the users'''
+        self._queue_spectator_message(lambda encoder: encoder.user_disconnected(self._game_session.get_tick(), user_id))
         await self._channel_layer.group_send(self._match_id, {
             "type": "user_disconnected",
-            "user_id": user_id
+            "data": self._encoder.user_disconnected(self._game_session.get_tick(), user_id)
         })
 
     async def _send_start_timer_update_message(self, time: int) -> None:
         '''Send a start timer update message to the users'''
+        self._queue_spectator_message(lambda encoder: encoder.start_timer(self._game_session.get_tick(), time))
         await self._channel_layer.group_send(self._match_id, {
             "type": "start_timer_update",
-            "start_timer": time
+            "data": self._encoder.start_timer(self._game_session.get_tick(), time)
         })
 
-    async def _send_game_over_message(self, winner: int) -> None:
-        '''Send a game over message to the users'''
-        await self._channel_layer.group_send(self._match_id, {
-            "type": "game_over",
-            "data": winner
-        })
+    def pack_game_over_message(self, winner: Optional[int], loser: Optional[int]) -> bytes:
+        '''Pack the game over message, it is sent by each MatchConsumer itself'''
+        return self._encoder.game_over(self._game_session.get_tick(), winner, loser)
     
     async def _send_player_scores_message(self, player1: int, player2: int) -> None:
         '''Send a player scores message to the users'''
+        self._queue_spectator_message(lambda encoder: encoder.player_scores(self._game_session.get_tick(), player1, player2))
         await self._channel_layer.group_send(self._match_id, {
             "type": "player_scores",
-            "player1": player1,
-            "player2": player2
+            "data": self._encoder.player_scores(self._game_session.get_tick(), player1, player2)
         })
 
     #############################
     #    Utility functions      #
     #############################
 
+    def get_assigned_users(self) -> List[int]:
+        '''Get the users that play the match'''
+        return self._assigned_users
+
     def is_user_assigned(self, user_id: int) -> bool:
         '''Check if a user is assigned to the match'''
         return user_id in self._assigned_users
@@ -1,15 +1,23 @@
+import asyncio
 import logging
+import time
 from typing import Dict, Optional, Callable
+from django.conf import settings
 from .match_session import MatchSession
 from channels.layers import get_channel_layer
+from asgiref.sync import sync_to_async
 from ..data_managment.matchmaking_queue import MatchmakingQueue
 from ..data_managment.matches import Matches
 from ..data_managment.user import User
 from ..data_managment.tournaments import Tournaments
+from ..rating.ratings import get_rating
 
 logger = logging.getLogger("match")
 
+MATCHMAKING_INTERVAL = settings.MATCHMAKING_CONFIG['interval']
+
 class MatchSessionHandler:
+    _matchmaking_task: Optional[asyncio.Task] = None # Pairs the users whose windows widened while they waited
 
     @classmethod
     async def create_match(
@@ -21,7 +29,7 @@ class MatchSessionHandler:
         
         match = MatchSession(user1, user2, on_match_finished)
 
-        Matches.add_match(match)
+        await Matches.add_match(match)
 
         logger.info(f"Match created with id {match.get_id()}")
 
@@ -30,11 +38,11 @@ class MatchSessionHandler:
     @classmethod
     async def create_local_match(cls, user_id: int) -> None:
         '''Create a local match'''
-        if MatchmakingQueue.is_user_registered(user_id):
+        if await MatchmakingQueue.is_user_registered(user_id):
             raise ValueError(f"registered to queue")
-        elif Tournaments.is_user_registered(user_id):
+        elif await Tournaments.is_user_registered(user_id):
             raise ValueError(f"registered to tournament")
-        elif Matches.is_user_registered(user_id):
+        elif await Matches.is_user_registered(user_id):
             raise ValueError(f"registered to match")
         match = await cls.create_match(user_id, None, cls.remove_match)
         match_id = match.get_id()
@@ -45,7 +53,7 @@ class MatchSessionHandler:
     @classmethod
     async def remove_match(cls, match_id: str, winner: int) -> None:
         '''Remove a match reference'''
-        Matches.remove_match(match_id)
+        await Matches.remove_match(match_id)
     
     ##############################
     # Matchmaking Queue Methods #
@@ -54,24 +62,47 @@ class MatchSessionHandler:
     @classmethod
     async def add_to_matchmaking_queue(cls, user_id: int) -> None:
         '''Add a user to the matchmaking queue'''
-        if MatchmakingQueue.is_user_registered(user_id):
+        if await MatchmakingQueue.is_user_registered(user_id):
             raise ValueError(f"registered to queue")
-        elif Tournaments.is_user_registered(user_id):
+        elif await Tournaments.is_user_registered(user_id):
             raise ValueError(f"registered to tournament")
-        elif Matches.is_user_registered(user_id):
+        elif await Matches.is_user_registered(user_id):
             raise ValueError(f"registered to match")
-        MatchmakingQueue.add_to_queue(user_id)
-        if MatchmakingQueue.get_queue_length() >= 2:
-            user_id_1 = MatchmakingQueue.pop_next_user()
-            user_id_2 = MatchmakingQueue.pop_next_user()
-            if user_id_1 and user_id_2:
-                match = await cls.create_match(user_id_1, user_id_2, cls.remove_match)
+        rating = await cls.get_user_rating(user_id)
+        await MatchmakingQueue.add_to_queue(user_id, rating, time.time())
+        await cls._create_queued_matches()
+        if cls._matchmaking_task is None and await MatchmakingQueue.get_queue_length() > 0:
+            cls._matchmaking_task = asyncio.create_task(cls._run_matchmaking())
+
+    @classmethod
+    async def get_user_rating(cls, user_id: int) -> float:
+        '''Get the rating the user is matched by'''
+        return await sync_to_async(get_rating)(user_id)
 
-                # Send a message to both users
-                match_id = match.get_id()
-                await cls.send_match_ready_message(match_id, user_id_1, user_id_2)
+    @classmethod
+    async def _create_queued_matches(cls) -> None:
+        '''Create a match for every pair of queued users that can play each other'''
+        for user_id_1, user_id_2 in await MatchmakingQueue.pop_pairs(time.time()):
+            match = await cls.create_match(user_id_1, user_id_2, cls.remove_match)
 
-                logger.debug(f"Match found: {user_id_1} vs {user_id_2}")
+            # Send a message to both users
+            match_id = match.get_id()
+            await cls.send_match_ready_message(match_id, user_id_1, user_id_2)
+
+            logger.debug(f"Match found: {user_id_1} vs {user_id_2}")
+
+    @classmethod
+    async def _run_matchmaking(cls) -> None:
+        '''Search for matches again while users are waiting, their windows widen over time'''
+        try:
+            while await MatchmakingQueue.get_queue_length() > 0:
+                await asyncio.sleep(MATCHMAKING_INTERVAL)
+                try:
+                    await cls._create_queued_matches()
+                except Exception as e:
+                    logger.error(f"Matchmaking failed: {e}")
+        finally:
+            cls._matchmaking_task = None
 
     @classmethod
     async def send_match_ready_message(cls, match_id: str, user1: str, user2: str) -> None:
@@ -92,9 +123,9 @@ class MatchSessionHandler:
             await cls._send_local_match_ready_message(match_id, user1)
 
     @classmethod
-    def remove_from_matchmaking_queue(cls, user_id: int) -> None:
+    async def remove_from_matchmaking_queue(cls, user_id: int) -> None:
         '''Remove a user from the matchmaking queue'''
-        is_removed = MatchmakingQueue.remove_from_queue(user_id)
+        is_removed = await MatchmakingQueue.remove_from_queue(user_id)
         if not is_removed:
             raise ValueError(f"not in queue")
         
@@ -0,0 +1,179 @@
+'''Binary framing of every message the server sends to the match clients
+
+Each frame starts with the same little-endian header:
+    version (uint8), message type (uint8), sequence (uint16, wraps around), tick (uint32)
+The sequence numbers all frames of a match, the tick is the simulation step the frame belongs to.
+Clients interpolate with the ticks, the user mapping tells them how many ticks pass per second.
+Positions are 16-bit fixed point values scaled to the world size.
+State is sent as a full keyframe every KEYFRAME_INTERVAL ticks and on request,
+the frames in between are deltas that only carry the positions that changed since the previous frame.'''
+
+import struct
+from typing import List, Optional, Tuple
+from django.conf import settings
+
+PROTOCOL_VERSION = 4
+
+# Message types
+STATE = 1
+USER_MAPPING = 2
+PLAYER_SCORES = 3
+START_TIMER = 4
+USER_DISCONNECTED = 5
+GAME_OVER = 6
+STATE_DELTA = 7
+
+# Flags of the state frame
+WALL_COLLISION = 1
+PADDLE_COLLISION = 2
+
+NO_PLAYER = 255 # Winner or loser of a match that ended without one
+NO_USER = 0     # Second user of a local match
+
+HEADER = '<BBHI'
+HEADER_FRAME = struct.Struct(HEADER)
+STATE_FRAME = struct.Struct(HEADER + 'HHHHHHB')          # left paddle x/y, right paddle x/y, ball x/y, flags
+USER_MAPPING_FRAME = struct.Struct(HEADER + 'BIIfff')    # is local match, user id of player 1 and 2, world size x/y, ticks per second
+PLAYER_SCORES_FRAME = struct.Struct(HEADER + 'BB')       # score of player 1 and 2
+START_TIMER_FRAME = struct.Struct(HEADER + 'B')          # seconds left
+USER_DISCONNECTED_FRAME = struct.Struct(HEADER + 'I')    # user id
+GAME_OVER_FRAME = struct.Struct(HEADER + 'BB')           # winner and loser player id
+# changed position bitmask, flags, then the changed positions in the order of the state frame
+DELTA_FRAMES = [struct.Struct(HEADER + 'BB' + 'H' * bin(mask).count('1')) for mask in range(64)]
+HEADER_SIZE = HEADER_FRAME.size
+POSITION_COUNT = 6
+
+WORLD_SIZE = settings.GAME_CONFIG['world_size']
+QUANTIZATION_STEPS = 0xFFFF
+SCALE_X = QUANTIZATION_STEPS / WORLD_SIZE[0]
+SCALE_Y = QUANTIZATION_STEPS / WORLD_SIZE[1]
+
+KEYFRAME_INTERVAL = settings.MATCH_CONFIG['keyframe_interval']
+SIMULATION_RATE = settings.MATCH_CONFIG['simulation_rate']
+
+# left paddle x/y, right paddle x/y, ball x/y in world units, wall collision, paddle collision
+GameState = Tuple[float, float, float, float, float, float, bool, bool]
+
+def quantize(value: float, scale: float) -> int:
+    '''Convert a position to 16-bit fixed point, clamped to the world'''
+    steps = int(value * scale + 0.5)
+    if steps < 0:
+        return 0
+    if steps > QUANTIZATION_STEPS:
+        return QUANTIZATION_STEPS
+    return steps
+
+def _collision_flags(state: GameState) -> int:
+    '''Get the flags of the collisions in a state'''
+    return (WALL_COLLISION if state[6] else 0) | (PADDLE_COLLISION if state[7] else 0)
+
+def _unpack_state(frame: bytes) -> Tuple[List[Optional[int]], int]:
+    '''Get the positions (None if unchanged) and the flags of a state or delta frame'''
+    if frame[1] == STATE:
+        fields = STATE_FRAME.unpack(frame)
+        return list(fields[4:10]), fields[10]
+    mask = frame[HEADER_SIZE]
+    fields = DELTA_FRAMES[mask].unpack(frame)
+    values = iter(fields[6:])
+    return [next(values) if mask & (1 << index) else None for index in range(POSITION_COUNT)], fields[5]
+
+def merge_state_frames(older: bytes, newer: bytes) -> bytes:
+    '''Combine a state frame that was not sent yet with the next one, so no change is lost when the older one is dropped
+
+    The result has the header of the newer frame, a keyframe stays a keyframe and the collision flags of both are kept.'''
+    if newer[1] == STATE:
+        return newer
+    older_positions, older_flags = _unpack_state(older)
+    newer_positions, newer_flags = _unpack_state(newer)
+    positions = [newer_value if newer_value is not None else older_value
+                 for older_value, newer_value in zip(older_positions, newer_positions)]
+    flags = older_flags | newer_flags
+    sequence, tick = HEADER_FRAME.unpack_from(newer)[2:]
+    if older[1] == STATE:
+        return STATE_FRAME.pack(PROTOCOL_VERSION, STATE, sequence, tick, *positions, flags)
+    return _pack_delta(sequence, tick, positions, flags)
+
+def get_sequence(frame: bytes) -> int:
+    '''Get the sequence number of a frame'''
+    return HEADER_FRAME.unpack_from(frame)[2]
+
+def is_newer_sequence(sequence: int, than: int) -> bool:
+    '''Check if a sequence number comes after another one, across the wrap around'''
+    return 0 < (sequence - than) & 0xFFFF < 0x8000
+
+def _pack_delta(sequence: int, tick: int, positions: List[Optional[int]], flags: int) -> bytes:
+    '''Pack the positions that are not None into a delta frame'''
+    mask = 0
+    for index, value in enumerate(positions):
+        if value is not None:
+            mask |= 1 << index
+    return DELTA_FRAMES[mask].pack(PROTOCOL_VERSION, STATE_DELTA, sequence, tick, mask, flags,
+                                   *(value for value in positions if value is not None))
+
+class FrameEncoder:
+    '''Packs the frames of one match and numbers them'''
+
+    def __init__(self) -> None:
+        self._sequence: int = 0
+        self._last_positions: Optional[List[int]] = None # Positions of the last state or delta frame
+        self._last_keyframe_tick: int = 0
+        self._keyframe_requested: bool = True
+        self._pending_flags: int = 0 # Collision flags of states that were not sent
+
+    def _next_sequence(self) -> int:
+        '''Get the sequence number for the next frame'''
+        sequence = self._sequence
+        self._sequence = (sequence + 1) & 0xFFFF
+        return sequence
+
+    def request_keyframe(self) -> None:
+        '''Send the next state as a keyframe, e.g. because a user (re)connected'''
+        self._keyframe_requested = True
+
+    def skip_state(self, state: GameState) -> None:
+        '''Keep the collisions of a state that is not sent, so they are reported with the next one'''
+        self._pending_flags |= _collision_flags(state)
+
+    def state(self, tick: int, state: GameState) -> bytes:
+        '''Pack the positions of the paddles and the ball, as a keyframe or as a delta to the previous frame'''
+        left_x, left_y, right_x, right_y, ball_x, ball_y = state[:POSITION_COUNT]
+        flags = _collision_flags(state) | self._pending_flags
+        self._pending_flags = 0
+        positions = [quantize(left_x, SCALE_X), quantize(left_y, SCALE_Y),
+                     quantize(right_x, SCALE_X), quantize(right_y, SCALE_Y),
+                     quantize(ball_x, SCALE_X), quantize(ball_y, SCALE_Y)]
+        last_positions = self._last_positions
+        self._last_positions = positions
+
+        if self._keyframe_requested or last_positions is None or tick - self._last_keyframe_tick >= KEYFRAME_INTERVAL:
+            self._keyframe_requested = False
+            self._last_keyframe_tick = tick
+            return STATE_FRAME.pack(PROTOCOL_VERSION, STATE, self._next_sequence(), tick, *positions, flags)
+
+        changed = [value if value != last_value else None for value, last_value in zip(positions, last_positions)]
+        return _pack_delta(self._next_sequence(), tick, changed, flags)
+
+    def user_mapping(self, tick: int, is_local_match: bool, user_id_1: int, user_id_2: Optional[int],
+                     tick_rate: float = SIMULATION_RATE) -> bytes:
+        '''Pack which user plays which side, tick_rate is the number of ticks the clients get per second'''
+        return USER_MAPPING_FRAME.pack(PROTOCOL_VERSION, USER_MAPPING, self._next_sequence(), tick,
+                                       int(is_local_match), user_id_1, user_id_2 if user_id_2 is not None else NO_USER,
+                                       WORLD_SIZE[0], WORLD_SIZE[1], tick_rate)
+
+    def player_scores(self, tick: int, player1: int, player2: int) -> bytes:
+        '''Pack the scores'''
+        return PLAYER_SCORES_FRAME.pack(PROTOCOL_VERSION, PLAYER_SCORES, self._next_sequence(), tick, player1, player2)
+
+    def start_timer(self, tick: int, seconds: int) -> bytes:
+        '''Pack the seconds left until the game starts'''
+        return START_TIMER_FRAME.pack(PROTOCOL_VERSION, START_TIMER, self._next_sequence(), tick, seconds)
+
+    def user_disconnected(self, tick: int, user_id: int) -> bytes:
+        '''Pack the disconnect of a user'''
+        return USER_DISCONNECTED_FRAME.pack(PROTOCOL_VERSION, USER_DISCONNECTED, self._next_sequence(), tick, user_id)
+
+    def game_over(self, tick: int, winner: Optional[int], loser: Optional[int]) -> bytes:
+        '''Pack the result of the match'''
+        return GAME_OVER_FRAME.pack(PROTOCOL_VERSION, GAME_OVER, self._next_sequence(), tick,
+                                    winner if winner is not None else NO_PLAYER,
+                                    loser if loser is not None else NO_PLAYER)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import weakref
+from typing import Dict, List, Optional, Protocol
+from django.conf import settings
+from .clock import REAL_CLOCK, Clock, get_clock
+
+logger = logging.getLogger("match")
+
+TICK_RATE = settings.MATCH_CONFIG['tick_rate']
+TICK_PHASES = settings.MATCH_CONFIG['tick_phases']
+
+class Tickable(Protocol):
+    async def tick(self, now: float) -> None:
+        '''Advance by one tick, now is the scheduler time of the tick in seconds'''
+        ...
+
+class TickScheduler:
+    '''Process wide loop that ticks every registered match at a fixed rate
+
+    Each tick is split into TICK_PHASES evenly spaced phases and every tickable is assigned to one of
+    them, so the matches do not all wake up at the same moment. Wake-ups are scheduled against
+    absolute deadlines, so the time spent ticking is subtracted from the sleep and the loop does not drift.'''
+
+    _instance: Optional['TickScheduler'] = None
+    _clock_instances: 'weakref.WeakKeyDictionary[Clock, TickScheduler]' = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_instance(cls, clock: Optional[Clock] = None) -> 'TickScheduler':
+        '''Get the process wide scheduler, or the one of a clock other than the real one'''
+        if clock is not None and clock is not REAL_CLOCK:
+            if clock not in cls._clock_instances:
+                cls._clock_instances[clock] = cls(clock=clock)
+            return cls._clock_instances[clock]
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, tick_rate: float = TICK_RATE, phases: int = TICK_PHASES, clock: Optional[Clock] = None) -> None:
+        self._clock: Clock = get_clock(clock)
+        self._tick_speed: float = 1 / tick_rate
+        self._phase_speed: float = self._tick_speed / phases
+        self._phases: List[Dict[Tickable, None]] = [{} for _ in range(phases)] # Dicts keep the registration order
+        self._phase_of: Dict[Tickable, int] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self._tick_lag: float = 0.0
+        self._average_tick_lag: float = 0.0
+        self._max_tick_lag: float = 0.0
+
+    #############################
+    #       Registration        #
+    #############################
+
+    def register(self, tickable: Tickable) -> None:
+        '''Start ticking an object, it is placed into the least busy phase'''
+        if tickable in self._phase_of:
+            return
+        phase = min(range(len(self._phases)), key=lambda index: len(self._phases[index]))
+        self._phases[phase][tickable] = None
+        self._phase_of[tickable] = phase
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._main_loop())
+
+    def unregister(self, tickable: Tickable) -> None:
+        '''Stop ticking an object'''
+        phase = self._phase_of.pop(tickable, None)
+        if phase is not None:
+            del self._phases[phase][tickable]
+
+    def is_registered(self, tickable: Tickable) -> bool:
+        '''Check if an object is ticked by the scheduler'''
+        return tickable in self._phase_of
+
+    #############################
+    #         Main loop         #
+    #############################
+
+    async def _main_loop(self) -> None:
+        '''Run the phases at their deadlines until nothing is registered anymore'''
+        deadline = self._clock.now()
+        phase = 0
+        while self._phase_of:
+            now = self._clock.now()
+            self._record_tick_lag(now - deadline)
+
+            tickables = list(self._phases[phase])
+            if tickables:
+                results = await asyncio.gather(*(tickable.tick(now) for tickable in tickables), return_exceptions=True)
+                for tickable, result in zip(tickables, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"Tick of {tickable} failed: {result}")
+
+            phase = (phase + 1) % len(self._phases)
+            deadline += self._phase_speed
+            delay = deadline - self._clock.now()
+            if delay < -self._tick_speed:
+                # More than a whole tick behind, skip the missed deadlines instead of bursting to catch up
+                logger.warning(f"Tick scheduler is {-delay:.3f}s behind, skipping missed ticks")
+                deadline = self._clock.now()
+                delay = 0
+            await self._clock.sleep(max(delay, 0))
+        logger.debug("Tick scheduler idle, stopping loop")
+
+    def _record_tick_lag(self, lag: float) -> None:
+        '''Keep track of how late the phases wake up'''
+        self._tick_lag = lag
+        self._average_tick_lag += (lag - self._average_tick_lag) * 0.01
+        self._max_tick_lag = max(self._max_tick_lag, lag)
+
+    #############################
+    #         Metrics           #
+    #############################
+
+    def get_tick_lag(self) -> float:
+        '''Get how late the last phase woke up, in seconds'''
+        return self._tick_lag
+
+    def get_average_tick_lag(self) -> float:
+        '''Get the moving average of the tick lag, in seconds'''
+        return self._average_tick_lag
+
+    def get_max_tick_lag(self) -> float:
+        '''Get the highest tick lag seen so far, in seconds'''
+        return self._max_tick_lag
+
+    def get_registered_count(self) -> int:
+        '''Get the number of ticked objects'''
+        return len(self._phase_of)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import math
+import weakref
+from typing import Callable, Dict, List, Optional
+from django.conf import settings
+from .clock import REAL_CLOCK, Clock, get_clock
+
+logger = logging.getLogger("match")
+
+TIMEOUT_RESOLUTION = settings.MATCH_CONFIG['timeout_resolution']
+TIMEOUT_WHEEL_SLOTS = settings.MATCH_CONFIG['timeout_wheel_slots']
+
+class Timeout:
+    '''A callback that the TimeoutWheel runs once its tick is reached, unless it is cancelled before'''
+
+    __slots__ = ("tick", "callback", "_wheel")
+
+    def __init__(self, wheel: 'TimeoutWheel', tick: int, callback: Callable[[], None]) -> None:
+        self.tick = tick
+        self.callback = callback
+        self._wheel: Optional[TimeoutWheel] = wheel
+
+    def cancel(self) -> None:
+        '''Remove the timeout from the wheel, nothing happens if it already fired'''
+        if self._wheel is not None:
+            self._wheel._remove(self)
+            self._wheel = None
+
+    def is_pending(self) -> bool:
+        '''Check if the timeout neither fired nor was cancelled'''
+        return self._wheel is not None
+
+
+class TimeoutWheel:
+    '''One timer for every timeout of the matches (hashed timing wheel)
+
+    A timeout is put into the slot of the tick it expires on, so adding and cancelling one costs the same
+    no matter how many are pending. A single task turns the wheel one slot per resolution while timeouts
+    are pending and stops when there are none, so waiting matches do not each keep a timer running.'''
+
+    _instance: Optional['TimeoutWheel'] = None
+    _clock_instances: 'weakref.WeakKeyDictionary[Clock, TimeoutWheel]' = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_instance(cls, clock: Optional[Clock] = None) -> 'TimeoutWheel':
+        '''Get the process wide wheel, or the one of a clock other than the real one'''
+        if clock is not None and clock is not REAL_CLOCK:
+            if clock not in cls._clock_instances:
+                cls._clock_instances[clock] = cls(clock=clock)
+            return cls._clock_instances[clock]
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, resolution: float = TIMEOUT_RESOLUTION, slots: int = TIMEOUT_WHEEL_SLOTS, clock: Optional[Clock] = None) -> None:
+        self._clock: Clock = get_clock(clock)
+        self._resolution: float = resolution
+        self._slots: List[Dict[Timeout, None]] = [{} for _ in range(slots)]
+        self._pending_count: int = 0
+        self._start_time: float = self._clock.now()
+        self._current_tick: int = 0 # Every tick up to this one has fired
+        self._turn_task: Optional[asyncio.Task] = None
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timeout:
+        '''Run a callback after delay seconds, at most one resolution later'''
+        now = self._clock.now()
+        if self._pending_count == 0:
+            # Idle until now, the skipped ticks had nothing to fire
+            self._current_tick = self._get_tick(now)
+        # The first tick that is not early
+        tick = max(math.ceil((now + delay - self._start_time) / self._resolution), self._current_tick + 1)
+        timeout = Timeout(self, tick, callback)
+        self._slots[tick % len(self._slots)][timeout] = None
+        self._pending_count += 1
+        if self._turn_task is None or self._turn_task.done():
+            self._turn_task = asyncio.create_task(self._turn())
+        return timeout
+
+    def get_pending_count(self) -> int:
+        '''Get the number of timeouts that did not fire yet'''
+        return self._pending_count
+
+    def _remove(self, timeout: Timeout) -> None:
+        '''Take a cancelled timeout out of its slot'''
+        slot = self._slots[timeout.tick % len(self._slots)]
+        if timeout in slot:
+            del slot[timeout]
+            self._pending_count -= 1
+
+    def _get_tick(self, time: float) -> int:
+        '''Get the tick a point in time falls into'''
+        return int((time - self._start_time) / self._resolution)
+
+    async def _turn(self) -> None:
+        '''Fire the timeouts of every tick that passed, one tick at a time, until none are pending'''
+        while self._pending_count > 0:
+            next_time = self._start_time + (self._current_tick + 1) * self._resolution
+            await self._clock.sleep(max(next_time - self._clock.now(), 0))
+            # The next tick is due after the sleep, after a stall several ticks are due at once
+            due_tick = max(self._get_tick(self._clock.now()), self._current_tick + 1)
+            for tick in range(self._current_tick + 1, due_tick + 1):
+                self._fire(tick)
+                self._current_tick = tick
+
+    def _fire(self, tick: int) -> None:
+        '''Run the timeouts of a tick, the ones of a later turn of the wheel stay in the slot'''
+        slot = self._slots[tick % len(self._slots)]
+        for timeout in [timeout for timeout in slot if timeout.tick <= tick]:
+            if timeout._wheel is None:
+                continue # Cancelled by an earlier callback
+            del slot[timeout]
+            self._pending_count -= 1
+            timeout._wheel = None
+            try:
+                timeout.callback()
+            except Exception as e:
+                logger.error(f"Timeout callback {timeout.callback} failed: {e}")
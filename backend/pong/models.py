@@ -1,3 +1,60 @@
 from django.db import models
+from usermanagement.models import CustomUser
 
 # Create your models here.
+
+class Tournament(models.Model):
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (FINISHED, 'Finished')]
+
+    id = models.CharField(max_length=32, primary_key=True)
+    name = models.CharField(max_length=255)
+    owner = models.ForeignKey(CustomUser, related_name='owned_tournaments', on_delete=models.SET_NULL, null=True, blank=True)
+    format = models.CharField(max_length=32)
+    max_players = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=RUNNING, db_index=True)
+    node_id = models.CharField(max_length=255) # Node that runs the tournament
+    winner = models.ForeignKey(CustomUser, related_name='won_tournaments', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Tournament {self.name} ({self.format}, {self.status})"
+
+
+class TournamentPlayer(models.Model):
+    tournament = models.ForeignKey(Tournament, related_name='players', on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, related_name='tournament_entries', on_delete=models.CASCADE)
+    seed = models.IntegerField() # 0 is the best seed
+    is_eliminated = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('tournament', 'user')
+        ordering = ['seed']
+
+    def __str__(self):
+        return f"Player {self.user_id} of {self.tournament_id}, seed {self.seed}"
+
+
+class TournamentMatch(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FINISHED, 'Finished')]
+
+    tournament = models.ForeignKey(Tournament, related_name='matches', on_delete=models.CASCADE)
+    round = models.IntegerField()
+    user1 = models.ForeignKey(CustomUser, related_name='+', on_delete=models.CASCADE)
+    user2 = models.ForeignKey(CustomUser, related_name='+', on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    match_id = models.CharField(max_length=36, null=True, blank=True) # Id of the MatchSession while it runs
+    winner = models.ForeignKey(CustomUser, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('tournament', 'round', 'user1', 'user2')
+        ordering = ['round', 'id']
+
+    def __str__(self):
+        return f"Round {self.round} of {self.tournament_id}: {self.user1_id} vs {self.user2_id} ({self.status})"
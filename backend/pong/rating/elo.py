@@ -0,0 +1,77 @@
+import numpy as np
+from typing import Tuple
+from django.conf import settings
+
+INITIAL_RATING = settings.RATING_CONFIG['initial_rating']
+K_FACTOR = settings.RATING_CONFIG['k_factor']
+PROVISIONAL_K_FACTOR = settings.RATING_CONFIG['provisional_k_factor']
+PROVISIONAL_GAMES = settings.RATING_CONFIG['provisional_games']
+SCALE = settings.RATING_CONFIG['scale']
+
+##############################
+#         One game           #
+##############################
+
+def get_game_score(home_score: int, visitor_score: int) -> float:
+    '''Get the result of a game for the home user: 1 for a win, 0.5 for a draw, 0 for a loss'''
+    if home_score == visitor_score:
+        return 0.5
+    return 1.0 if home_score > visitor_score else 0.0
+
+def get_expected_score(rating: float, opponent_rating: float) -> float:
+    '''Get the result a user is expected to reach against an opponent'''
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / SCALE))
+
+def get_k_factor(games_played: int) -> float:
+    '''Get the largest rating change of the next game of a user'''
+    return PROVISIONAL_K_FACTOR if games_played < PROVISIONAL_GAMES else K_FACTOR
+
+def update_ratings(home_rating: float, visitor_rating: float, home_games: int, visitor_games: int, score: float) -> Tuple[float, float]:
+    '''Get the ratings of both users after a game, score is the result of the home user'''
+    expected = get_expected_score(home_rating, visitor_rating)
+    return (home_rating + get_k_factor(home_games) * (score - expected),
+            visitor_rating + get_k_factor(visitor_games) * (expected - score))
+
+##############################
+#        Game history        #
+##############################
+
+def get_game_scores(home_scores: np.ndarray, visitor_scores: np.ndarray) -> np.ndarray:
+    '''Get the results of many games for the home users'''
+    return (np.sign(home_scores - visitor_scores) + 1) / 2
+
+def get_layers(home: np.ndarray, visitor: np.ndarray) -> np.ndarray:
+    '''Get the layer of every game in chronological order
+
+    A game lies one layer after the previous games of both of its users, so the games of a layer
+    share no user and every user plays the games of the layers in the order they were played.'''
+    last_layer = {}
+    layers = np.empty(len(home), dtype=np.int64)
+    for index, (home_user, visitor_user) in enumerate(zip(home.tolist(), visitor.tolist())):
+        layer = max(last_layer.get(home_user, -1), last_layer.get(visitor_user, -1)) + 1
+        last_layer[home_user] = layer
+        last_layer[visitor_user] = layer
+        layers[index] = layer
+    return layers
+
+def replay_games(home: np.ndarray, visitor: np.ndarray, scores: np.ndarray, user_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    '''Get the ratings and game counts of users 0 to user_count - 1 after the games in chronological order
+
+    The games of a layer are independent of each other and are rated at once.'''
+    ratings = np.full(user_count, INITIAL_RATING, dtype=np.float64)
+    games_played = np.zeros(user_count, dtype=np.int64)
+    if len(home) == 0:
+        return ratings, games_played
+
+    layers = get_layers(home, visitor)
+    order = np.argsort(layers, kind='stable')
+    for batch in np.split(order, np.flatnonzero(np.diff(layers[order])) + 1):
+        home_users = home[batch]
+        visitor_users = visitor[batch]
+        expected = 1 / (1 + 10 ** ((ratings[visitor_users] - ratings[home_users]) / SCALE))
+        change = scores[batch] - expected
+        ratings[home_users] += np.where(games_played[home_users] < PROVISIONAL_GAMES, PROVISIONAL_K_FACTOR, K_FACTOR) * change
+        ratings[visitor_users] -= np.where(games_played[visitor_users] < PROVISIONAL_GAMES, PROVISIONAL_K_FACTOR, K_FACTOR) * change
+        games_played[home_users] += 1
+        games_played[visitor_users] += 1
+    return ratings, games_played
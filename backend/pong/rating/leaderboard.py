@@ -0,0 +1,194 @@
+import logging
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from usermanagement.models import Games, PlayerRating
+from ..data_managment.registry_backend import BACKENDS, RegistryBackend
+from .elo import get_game_score
+
+logger = logging.getLogger("rating")
+
+LEADERBOARD_BACKEND = settings.LEADERBOARD_CONFIG['backend']
+REBUILD_CHUNK_SIZE = settings.LEADERBOARD_CONFIG['rebuild_chunk_size']
+
+RANKING = "pong:leaderboard"            # sorted set of user ids by rating
+RESULTS = "pong:leaderboard_results"    # "user_id:wins", "user_id:losses", "user_id:draws" -> count
+REBUILD = ":rebuild"                    # + to the keys above while a rebuild writes them
+
+RESULT_FIELDS = ("wins", "losses", "draws")
+
+# A game result: home user id, visitor user id, home score, visitor score
+GameResult = Tuple[int, int, int, int]
+
+class Leaderboard:
+    '''Users ranked by rating, the highest first
+
+    The ranking is a sorted set, so a page or the rank of a user costs a logarithmic lookup instead of
+    a scan of the game history. Every saved game updates it, rebuild replaces it from the database.'''
+
+    _backend: Optional[RegistryBackend] = None
+    _is_built: bool = False # A memory backend is built from the database on first use
+
+    @classmethod
+    def get_backend(cls) -> RegistryBackend:
+        '''Get the configured backend, created on first use'''
+        if cls._backend is None:
+            if LEADERBOARD_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown leaderboard backend {LEADERBOARD_BACKEND}")
+            cls._backend = BACKENDS[LEADERBOARD_BACKEND]()
+        if not cls._backend.is_shared and not cls._is_built:
+            cls._is_built = True
+            cls.rebuild_from_database()
+        return cls._backend
+
+    @classmethod
+    def set_backend(cls, backend: RegistryBackend) -> None:
+        '''Replace the backend, e.g. with a fresh one in tests'''
+        cls._backend = backend
+        cls._is_built = True
+
+    @classmethod
+    def add_game(cls, home_user_id: int, home_rating: float, visitor_user_id: int, visitor_rating: float, score: float) -> None:
+        '''Add a saved game with the new ratings of both users, score is the result of the home user'''
+        if not cls._is_built and not BACKENDS[LEADERBOARD_BACKEND].is_shared:
+            return # Not built in this process yet, the build from the database will contain the game
+        backend = cls.get_backend()
+        backend.sorted_set_add_many(RANKING, {str(home_user_id): home_rating, str(visitor_user_id): visitor_rating})
+        for user_id, field in cls._get_result_fields(home_user_id, visitor_user_id, score):
+            backend.hash_increment(RESULTS, f"{user_id}:{field}", 1)
+
+    @classmethod
+    def get_size(cls) -> int:
+        '''Get the number of ranked users'''
+        return cls.get_backend().sorted_set_size(RANKING)
+
+    @classmethod
+    def get_rank(cls, user_id: int) -> Optional[int]:
+        '''Get the rank of a user, 1 for the highest rating, None if they are not ranked'''
+        rank = cls.get_backend().sorted_set_rank(RANKING, str(user_id), reverse=True)
+        return rank + 1 if rank is not None else None
+
+    @classmethod
+    def get_page(cls, page: int, page_size: int) -> List[Dict]:
+        '''Get the entries of a page, page 1 starts at the highest rating'''
+        return cls._get_entries((page - 1) * page_size, page_size)
+
+    @classmethod
+    def get_neighbourhood(cls, user_id: int, neighbours: int) -> Optional[List[Dict]]:
+        '''Get the entry of a user with up to neighbours entries above and below, None if they are not ranked'''
+        rank = cls.get_rank(user_id)
+        if rank is None:
+            return None
+        start = max(rank - 1 - neighbours, 0)
+        return cls._get_entries(start, rank - start + neighbours)
+
+    @classmethod
+    def _get_entries(cls, start: int, count: int) -> List[Dict]:
+        '''Get count entries from position start on'''
+        backend = cls.get_backend()
+        ranking = backend.sorted_set_range(RANKING, start, count, reverse=True)
+        keys = [f"{user_id}:{field}" for user_id, _ in ranking for field in RESULT_FIELDS]
+        results = iter(backend.hash_get_many(RESULTS, keys))
+        return [
+            {
+                "rank": start + position + 1,
+                "user_id": int(user_id),
+                "rating": round(rating),
+                **{field: int(next(results) or 0) for field in RESULT_FIELDS}
+            }
+            for position, (user_id, rating) in enumerate(ranking)
+        ]
+
+    ##############################
+    #          Rebuild           #
+    ##############################
+
+    @classmethod
+    def rebuild(cls, ratings: Iterable[Tuple[int, float]], games: Iterable[GameResult], chunk_size: int = REBUILD_CHUNK_SIZE,
+                get_newer: Optional[Callable[[], Tuple[List[Tuple[int, float]], List[GameResult]]]] = None) -> Tuple[int, int]:
+        '''Replace the leaderboard with the ratings and the results of the games, returns the number of users and games
+
+        Both are consumed as they come and written in chunks next to the live keys, which are swapped
+        in at the end, so the leaderboard stays readable the whole time. The games saved meanwhile only
+        reach the live keys, get_newer returns them with the new ratings of their users to be added
+        before the swap.'''
+        backend = cls.get_backend()
+        for name in (RANKING, RESULTS):
+            backend.delete(name + REBUILD)
+
+        user_count = 0
+        chunk = {}
+        for user_id, rating in ratings:
+            chunk[str(user_id)] = rating
+            if len(chunk) >= chunk_size:
+                backend.sorted_set_add_many(RANKING + REBUILD, chunk)
+                user_count += len(chunk)
+                chunk = {}
+        backend.sorted_set_add_many(RANKING + REBUILD, chunk)
+        user_count += len(chunk)
+
+        # One counter per user and result, far fewer than the games
+        game_count = 0
+        results = Counter()
+        for home_user_id, visitor_user_id, home_score, visitor_score in games:
+            game_count += 1
+            results.update(f"{user_id}:{field}" for user_id, field in cls._get_result_fields(
+                home_user_id, visitor_user_id, get_game_score(home_score, visitor_score)))
+        fields = list(results.items())
+        for index in range(0, len(fields), chunk_size):
+            backend.hash_set_many(RESULTS + REBUILD, {key: str(count) for key, count in fields[index:index + chunk_size]})
+
+        if get_newer is not None:
+            newer_ratings, newer_games = get_newer()
+            backend.sorted_set_add_many(RANKING + REBUILD, {str(user_id): rating for user_id, rating in newer_ratings})
+            for home_user_id, visitor_user_id, home_score, visitor_score in newer_games:
+                game_count += 1
+                for user_id, field in cls._get_result_fields(home_user_id, visitor_user_id, get_game_score(home_score, visitor_score)):
+                    backend.hash_increment(RESULTS + REBUILD, f"{user_id}:{field}", 1)
+
+        for name in (RANKING, RESULTS):
+            backend.rename(name + REBUILD, name)
+        logger.info(f"Leaderboard rebuilt from {user_count} ratings and {game_count} games")
+        return user_count, game_count
+
+    @classmethod
+    def rebuild_from_database(cls, chunk_size: int = REBUILD_CHUNK_SIZE) -> Tuple[int, int]:
+        '''Replace the leaderboard with the stored ratings and games, read chunk by chunk
+
+        The games saved during the rebuild are read again under the rating lock right before the swap,
+        the lock holds back the games that finish after that until the new keys are live.'''
+        from .ratings import lock_ratings # Imported here, ratings imports the leaderboard
+
+        with transaction.atomic():
+            lock_ratings() # The games that are being rated commit first, so every game up to the last id is read
+            last_game_id = Games.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        ratings = PlayerRating.objects.order_by('pk').values_list('user_id', 'rating').iterator(chunk_size=chunk_size)
+        games = cls._get_games().filter(id__lte=last_game_id).iterator(chunk_size=chunk_size)
+
+        def get_newer() -> Tuple[List[Tuple[int, float]], List[GameResult]]:
+            lock_ratings()
+            newer_games = list(cls._get_games().filter(id__gt=last_game_id))
+            user_ids = {user_id for home_user_id, visitor_user_id, _, _ in newer_games for user_id in (home_user_id, visitor_user_id)}
+            newer_ratings = list(PlayerRating.objects.filter(user_id__in=user_ids).values_list('user_id', 'rating'))
+            return newer_ratings, newer_games
+
+        with transaction.atomic(): # Keeps the lock until the swap is done
+            return cls.rebuild(ratings, games, chunk_size, get_newer)
+
+    @staticmethod
+    def _get_games():
+        '''Get the results of the stored games between two users'''
+        return (Games.objects
+                .filter(home_id__isnull=False, visitor_id__isnull=False)
+                .values_list('home_id', 'visitor_id', 'home_score', 'visitor_score'))
+
+    @staticmethod
+    def _get_result_fields(home_user_id: int, visitor_user_id: int, score: float) -> List[Tuple[int, str]]:
+        '''Get the result counters a game adds to'''
+        if score == 0.5:
+            return [(home_user_id, "draws"), (visitor_user_id, "draws")]
+        if score > 0.5:
+            return [(home_user_id, "wins"), (visitor_user_id, "losses")]
+        return [(home_user_id, "losses"), (visitor_user_id, "wins")]
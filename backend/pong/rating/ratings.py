@@ -0,0 +1,59 @@
+import logging
+from django.db import connection, transaction
+from usermanagement.models import CustomUser, Games, PlayerRating
+from .elo import INITIAL_RATING, get_game_score, update_ratings
+from .leaderboard import Leaderboard
+
+logger = logging.getLogger("rating")
+
+def get_rating(user_id: int) -> float:
+    '''Get the rating of a user, the initial rating if they have not played yet'''
+    rating = PlayerRating.objects.filter(user_id=user_id).values_list('rating', flat=True).first()
+    return rating if rating is not None else INITIAL_RATING
+
+def lock_ratings() -> None:
+    '''Lock the rating table until the current transaction ends, games wait to be rated meanwhile
+
+    save_game locks the ratings of both users, also the ones it creates, with select_for_update,
+    which takes a ROW SHARE lock on the table. EXCLUSIVE is the weakest mode that conflicts with it
+    and still lets the ratings be read, so the games that are being rated are committed first and
+    the ones that finish meanwhile are rated after the lock is released.'''
+    table = connection.ops.quote_name(PlayerRating._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+
+def save_game(home_user_id: int, visitor_user_id: int, home_score: int, visitor_score: int) -> Games:
+    '''Save a game and update the ratings of both users in the same transaction'''
+    with transaction.atomic():
+        # Locked in the order of the user ids, so two games of the same users cannot deadlock.
+        # Locked before the game gets its id, so a game with a lower id than another is never committed after lock_ratings
+        ratings = {}
+        for user_id in sorted((home_user_id, visitor_user_id)):
+            ratings[user_id], _ = PlayerRating.objects.select_for_update().get_or_create(
+                user_id=user_id,
+                defaults={'rating': INITIAL_RATING}
+            )
+        home, visitor = ratings[home_user_id], ratings[visitor_user_id]
+
+        game = Games.objects.create(
+            home_id=CustomUser.objects.get(id=home_user_id),
+            visitor_id=CustomUser.objects.get(id=visitor_user_id),
+            home_score=home_score,
+            visitor_score=visitor_score
+        )
+
+        score = get_game_score(home_score, visitor_score)
+        home.rating, visitor.rating = update_ratings(home.rating, visitor.rating, home.games_played, visitor.games_played, score)
+        home.games_played += 1
+        visitor.games_played += 1
+        home.save(update_fields=['rating', 'games_played', 'updated_at'])
+        visitor.save(update_fields=['rating', 'games_played', 'updated_at'])
+
+        # Only a committed game reaches the leaderboard, a failing leaderboard does not undo the game
+        transaction.on_commit(
+            lambda: Leaderboard.add_game(home_user_id, home.rating, visitor_user_id, visitor.rating, score),
+            robust=True
+        )
+
+    logger.debug(f"Game {game.id} rated: {home_user_id} {home.rating:.0f}, {visitor_user_id} {visitor.rating:.0f}")
+    return game
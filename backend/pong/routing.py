@@ -1,8 +1,12 @@
 from django.urls import re_path
 from .consumers.match_consumer import MatchConsumer
 from .consumers.matchmaking_consumer import MatchmakingConsumer
+from .consumers.replay_consumer import ReplayConsumer
+from .consumers.spectator_consumer import SpectatorConsumer
 
 websocket_urlpatterns = [
     re_path(r"wss/pong/matchmaking/$", MatchmakingConsumer.as_asgi()),
     re_path(r"wss/pong/match/(?P<match_id>[^/]+)/$", MatchConsumer.as_asgi()),
+    re_path(r"wss/pong/match/(?P<match_id>[^/]+)/spectate/$", SpectatorConsumer.as_asgi()),
+    re_path(r"wss/pong/replay/(?P<match_id>[^/]+)/$", ReplayConsumer.as_asgi()),
 ]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal
+from typing import Literal, Optional
 
 class ActiveConnection(BaseModel):
     type: Literal["active_connection"]
@@ -40,6 +40,7 @@ class TournamentCreate(BaseModel):
     type: Literal["tournament_create"]
     name: str
     max_players: int
+    format: Optional[str] = None
 
     @classmethod
     async def get_type(cls):
@@ -0,0 +1,35 @@
+from typing import Callable
+
+class StartupMiddleware:
+    '''Runs the startup tasks of this node once, when the server starts serving the application
+
+    Servers with ASGI lifespan support start them on the startup event. Daphne sends no lifespan
+    events, there they start with the first scope the server hands to the application.'''
+
+    def __init__(self, inner, on_startup: Callable[[], None]) -> None:
+        self._inner = inner
+        self._on_startup = on_startup
+        self._is_started = False
+
+    async def __call__(self, scope, receive, send):
+        self._start()
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        return await self._inner(scope, receive, send)
+
+    def _start(self) -> None:
+        '''Run the startup tasks if they did not run yet'''
+        if not self._is_started:
+            self._is_started = True
+            self._on_startup()
+
+    async def _lifespan(self, receive, send) -> None:
+        '''Answer the lifespan events, the startup tasks already run'''
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -1,3 +1,1251 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from .data_managment.matches import Matches
+from .data_managment.tournaments import Tournaments
+from .data_managment.user import User
+from .data_managment.matchmaking_queue import MatchmakingQueue
+from .data_managment.user_connections import UserConnections
+from .data_managment.registry_backend import AsyncMemoryRegistryBackend, AsyncRegistryBackend, MemoryRegistryBackend, set_registry_backend
+from .rating import elo
+from .rating.leaderboard import Leaderboard
+from .match.clock import Clock, VirtualClock
+from .match.tick_scheduler import TickScheduler
+from .match.timeout_wheel import TimeoutWheel
+from .match.connection_notifier import ConnectionNotifier
+from .game_logic.game_session import MAX_CATCH_UP_STEPS, GameSession, PHYSICS_STEP
+from .game_logic.batched_engine import BALL_SIZE, BALL_SPEED, PADDLE_X, SPEED_MULTIPLIER, WORLD_SIZE, BatchedGameSession, BatchedPhysicsEngine
+from .match.match_recorder import MatchRecorder, MatchRecording
+from .match.match_session import MatchSession, advance_cadence
+from .match.protocol import (HEADER_FRAME, KEYFRAME_INTERVAL, PADDLE_COLLISION, PLAYER_SCORES, PROTOCOL_VERSION, SCALE_X, SCALE_Y,
+                             STATE, STATE_DELTA, STATE_FRAME, USER_MAPPING, WALL_COLLISION, FrameEncoder, _unpack_state,
+                             get_sequence, is_newer_sequence, merge_state_frames, quantize)
+from .data_managment.match_consumers import MatchConsumers
+from .consumers.match_consumer import MatchConsumer
+from .consumers.outbound_mailbox import OutboundMailbox
+from .consumers.spectator_consumer import SpectatorConsumer
+from .game_logic.simulation_workers import RemoteGameSession, SimulationWorkerPool
+from .tournament.tournament_formats import get_round_robin_rounds, RoundRobinFormat, SingleEliminationFormat, SwissFormat
+from .tournament.tournament_store import TournamentStore
+from .startup import StartupMiddleware
+import asyncio
+import math
+import numpy as np
+import os
+import random
+import tempfile
+from types import SimpleNamespace
 
-# Create your tests here.
+
+class FakeMatch:
+    '''Stands in for a MatchSession, the registries only need its id and users'''
+
+    def __init__(self, match_id: str, *user_ids: int) -> None:
+        self._id = match_id
+        self._users = list(user_ids)
+
+    def get_id(self) -> str:
+        return self._id
+
+    def get_assigned_users(self) -> list:
+        return self._users
+
+    def is_user_assigned(self, user_id: int) -> bool:
+        return user_id in self._users
+
+
+class FakeTournament:
+    '''Stands in for a TournamentSession, the registries only need its id, name and users'''
+
+    def __init__(self, tournament_id: str, name: str, owner_user_id: int) -> None:
+        self._id = tournament_id
+        self._name = name
+        self._users = {owner_user_id}
+
+    def get_id(self) -> str:
+        return self._id
+
+    def get_name(self) -> str:
+        return self._name
+
+    def get_users(self) -> set:
+        return self._users
+
+    def has_user(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def add_user(self, user_id: int) -> None:
+        self._users.add(user_id)
+
+    def remove_user(self, user_id: int) -> None:
+        self._users.remove(user_id)
+
+
+class RegistryBackendTests(SimpleTestCase):
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class HashOnlyBackend(AsyncRegistryBackend):
+            async def hash_get(self, name, key):
+                return None
+        with self.assertRaises(TypeError):
+            HashOnlyBackend()
+        AsyncMemoryRegistryBackend()
+        MemoryRegistryBackend()
+
+
+class MatchesIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        set_registry_backend(AsyncMemoryRegistryBackend())
+        Matches.matches = {}
+
+    async def test_add_and_remove_keep_index_consistent(self):
+        await Matches.add_match(FakeMatch("a", 1, 2))
+        await Matches.add_match(FakeMatch("b", 3))
+        self.assertTrue(await Matches.is_index_consistent())
+        self.assertEqual(await Matches.get_user_match_id(1), "a")
+        self.assertEqual(await Matches.get_user_match_id(3), "b")
+        self.assertTrue(await Matches.is_user_registered(2))
+
+        self.assertTrue(await Matches.remove_match("a"))
+        self.assertTrue(await Matches.is_index_consistent())
+        self.assertIsNone(await Matches.get_user_match_id(1))
+        self.assertFalse(await Matches.is_user_registered(2))
+        self.assertFalse(await Matches.remove_match("a"))
+
+    async def test_removing_an_old_match_keeps_the_new_one(self):
+        await Matches.add_match(FakeMatch("a", 1, 2))
+        await Matches.add_match(FakeMatch("b", 1, 3))
+        await Matches.remove_match("a")
+        self.assertEqual(await Matches.get_user_match_id(1), "b")
+        self.assertFalse(await Matches.is_user_registered(2))
+
+    async def test_index_matches_linear_scan(self):
+        for index in range(100):
+            await Matches.add_match(FakeMatch(f"m{index}", 2 * index, 2 * index + 1))
+        for index in range(0, 100, 3):
+            await Matches.remove_match(f"m{index}")
+        self.assertTrue(await Matches.is_index_consistent())
+        for user_id in range(200):
+            expected = next((match.get_id() for match in Matches.matches.values() if match.is_user_assigned(user_id)), None)
+            self.assertEqual(await Matches.get_user_match_id(user_id), expected)
+
+
+class TournamentsIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        set_registry_backend(AsyncMemoryRegistryBackend())
+        Tournaments.tournaments = {}
+        Matches.matches = {}
+
+    async def test_add_user_and_remove_user_keep_index_consistent(self):
+        await Tournaments.add(FakeTournament("t1", "first", 1))
+        await Tournaments.add_user("t1", 2)
+        await Tournaments.add_user("t1", 3)
+        self.assertTrue(await Tournaments.is_index_consistent())
+        self.assertEqual(await Tournaments.get_user_tournament_id(2), "t1")
+        self.assertTrue(await Tournaments.is_user_registered(3))
+
+        await Tournaments.remove_user("t1", 3)
+        self.assertTrue(await Tournaments.is_index_consistent())
+        self.assertFalse(await Tournaments.is_user_registered(3))
+        self.assertEqual(Tournaments.get("t1").get_users(), {1, 2})
+
+    async def test_name_index(self):
+        tournament = FakeTournament("t1", "first", 1)
+        await Tournaments.add(tournament)
+        self.assertIs(await Tournaments.get_by_name("first"), tournament)
+        self.assertIsNone(await Tournaments.get_by_name("second"))
+
+        await Tournaments.remove("t1")
+        self.assertIsNone(await Tournaments.get_by_name("first"))
+        self.assertFalse(await Tournaments.is_user_registered(1))
+        self.assertTrue(await Tournaments.is_index_consistent())
+
+    async def test_name_is_unique(self):
+        await Tournaments.add(FakeTournament("t1", "first", 1))
+        with self.assertRaisesMessage(ValueError, "tournament with name exists"):
+            await Tournaments.add(FakeTournament("t2", "first", 2))
+        self.assertIsNone(Tournaments.get("t2"))
+        self.assertFalse(await Tournaments.is_user_registered(2))
+        self.assertTrue(await Tournaments.is_index_consistent())
+
+    async def test_user_registered_somewhere(self):
+        await Tournaments.add(FakeTournament("t1", "first", 1))
+        await Matches.add_match(FakeMatch("m1", 2, 3))
+        with self.assertRaisesMessage(ValueError, "registered to tournament"):
+            await User.check_if_user_is_registered_somewhere(1)
+        with self.assertRaisesMessage(ValueError, "registered to match"):
+            await User.check_if_user_is_registered_somewhere(3)
+        await User.check_if_user_is_registered_somewhere(4)
+
+
+class MatchmakingQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        set_registry_backend(AsyncMemoryRegistryBackend())
+
+    async def test_pairs_similar_ratings_first_in_first_out(self):
+        await MatchmakingQueue.add_to_queue(1, 1000, 0.0)
+        await MatchmakingQueue.add_to_queue(2, 1010, 1.0)
+        await MatchmakingQueue.add_to_queue(3, 1020, 2.0)
+        self.assertEqual(await MatchmakingQueue.pop_pairs(2.0), [(1, 2)])
+        self.assertEqual(await MatchmakingQueue.get_queue(), {3})
+
+    async def test_window_widens_while_waiting(self):
+        await MatchmakingQueue.add_to_queue(1, 1000, 0.0)
+        await MatchmakingQueue.add_to_queue(2, 1500, 0.0)
+        self.assertEqual(await MatchmakingQueue.pop_pairs(0.0), [])
+        self.assertEqual(await MatchmakingQueue.get_queue_length(), 2)
+        waited = (500 - MatchmakingQueue.get_window(0.0, 0.0)) / (MatchmakingQueue.get_window(0.0, 1.0) - MatchmakingQueue.get_window(0.0, 0.0))
+        self.assertEqual([set(pair) for pair in await MatchmakingQueue.pop_pairs(waited)], [{1, 2}])
+        self.assertEqual(await MatchmakingQueue.get_queue_length(), 0)
+
+    async def test_closest_rating_within_window(self):
+        await MatchmakingQueue.add_to_queue(1, 1000, 0.0)
+        await MatchmakingQueue.add_to_queue(2, 1090, 1.0)
+        await MatchmakingQueue.add_to_queue(3, 1030, 2.0)
+        self.assertEqual(await MatchmakingQueue.pop_pairs(2.0), [(1, 3)])
+
+    async def test_remove_from_queue(self):
+        await MatchmakingQueue.add_to_queue(1, 1000, 0.0)
+        self.assertTrue(await MatchmakingQueue.remove_from_queue(1))
+        self.assertFalse(await MatchmakingQueue.remove_from_queue(1))
+        self.assertEqual(await MatchmakingQueue.get_queue(), set())
+        await MatchmakingQueue.add_to_queue(2, 1000, 1.0)
+        self.assertEqual(await MatchmakingQueue.pop_pairs(1.0), [])
+
+
+class UserConnectionsTests(SimpleTestCase):
+
+    def setUp(self):
+        set_registry_backend(AsyncMemoryRegistryBackend())
+        self.connections = UserConnections("test")
+
+    async def test_first_and_last_connection(self):
+        self.assertTrue(await self.connections.add(1, "a"))
+        self.assertFalse(await self.connections.add(1, "b"))
+        self.assertEqual(await self.connections.get_users(), {"1"})
+        self.assertFalse(await self.connections.remove(1, "a"))
+        self.assertTrue(await self.connections.remove(1, "b"))
+        self.assertFalse(await self.connections.is_connected(1))
+        self.assertEqual(await self.connections.get_users(), set())
+
+    async def test_active_connection_moves_to_a_remaining_one(self):
+        await self.connections.add(1, "a")
+        await self.connections.add(1, "b")
+        self.assertTrue(await self.connections.is_active(1, "b"))
+        await self.connections.remove(1, "b")
+        self.assertTrue(await self.connections.is_active(1, "a"))
+        await self.connections.remove(1, "a")
+        self.assertIsNone(await self.connections.get_active(1))
+
+
+class EloTests(SimpleTestCase):
+
+    def test_update_is_zero_sum_between_equal_k_factors(self):
+        home, visitor = elo.update_ratings(1200, 1000, 0, 0, 1.0)
+        self.assertAlmostEqual(home + visitor, 2200)
+        self.assertGreater(home, 1200)
+        home, visitor = elo.update_ratings(1000, 1000, 0, 0, 0.5)
+        self.assertEqual((home, visitor), (1000, 1000))
+
+    def test_game_scores(self):
+        self.assertEqual(elo.get_game_score(11, 3), 1.0)
+        self.assertEqual(elo.get_game_score(0, 0), 0.5)
+        self.assertEqual(elo.get_game_scores(np.array([11, 0, 4]), np.array([3, 0, 11])).tolist(), [1.0, 0.5, 0.0])
+
+    def test_layers_share_no_user(self):
+        home = np.array([0, 2, 0, 1, 3])
+        visitor = np.array([1, 3, 2, 3, 2])
+        layers = elo.get_layers(home, visitor)
+        self.assertEqual(layers.tolist(), [0, 0, 1, 1, 2])
+
+    def test_batch_replay_matches_incremental_updates(self):
+        rng = random.Random(0)
+        user_count = 20
+        games = []
+        for _ in range(300):
+            home, visitor = rng.sample(range(user_count), 2)
+            games.append((home, visitor, rng.randint(0, 11), rng.randint(0, 11)))
+
+        ratings = [elo.INITIAL_RATING] * user_count
+        games_played = [0] * user_count
+        for home, visitor, home_score, visitor_score in games:
+            ratings[home], ratings[visitor] = elo.update_ratings(
+                ratings[home], ratings[visitor], games_played[home], games_played[visitor],
+                elo.get_game_score(home_score, visitor_score)
+            )
+            games_played[home] += 1
+            games_played[visitor] += 1
+
+        rows = np.array(games)
+        batch_ratings, batch_games_played = elo.replay_games(rows[:, 0], rows[:, 1], elo.get_game_scores(rows[:, 2], rows[:, 3]), user_count)
+        np.testing.assert_allclose(batch_ratings, ratings)
+        self.assertEqual(batch_games_played.tolist(), games_played)
+
+
+class LeaderboardTests(SimpleTestCase):
+
+    def setUp(self):
+        Leaderboard.set_backend(MemoryRegistryBackend())
+        Leaderboard.rebuild(
+            [(user_id, 1000 + 10 * user_id) for user_id in range(1, 11)],
+            [(10, 1, 11, 3), (10, 2, 11, 5), (1, 2, 4, 4)],
+            chunk_size=3
+        )
+
+    def test_page_starts_at_highest_rating(self):
+        page = Leaderboard.get_page(1, 3)
+        self.assertEqual([entry["user_id"] for entry in page], [10, 9, 8])
+        self.assertEqual(page[0], {"rank": 1, "user_id": 10, "rating": 1100, "wins": 2, "losses": 0, "draws": 0})
+        self.assertEqual([entry["rank"] for entry in Leaderboard.get_page(4, 3)], [10])
+        self.assertEqual(Leaderboard.get_page(5, 3), [])
+        self.assertEqual(Leaderboard.get_size(), 10)
+
+    def test_rank_and_neighbourhood(self):
+        self.assertEqual(Leaderboard.get_rank(10), 1)
+        self.assertEqual(Leaderboard.get_rank(1), 10)
+        self.assertIsNone(Leaderboard.get_rank(11))
+        self.assertEqual([entry["user_id"] for entry in Leaderboard.get_neighbourhood(5, 2)], [7, 6, 5, 4, 3])
+        self.assertEqual([entry["user_id"] for entry in Leaderboard.get_neighbourhood(9, 2)], [10, 9, 8, 7])
+        self.assertEqual([entry["user_id"] for entry in Leaderboard.get_neighbourhood(2, 2)], [4, 3, 2, 1])
+        self.assertIsNone(Leaderboard.get_neighbourhood(11, 2))
+
+    def test_saved_game_updates_rank_and_results(self):
+        Leaderboard.add_game(1, 1200, 11, 990, 1.0)
+        self.assertEqual(Leaderboard.get_rank(1), 1)
+        self.assertEqual(Leaderboard.get_rank(11), 11)
+        entry = Leaderboard.get_page(1, 1)[0]
+        self.assertEqual((entry["wins"], entry["losses"], entry["draws"]), (1, 1, 1))
+
+    def test_rebuild_replaces_everything(self):
+        Leaderboard.rebuild([(20, 1500)], [])
+        self.assertEqual(Leaderboard.get_size(), 1)
+        self.assertEqual(Leaderboard.get_page(1, 10), [{"rank": 1, "user_id": 20, "rating": 1500, "wins": 0, "losses": 0, "draws": 0}])
+
+    def test_rebuild_keeps_the_games_saved_meanwhile(self):
+        def get_newer():
+            # Saved after the rebuild has read the games, it only reached the live keys
+            Leaderboard.add_game(20, 1510, 21, 990, 1.0)
+            return [(20, 1510), (21, 990)], [(20, 21, 11, 2)]
+        users, games = Leaderboard.rebuild([(20, 1500), (21, 1000)], [(21, 20, 11, 9)], get_newer=get_newer)
+        self.assertEqual((users, games), (2, 2))
+        self.assertEqual(Leaderboard.get_page(1, 10), [
+            {"rank": 1, "user_id": 20, "rating": 1510, "wins": 1, "losses": 1, "draws": 0},
+            {"rank": 2, "user_id": 21, "rating": 990, "wins": 1, "losses": 1, "draws": 0}
+        ])
+
+
+class RoundRobinScheduleTests(SimpleTestCase):
+
+    def assert_valid_schedule(self, users: list, round_count: int) -> None:
+        rounds = get_round_robin_rounds(users)
+        self.assertEqual(len(rounds), round_count)
+        pairings = [frozenset(match) for round_matches in rounds for match in round_matches]
+        self.assertEqual(len(pairings), len(users) * (len(users) - 1) // 2)
+        self.assertEqual(set(pairings), {frozenset((a, b)) for a in users for b in users if a != b})
+        for round_matches in rounds:
+            players = [user for match in round_matches for user in match]
+            self.assertEqual(len(players), len(set(players)))
+            self.assertEqual(len(round_matches), len(users) // 2)
+
+    def test_even_number_of_users(self):
+        self.assert_valid_schedule(list(range(12)), 11)
+        self.assert_valid_schedule([1, 2], 1)
+
+    def test_odd_number_of_users_sit_out_once(self):
+        users = list(range(5))
+        self.assert_valid_schedule(users, 5)
+        resting = [set(users) - {user for match in round_matches for user in match} for round_matches in get_round_robin_rounds(users)]
+        self.assertEqual(sorted(user for rest in resting for user in rest), users)
+
+
+def play_tournament(tournament_format, winner_of) -> list:
+    '''Play every round of a tournament format, winner_of(user1, user2) decides the matches'''
+    rounds = []
+    while True:
+        matches = tournament_format.next_round()
+        if not matches:
+            return rounds
+        players = [user for match in matches for user in match]
+        assert len(players) == len(set(players)), "a user plays twice in a round"
+        rounds.append(matches)
+        for user1, user2 in matches:
+            tournament_format.add_result(user1, user2, winner_of(user1, user2))
+
+
+class TournamentFormatTests(SimpleTestCase):
+
+    def test_round_robin_replays_among_the_tied_users(self):
+        tournament_format = RoundRobinFormat([1, 2, 3, 4])
+        # 1, 2 and 3 beat each other in a circle and all beat 4, the tie-break is always won by 1
+        beats = {(1, 2), (2, 3), (3, 1)}
+        def winner_of(user1, user2):
+            if 4 in (user1, user2):
+                return user1 if user2 == 4 else user2
+            if tournament_format.get_schedule() != first_stage:
+                return 1 if 1 in (user1, user2) else user1
+            return user1 if (user1, user2) in beats else user2
+        first_stage = list(tournament_format.get_schedule())
+        rounds = play_tournament(tournament_format, winner_of)
+        self.assertEqual(sum(len(matches) for matches in rounds), 6 + 3)
+        self.assertEqual(tournament_format.pop_eliminated(), {4})
+        self.assertEqual(tournament_format.get_winner(), 1)
+
+    def test_round_robin_circle_tie_goes_to_the_best_seed(self):
+        tournament_format = RoundRobinFormat([3, 1, 2])
+        beats = {(1, 2), (2, 3), (3, 1)}
+        rounds = play_tournament(tournament_format, lambda user1, user2: user1 if (user1, user2) in beats else user2)
+        self.assertEqual(sum(len(matches) for matches in rounds), 3)
+        self.assertEqual(tournament_format.pop_eliminated(), set())
+        self.assertEqual(tournament_format.get_winner(), 3)
+
+    def test_single_elimination_gives_byes_to_the_best_seeds(self):
+        users = list(range(1, 6))
+        tournament_format = SingleEliminationFormat(users)
+        rounds = play_tournament(tournament_format, min) # The better seed always wins
+        self.assertEqual(rounds[0], [(4, 5)])
+        self.assertEqual(sum(len(matches) for matches in rounds), len(users) - 1)
+        self.assertEqual(len(rounds), 3)
+        self.assertEqual(tournament_format.get_winner(), 1)
+        self.assertEqual(tournament_format.pop_eliminated(), {2, 3, 4, 5})
+
+    def test_single_elimination_draw_is_a_walkover(self):
+        tournament_format = SingleEliminationFormat([1, 2, 3, 4])
+        rounds = play_tournament(tournament_format, lambda user1, user2: None if 1 in (user1, user2) else min(user1, user2))
+        self.assertEqual(rounds, [[(1, 4), (2, 3)]])
+        self.assertEqual(tournament_format.get_winner(), 2)
+
+    def test_single_elimination_large_bracket(self):
+        users = list(range(1, 201))
+        tournament_format = SingleEliminationFormat(users)
+        rounds = play_tournament(tournament_format, max) # The worse seed always wins
+        self.assertEqual(len(rounds), 8)
+        self.assertEqual(sum(len(matches) for matches in rounds), 199)
+        self.assertIsNotNone(tournament_format.get_winner())
+
+    def test_swiss_pairs_without_rematches(self):
+        users = list(range(1, 65))
+        tournament_format = SwissFormat(users)
+        rounds = play_tournament(tournament_format, min)
+        self.assertEqual(len(rounds), 6)
+        self.assertEqual(sum(len(matches) for matches in rounds), 6 * 32)
+        pairings = [frozenset(match) for matches in rounds for match in matches]
+        self.assertEqual(len(pairings), len(set(pairings)))
+        self.assertEqual(tournament_format.get_winner(), 1)
+
+    def test_swiss_bye_with_odd_number_of_users(self):
+        tournament_format = SwissFormat([1, 2, 3])
+        rounds = play_tournament(tournament_format, min)
+        self.assertEqual([len(matches) for matches in rounds], [1, 1])
+        self.assertEqual(tournament_format.get_winner(), 1)
+
+    def test_formats_decide_the_same_rounds_again_from_the_results(self):
+        # A resumed tournament replays its stored results to find its next pending match
+        for format_class in (RoundRobinFormat, SingleEliminationFormat, SwissFormat):
+            users = list(range(1, 12))
+            stored = {}
+            def play(user1, user2):
+                stored[(user1, user2)] = max(user1, user2)
+                return stored[(user1, user2)]
+            original = format_class(users)
+            rounds = play_tournament(original, play)
+            replayed = format_class(users)
+            self.assertEqual(play_tournament(replayed, lambda user1, user2: stored[(user1, user2)]), rounds, format_class.name)
+            self.assertEqual(replayed.get_winner(), original.get_winner())
+
+
+class TournamentStoreTests(SimpleTestCase):
+
+    def test_finished_tournament_is_not_resumable_until_written(self):
+        store = TournamentStore()
+        written = []
+        def write(writes):
+            if not written:
+                written.append(None)
+                raise RuntimeError("database unavailable")
+            written.extend(writes)
+        store._write = write
+        async def main():
+            store.tournament_finished("t1", 3)
+            self.assertEqual(store.get_unwritten_finished(), ["t1"])
+            await store.flush() # Fails, the transition stays queued
+            self.assertEqual(store.get_unwritten_finished(), ["t1"])
+            await store.flush()
+            self.assertEqual(store.get_unwritten_finished(), [])
+        asyncio.run(main())
+        self.assertEqual(written[1:], [(TournamentStore._write_tournament_finished, ("t1", 3))])
+
+    def test_failed_batch_is_retried_in_order_before_newer_transitions(self):
+        store = TournamentStore()
+        batches = []
+        def write(writes):
+            batches.append([write.__name__ for write, args in writes])
+            if len(batches) == 1:
+                raise RuntimeError("deadlock detected")
+        store._write = write
+        async def main():
+            store.tournament_started("t1", "cup", 1, "round_robin", 4, [1, 2, 3, 4])
+            store.round_scheduled("t1", 0, [(1, 4), (2, 3)])
+            await store.flush()
+            store.match_started("t1", 0, 1, 4, "m1")
+            await store.flush()
+        asyncio.run(main())
+        self.assertEqual(batches, [["_write_tournament_started", "_write_round_scheduled"],
+                                   ["_write_tournament_started", "_write_round_scheduled", "_write_match_started"]])
+
+
+class StartupMiddlewareTests(SimpleTestCase):
+
+    async def test_startup_tasks_run_once_on_the_lifespan_startup(self):
+        started = []
+        inner_scopes = []
+        async def inner(scope, receive, send):
+            inner_scopes.append(scope['type'])
+        application = StartupMiddleware(inner, lambda: started.append(None))
+        events = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        async def receive():
+            return next(events)
+        sent = []
+        async def send(message):
+            sent.append(message['type'])
+        await application({'type': 'lifespan'}, receive, send)
+        await application({'type': 'websocket'}, receive, send)
+        self.assertEqual(len(started), 1)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertEqual(inner_scopes, ['websocket'])
+
+    async def test_startup_tasks_run_with_the_first_scope_without_lifespan(self):
+        started = []
+        async def inner(scope, receive, send):
+            pass
+        application = StartupMiddleware(inner, lambda: started.append(None))
+        for _ in range(2):
+            await application({'type': 'http'}, None, None)
+        self.assertEqual(len(started), 1)
+
+
+class CountingTickable:
+    '''Counts the ticks it gets from a TickScheduler'''
+
+    def __init__(self) -> None:
+        self.ticks = []
+
+    async def tick(self, now: float) -> None:
+        self.ticks.append(now)
+
+
+class SleepingTickable(CountingTickable):
+    '''Counts its ticks and spends time on the clock in each of them, one duration per tick'''
+
+    def __init__(self, clock: VirtualClock, durations: list) -> None:
+        super().__init__()
+        self._clock = clock
+        self._durations = iter(durations)
+
+    async def tick(self, now: float) -> None:
+        await super().tick(now)
+        await self._clock.sleep(next(self._durations, 0))
+
+
+class VirtualClockTests(SimpleTestCase):
+
+    def test_clock_without_sleep_cannot_be_created(self):
+        class NowOnlyClock(Clock):
+            def now(self):
+                return 0.0
+        with self.assertRaises(TypeError):
+            NowOnlyClock()
+
+    def test_sleepers_wake_in_deadline_order(self):
+        clock = VirtualClock()
+        woken = []
+        async def sleeper(name, seconds):
+            await clock.sleep(seconds)
+            woken.append((name, clock.now()))
+        async def main():
+            await asyncio.gather(sleeper("late", 3600), sleeper("early", 1), sleeper("middle", 60))
+        asyncio.run(clock.run(main()))
+        self.assertEqual(woken, [("early", 1), ("middle", 60), ("late", 3600)])
+
+    def test_wait_for_times_out_at_the_virtual_deadline(self):
+        clock = VirtualClock()
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await clock.wait_for(clock.sleep(30), 10)
+            self.assertEqual(clock.now(), 10)
+            self.assertEqual(await clock.wait_for(asyncio.sleep(0, "done"), 10), "done")
+        asyncio.run(clock.run(main()))
+
+    def test_tick_scheduler_runs_on_the_virtual_clock(self):
+        clock = VirtualClock()
+        scheduler = TickScheduler(tick_rate=60, phases=4, clock=clock)
+        tickable = CountingTickable()
+        async def main():
+            scheduler.register(tickable)
+            await clock.sleep(10)
+            scheduler.unregister(tickable)
+        asyncio.run(clock.run(main()))
+        self.assertAlmostEqual(len(tickable.ticks), 600, delta=1)
+        self.assertAlmostEqual(tickable.ticks[-1] - tickable.ticks[0], 10, delta=1 / 60)
+        self.assertEqual(scheduler.get_max_tick_lag(), 0)
+
+    def test_batched_engine_steps_the_sessions_of_a_phase_together(self):
+        clock = VirtualClock()
+        engine = BatchedPhysicsEngine.get_instance(clock)
+        advance = engine.advance
+        stepped = []
+        def recording_advance():
+            stepped.append(int(engine.step_requested.sum()))
+            advance()
+        engine.advance = recording_advance
+        async def main():
+            sessions = [BatchedGameSession(None, clock=clock) for _ in range(3)]
+            for _ in range(128):
+                await asyncio.gather(*(session.calculate_game_state(1 / 128) for session in sessions))
+                await clock.sleep(1 / 128)
+            for session in sessions:
+                session.close()
+            return [session.get_tick() for session in sessions]
+        ticks = asyncio.run(clock.run(main()))
+        # One virtual second of 64 Hz steps, the real time it took is far too short for them
+        self.assertEqual(ticks, [round(1 / PHYSICS_STEP)] * 3)
+        self.assertEqual(stepped, [3] * 128)
+
+
+class TickSchedulerTests(SimpleTestCase):
+
+    def run_scheduler(self, scheduler: TickScheduler, clock: VirtualClock, tickables: list, seconds: float) -> None:
+        async def main():
+            for tickable in tickables:
+                scheduler.register(tickable)
+            await clock.sleep(seconds)
+            for tickable in tickables:
+                scheduler.unregister(tickable)
+        asyncio.run(clock.run(main()))
+
+    def test_time_spent_ticking_does_not_delay_the_next_tick(self):
+        clock = VirtualClock()
+        scheduler = TickScheduler(tick_rate=10, phases=1, clock=clock)
+        tickable = SleepingTickable(clock, [0.03] * 100)
+        self.run_scheduler(scheduler, clock, [tickable], 5)
+        self.assertAlmostEqual(len(tickable.ticks), 50, delta=1)
+        for index, now in enumerate(tickable.ticks):
+            self.assertAlmostEqual(now - tickable.ticks[0], index * 0.1, places=9)
+
+    def test_tickables_are_spread_over_the_phases(self):
+        clock = VirtualClock()
+        scheduler = TickScheduler(tick_rate=10, phases=4, clock=clock)
+        tickables = [CountingTickable() for _ in range(4)]
+        self.run_scheduler(scheduler, clock, tickables, 1)
+        for index, tickable in enumerate(tickables):
+            self.assertAlmostEqual(tickable.ticks[0], index * 0.025, places=9)
+            self.assertAlmostEqual(tickable.ticks[1] - tickable.ticks[0], 0.1, places=9)
+
+    def test_missed_ticks_are_skipped_after_a_stall(self):
+        clock = VirtualClock()
+        scheduler = TickScheduler(tick_rate=10, phases=1, clock=clock)
+        tickable = SleepingTickable(clock, [0, 0, 0.35])
+        self.run_scheduler(scheduler, clock, [tickable], 2)
+        # No burst to catch up, the ticks that fell into the stall are dropped
+        gaps = [later - earlier for earlier, later in zip(tickable.ticks, tickable.ticks[1:])]
+        self.assertGreaterEqual(min(gaps), 0.1 - 1e-9)
+        self.assertLess(len(tickable.ticks), 20)
+
+
+class TimeoutWheelTests(SimpleTestCase):
+
+    def test_timeouts_fire_in_order_at_most_one_resolution_late(self):
+        clock = VirtualClock()
+        wheel = TimeoutWheel(resolution=0.1, slots=8, clock=clock)
+        fired = []
+        async def main():
+            # Longer than a turn of the wheel, these share slots with the short ones
+            for delay in (5.0, 0.35, 2.0, 0.8):
+                wheel.schedule(delay, lambda delay=delay: fired.append((delay, clock.now())))
+            cancelled = wheel.schedule(0.5, lambda: fired.append((0.5, clock.now())))
+            cancelled.cancel()
+            self.assertFalse(cancelled.is_pending())
+            await clock.sleep(6)
+        asyncio.run(clock.run(main()))
+        self.assertEqual([delay for delay, _ in fired], [0.35, 0.8, 2.0, 5.0])
+        for delay, fired_at in fired:
+            self.assertTrue(delay <= fired_at <= delay + 0.1 + 1e-9, (delay, fired_at))
+        self.assertEqual(wheel.get_pending_count(), 0)
+
+
+class ConnectionNotifierTests(SimpleTestCase):
+
+    def test_wait_ends_on_notify_without_waiting_for_the_timeout(self):
+        clock = VirtualClock()
+        wheel = TimeoutWheel(resolution=0.1, clock=clock)
+        notifier = ConnectionNotifier(wheel)
+        connected = set()
+        async def connect_later():
+            await clock.sleep(2)
+            connected.add(1)
+            notifier.notify()
+        async def main():
+            asyncio.ensure_future(connect_later())
+            self.assertTrue(await notifier.wait_until(lambda: 1 in connected, 10))
+            self.assertEqual(clock.now(), 2)
+            self.assertTrue(await notifier.wait_until(lambda: 1 in connected, 10))
+        asyncio.run(clock.run(main()))
+        self.assertEqual(notifier.get_waiter_count(), 0)
+        self.assertEqual(wheel.get_pending_count(), 0)
+
+    def test_wait_times_out(self):
+        clock = VirtualClock()
+        wheel = TimeoutWheel(resolution=0.1, clock=clock)
+        notifier = ConnectionNotifier(wheel)
+        async def main():
+            self.assertFalse(await notifier.wait_until(lambda: False, 10))
+            self.assertTrue(10 <= clock.now() <= 10.1 + 1e-9)
+        asyncio.run(clock.run(main()))
+        self.assertEqual(notifier.get_waiter_count(), 0)
+
+
+async def wait_until(condition, timeout: float = 60.0) -> None:
+    '''Poll a condition in real time, for the tests that wait on other processes'''
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise AssertionError("Condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+class EngineParityTests(SimpleTestCase):
+
+    async def test_batched_session_plays_like_a_python_one(self):
+        clock = VirtualClock() # Only keeps the engine apart from the one of the other tests
+        goals = {"python": [], "batched": []}
+        def goal_recorder(engine_name):
+            async def on_player_scored(player_id, tick):
+                goals[engine_name].append((tick, player_id))
+            return on_player_scored
+        python_session = GameSession(goal_recorder("python"))
+        batched_session = BatchedGameSession(goal_recorder("batched"), None, clock)
+        rng = random.Random(11)
+        for _ in range(3000):
+            if rng.random() < 0.1:
+                player_id, direction = rng.randrange(2), rng.choice((-1, 0, 1))
+                python_session.update_player_direction(player_id, direction)
+                batched_session.update_player_direction(player_id, direction)
+            delta_time = rng.choice((1 / 60, 1 / 30, 0.004, 0.25))
+            await python_session.calculate_game_state(delta_time)
+            await batched_session.calculate_game_state(delta_time)
+            # The state of the tick itself, not the one of the tick before
+            self.assertEqual(batched_session.get_tick(), python_session.get_tick())
+            for python_value, batched_value in zip(python_session.get_state()[:6], batched_session.get_state()[:6]):
+                self.assertAlmostEqual(python_value, batched_value, places=9)
+        batched_session.close()
+        self.assertEqual(batched_session.to_dict(), python_session.to_dict())
+        self.assertGreater(len(goals["python"]), 2)
+        self.assertEqual(goals["batched"], goals["python"])
+
+
+class InPlaceMathTests(SimpleTestCase):
+
+    async def test_python_engine_moves_its_vectors_in_place(self):
+        session = GameSession(None)
+        position = session.ball.get_position()
+        direction = session.ball.get_direction()
+        paddle_position = session.paddle_left.get_position()
+        session.update_player_direction(0, 1)
+        start = position.copy()
+        for _ in range(10):
+            session.step()
+        self.assertIs(session.ball.get_position(), position)
+        self.assertIs(session.ball.get_direction(), direction)
+        self.assertIs(session.paddle_left.get_position(), paddle_position)
+        self.assertNotEqual(position, start)
+
+
+class FixedStepTests(SimpleTestCase):
+
+    async def play(self, delta_times: list) -> tuple:
+        '''Play with a moving paddle, returns the tick and the positions'''
+        session = GameSession(None)
+        session.update_player_direction(0, 1)
+        for delta_time in delta_times:
+            await session.calculate_game_state(delta_time)
+        return session.get_tick(), session.get_state()[:6]
+
+    async def test_outcome_does_not_depend_on_the_tick_lengths(self):
+        # Binary fractions, so both add up to exactly half a second
+        even = await self.play([1 / 128] * 64)
+        uneven = await self.play([0.125, 0.0625, 0.125, 0.0078125, 0.1171875, 0.0625])
+        self.assertEqual(even, uneven)
+        self.assertEqual(even[0], round(0.5 / PHYSICS_STEP))
+
+    async def test_stall_drops_the_time_beyond_the_catch_up_limit(self):
+        session = GameSession(None)
+        await session.calculate_game_state(10)
+        self.assertEqual(session.get_tick(), MAX_CATCH_UP_STEPS)
+        await session.calculate_game_state(PHYSICS_STEP / 2)
+        self.assertEqual(session.get_tick(), MAX_CATCH_UP_STEPS)
+        await session.calculate_game_state(PHYSICS_STEP / 2)
+        self.assertEqual(session.get_tick(), MAX_CATCH_UP_STEPS + 1)
+
+
+class SweptCollisionTests(SimpleTestCase):
+    '''A fast ball bounces off everything in its way and travels its whole distance, the same way in both engines'''
+
+    def step_both(self, position, angle: float, distance: float, right_paddle_y: float = None):
+        '''Step a Python and a batched session once from the same ball state, returns the Python state'''
+        clock = VirtualClock() # Never driven, the test steps the engine itself
+        engine = BatchedPhysicsEngine.get_instance(clock)
+        python_session = GameSession(None)
+        batched_session = BatchedGameSession(None, None, clock)
+        slot = batched_session._slot
+        direction = (math.cos(math.radians(angle)), math.sin(math.radians(angle)))
+        # The speed grows with the time alive, pick the one that covers the distance in a step
+        time_alive = (distance / PHYSICS_STEP - BALL_SPEED) / SPEED_MULTIPLIER
+
+        ball = python_session.ball
+        ball._position.set(*position)
+        ball._direction.set(*direction)
+        ball._time_alive = time_alive
+        engine.ball_position[slot] = position
+        engine.ball_direction[slot] = direction
+        engine.ball_time_alive[slot] = time_alive
+        if right_paddle_y is not None:
+            python_session.paddle_right.get_position().y = right_paddle_y
+            engine.paddle_y[slot, 1] = right_paddle_y
+
+        python_session.step()
+        engine.step(np.array([slot]))
+        states = python_session.get_state(), batched_session.get_state()
+        batched_session.close()
+        for python_value, batched_value in zip(*(state[:6] for state in states)):
+            self.assertAlmostEqual(python_value, batched_value, places=9)
+        return states[0]
+
+    async def test_fast_ball_does_not_pass_through_a_paddle(self):
+        # Five units per step, far more than the paddle is thick
+        state = self.step_both((13.0, 4.4), 0.0, 5.0)
+        self.assertLessEqual(state[4] + BALL_SIZE, PADDLE_X[1] + 1e-9)
+        self.assertGreater(state[4], 10.0) # Bounced back, not put back to the center after a goal
+
+    async def test_bounces_beyond_the_limit_per_step_keep_the_distance(self):
+        # Nearly vertical, about nine bounces between the walls in one step
+        angle = 87.0
+        state = self.step_both((8.0, 4.5), angle, 80.0)
+        self.assertAlmostEqual(state[4], 8.0 + math.cos(math.radians(angle)) * 80.0, places=9)
+        self.assertGreaterEqual(state[5], 0.0)
+        self.assertLessEqual(state[5], WORLD_SIZE[1] - BALL_SIZE)
+
+    async def test_ball_caught_in_a_corner_stays_in_front_of_the_paddle(self):
+        # The right paddle touches the top wall, the ball is shot into the corner between them
+        for angle in range(-89, 0, 4):
+            state = self.step_both((14.5, 1.0), angle, 30.0, right_paddle_y=0.0)
+            self.assertLessEqual(state[4] + BALL_SIZE, PADDLE_X[1] + 1e-9)
+            self.assertGreaterEqual(state[5], 0.0)
+
+
+class SimulationWorkerTests(SimpleTestCase):
+
+    def test_remote_session_plays_like_a_local_one_until_its_worker_dies(self):
+        async def main():
+            pool = SimulationWorkerPool(1)
+            try:
+                failed = asyncio.get_running_loop().create_future()
+                async def on_failed():
+                    failed.set_result(True)
+                remote = RemoteGameSession(None, on_failed=on_failed, pool=pool)
+                local = GameSession(None)
+                self.assertEqual(remote.get_state(), local.get_state())
+                for session in (remote, local):
+                    session.update_player_direction(0, 1)
+                    session.update_player_direction(1, -1)
+                for _ in range(20):
+                    await remote.calculate_game_state(PHYSICS_STEP)
+                    await local.calculate_game_state(PHYSICS_STEP)
+                await wait_until(lambda: remote.get_tick() == 20)
+                self.assertEqual(remote.get_state(), local.get_state())
+
+                worker = pool.get_worker_processes()[0]
+                worker.kill()
+                await asyncio.wait_for(failed, 10)
+                self.assertEqual(pool.get_session_count(), 0)
+                await remote.calculate_game_state(PHYSICS_STEP) # A failed session does nothing
+                self.assertEqual(remote.get_tick(), 20)
+                # The dead worker is replaced for new sessions
+                self.assertIsNot(pool.get_worker_processes()[0], worker)
+                replacement = RemoteGameSession(None, pool=pool)
+                await replacement.calculate_game_state(PHYSICS_STEP)
+                await wait_until(lambda: replacement.get_tick() == 1)
+            finally:
+                processes = pool.get_worker_processes()
+                pool.close()
+                for process in processes:
+                    process.join(10)
+        asyncio.run(main())
+
+
+class RecordingChannelLayer:
+    '''Stands in for the channel layer, keeps the group messages instead of sending them'''
+
+    def __init__(self) -> None:
+        self.messages = []
+
+    async def group_send(self, group: str, message: dict) -> None:
+        self.messages.append(message)
+
+
+class FakeMatchConsumer:
+    '''Stands in for a MatchConsumer of this process, keeps the position updates handed to it'''
+
+    def __init__(self) -> None:
+        self.frames = []
+
+    async def position_update(self, event: dict) -> None:
+        self.frames.append(event["data"])
+
+
+class DeliveryPathTests(SimpleTestCase):
+
+    async def test_a_changed_delivery_path_starts_with_a_keyframe(self):
+        match = MatchSession(1, 2, clock=VirtualClock(), is_recorded=False)
+        layer = RecordingChannelLayer()
+        match._channel_layer = layer
+        match._connected_users = {1, 2}
+        consumers = {1: FakeMatchConsumer(), 2: FakeMatchConsumer()}
+        for user_id, consumer in consumers.items():
+            MatchConsumers.add_consumer(match.get_id(), user_id, consumer)
+        try:
+            await match._send_position_update()
+            await match._send_position_update()
+            self.assertEqual([frame[1] for frame in consumers[1].frames], [STATE, STATE_DELTA])
+
+            # User 2 reconnected through another node, the updates go through the channel layer
+            MatchConsumers.remove_consumer(match.get_id(), consumers[2])
+            await match._send_position_update()
+            await match._send_position_update()
+            self.assertEqual([message["data"][1] for message in layer.messages], [STATE, STATE_DELTA])
+
+            MatchConsumers.add_consumer(match.get_id(), 2, consumers[2])
+            await match._send_position_update()
+            self.assertEqual(consumers[1].frames[-1][1], STATE)
+        finally:
+            for consumer in consumers.values():
+                MatchConsumers.remove_consumer(match.get_id(), consumer)
+            match._scheduler.unregister(match)
+
+    async def test_consumer_drops_updates_that_were_overtaken(self):
+        consumer = MatchConsumer()
+        sent = []
+        async def send(text_data=None, bytes_data=None):
+            sent.append(bytes_data)
+        consumer.send = send
+        consumer._connection_established = True
+        encoder = FrameEncoder()
+        state = (1.0, 4.5, 15.0, 4.5, 8.0, 4.5, False, False)
+        old_path = [encoder.state(tick, state) for tick in range(2)]
+        encoder.request_keyframe()
+        new_path = encoder.state(2, state)
+        # The keyframe of the new path arrives before the last frame of the old one
+        for frame in (old_path[0], new_path, old_path[1]):
+            await consumer.position_update({"data": frame})
+        consumer._mailbox.start()
+        await asyncio.sleep(0)
+        await consumer._mailbox.drain()
+        await consumer._mailbox.close()
+        self.assertEqual(sent, [new_path])
+
+
+class OutboundMailboxTests(SimpleTestCase):
+
+    async def test_slow_client_gets_the_latest_snapshot_and_every_control_message_in_order(self):
+        sent = []
+        release = asyncio.Event()
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data if text_data is not None else bytes_data)
+            await release.wait()
+        mailbox = OutboundMailbox(send)
+        mailbox.start()
+        mailbox.put_snapshot(b"s1")
+        await asyncio.sleep(0)
+        self.assertEqual(sent, [b"s1"]) # The writer waits for the client
+        mailbox.put_control(text_data="c1")
+        for snapshot in (b"s2", b"s3", b"s4"):
+            mailbox.put_snapshot(snapshot)
+        mailbox.put_control(text_data="c2")
+        release.set()
+        await mailbox.drain()
+        await mailbox.close()
+        self.assertEqual(sent, [b"s1", "c1", "c2", b"s4"])
+        self.assertEqual(mailbox.get_sent_frames(), 2)
+        self.assertEqual(mailbox.get_dropped_frames(), 2)
+        self.assertEqual(mailbox.get_sent_control_messages(), 2)
+
+
+def decode_positions(frames: list) -> tuple:
+    '''Apply state and delta frames in order like a client, returns the positions in quantization steps and the last flags'''
+    positions = [None] * 6
+    flags = 0
+    for frame in frames:
+        changed, flags = _unpack_state(frame)
+        positions = [new_value if new_value is not None else value for value, new_value in zip(positions, changed)]
+    return positions, flags
+
+def quantized(state: tuple) -> list:
+    '''Get the positions of a state in quantization steps'''
+    return [quantize(value, SCALE_X if index % 2 == 0 else SCALE_Y) for index, value in enumerate(state[:6])]
+
+def moved_state(ball_x: float, left_y: float = 3.25, wall_collision: bool = False, paddle_collision: bool = False) -> tuple:
+    '''Get a state with the paddles in place and the ball at ball_x'''
+    return (0.0, left_y, 15.8, 3.25, ball_x, 4.5, wall_collision, paddle_collision)
+
+
+class FrameHeaderTests(SimpleTestCase):
+
+    def test_state_frame_carries_fixed_point_positions(self):
+        encoder = FrameEncoder()
+        state = (0.0, 3.25, 15.8, 3.25, 8.123, 4.567, False, True)
+        frame = encoder.state(7, state)
+        self.assertEqual(len(frame), STATE_FRAME.size)
+        self.assertLess(STATE_FRAME.size, 26) # The float frame this protocol replaced
+        self.assertEqual(HEADER_FRAME.unpack_from(frame), (PROTOCOL_VERSION, STATE, 0, 7))
+        positions, flags = decode_positions([frame])
+        self.assertEqual((positions, flags), (quantized(state), PADDLE_COLLISION))
+        for index, value in enumerate(state[:6]):
+            scale = SCALE_X if index % 2 == 0 else SCALE_Y
+            self.assertAlmostEqual(positions[index] / scale, value, delta=0.5 / scale)
+
+    def test_sequence_wraps_around(self):
+        encoder = FrameEncoder()
+        encoder._sequence = 0xFFFF
+        frames = [encoder.state(tick, moved_state(8.0)) for tick in range(2)]
+        self.assertEqual([get_sequence(frame) for frame in frames], [0xFFFF, 0])
+        self.assertTrue(is_newer_sequence(0, 0xFFFF))
+        self.assertFalse(is_newer_sequence(0xFFFF, 0))
+        self.assertFalse(is_newer_sequence(5, 5))
+
+
+class FrameEncoderTests(SimpleTestCase):
+
+    def test_deltas_only_carry_the_changed_positions(self):
+        encoder = FrameEncoder()
+        keyframe = encoder.state(0, moved_state(8.0))
+        delta = encoder.state(1, moved_state(8.5))
+        self.assertEqual(keyframe[1], STATE)
+        self.assertEqual(delta[1], STATE_DELTA)
+        self.assertEqual(len(delta), 12) # Header, mask, flags and the ball x
+        self.assertEqual(decode_positions([keyframe, delta]), (quantized(moved_state(8.5)), 0))
+        self.assertEqual([get_sequence(keyframe), get_sequence(delta)], [0, 1])
+
+    def test_keyframes_at_the_interval_and_on_request(self):
+        encoder = FrameEncoder()
+        frames = [encoder.state(tick, moved_state(8.0 + tick * 0.01)) for tick in range(KEYFRAME_INTERVAL * 2 + 1)]
+        keyframe_ticks = [tick for tick, frame in enumerate(frames) if frame[1] == STATE]
+        self.assertEqual(keyframe_ticks, [0, KEYFRAME_INTERVAL, KEYFRAME_INTERVAL * 2])
+        encoder.request_keyframe()
+        self.assertEqual(encoder.state(KEYFRAME_INTERVAL * 2 + 1, moved_state(8.0))[1], STATE)
+
+    def test_skipped_collisions_are_reported_with_the_next_frame(self):
+        encoder = FrameEncoder()
+        encoder.state(0, moved_state(8.0))
+        encoder.skip_state(moved_state(8.1, wall_collision=True))
+        self.assertEqual(decode_positions([encoder.state(2, moved_state(8.2))])[1], WALL_COLLISION)
+
+    def test_merged_frames_lose_no_change(self):
+        encoder = FrameEncoder()
+        keyframe = encoder.state(0, moved_state(8.0))
+        ball_moved = encoder.state(1, moved_state(8.5, wall_collision=True))
+        paddle_moved = encoder.state(2, moved_state(8.5, left_y=4.0, paddle_collision=True))
+
+        merged = merge_state_frames(ball_moved, paddle_moved)
+        self.assertEqual(merged[1], STATE_DELTA)
+        self.assertEqual(get_sequence(merged), get_sequence(paddle_moved))
+        self.assertEqual(decode_positions([keyframe, merged]),
+                         (quantized(moved_state(8.5, left_y=4.0)), WALL_COLLISION | PADDLE_COLLISION))
+
+        merged_keyframe = merge_state_frames(keyframe, ball_moved)
+        self.assertEqual(merged_keyframe[1], STATE)
+        self.assertEqual(decode_positions([merged_keyframe]), (quantized(moved_state(8.5)), WALL_COLLISION))
+
+        encoder.request_keyframe()
+        newer_keyframe = encoder.state(3, moved_state(9.0))
+        self.assertEqual(merge_state_frames(paddle_moved, newer_keyframe), newer_keyframe)
+
+
+class SendCadenceTests(SimpleTestCase):
+
+    def send_times(self, tick_times: list, interval: float) -> list:
+        '''Get the tick times at which a send is due'''
+        next_send_time = 0.0
+        sends = []
+        for now in tick_times:
+            following = advance_cadence(now, next_send_time, interval)
+            if following is not None:
+                next_send_time = following
+                sends.append(now)
+        return sends
+
+    def test_sends_at_the_send_rate_whatever_the_tick_jitter(self):
+        rng = random.Random(5)
+        tick_times = [tick / 60 + rng.uniform(-0.002, 0.002) for tick in range(600)]
+        sends = self.send_times(tick_times, 1 / 20)
+        self.assertEqual(len(sends), 200)
+        for earlier, later in zip(sends, sends[1:]):
+            self.assertAlmostEqual(later - earlier, 1 / 20, delta=0.005)
+
+    def test_stall_restarts_the_cadence_instead_of_bursting(self):
+        tick_times = [tick / 60 for tick in range(30)] + [2 + tick / 60 for tick in range(30)]
+        sends = self.send_times(tick_times, 1 / 20)
+        after_stall = [now for now in sends if now >= 2]
+        self.assertEqual(after_stall[0], 2)
+        for earlier, later in zip(after_stall, after_stall[1:]):
+            self.assertAlmostEqual(later - earlier, 1 / 20, delta=0.005)
+
+
+class SpectatorStreamTests(SimpleTestCase):
+
+    async def test_spectators_share_one_reduced_rate_stream(self):
+        match = MatchSession(1, 2, clock=VirtualClock(), is_recorded=False)
+        layer = RecordingChannelLayer()
+        match._channel_layer = layer
+        try:
+            match.add_spectator()
+            match.add_spectator()
+            # Half a second of ticks at 60 Hz
+            for tick in range(1, 31):
+                await match._game_session.calculate_game_state(1 / 60)
+                match._update_spectators(tick / 60)
+                await asyncio.sleep(0)
+            await match._spectators.drain()
+        finally:
+            await match._spectators.close()
+            match._scheduler.unregister(match)
+        self.assertTrue(all(message["type"] == "spectator_frame" for message in layer.messages))
+        frames = [message["data"] for message in layer.messages]
+        # The keyframe of the second spectator replaced the one of the first before it was sent
+        self.assertEqual([frame[1] for frame in frames], [USER_MAPPING, PLAYER_SCORES] * 2 + [STATE] + [STATE_DELTA] * 10)
+        self.assertEqual(decode_positions(frames[4:])[0], quantized(match._game_session.get_state()))
+
+    async def test_spectator_skips_the_deltas_before_its_first_keyframe(self):
+        consumer = SpectatorConsumer()
+        sent = []
+        async def send(text_data=None, bytes_data=None):
+            sent.append(bytes_data)
+        consumer.send = send
+        consumer._connection_established = True
+        consumer._mailbox.start()
+        encoder = FrameEncoder()
+        encoder.state(0, moved_state(8.0))
+        early_delta = encoder.state(1, moved_state(8.1))
+        mapping = encoder.user_mapping(1, False, 1, 2)
+        encoder.request_keyframe()
+        keyframe = encoder.state(2, moved_state(8.2))
+        delta = encoder.state(3, moved_state(8.3))
+        for frame in (early_delta, mapping, keyframe, delta):
+            await consumer.spectator_frame({"data": frame})
+            await asyncio.sleep(0)
+            await consumer._mailbox.drain()
+        await consumer._mailbox.close()
+        self.assertEqual(sent, [mapping, keyframe, delta])
+
+
+class RecordingAccessTests(SimpleTestCase):
+
+    def test_only_players_and_staff_can_view_a_recording(self):
+        recording = MatchRecording(1, 2, 0, {}, [])
+        self.assertTrue(recording.is_viewable_by(SimpleNamespace(id=1, is_staff=False)))
+        self.assertTrue(recording.is_viewable_by(SimpleNamespace(id=2, is_staff=False)))
+        self.assertTrue(recording.is_viewable_by(SimpleNamespace(id=3, is_staff=True)))
+        self.assertFalse(recording.is_viewable_by(SimpleNamespace(id=3, is_staff=False)))
+        self.assertFalse(recording.is_viewable_by(SimpleNamespace(id=None, is_staff=False)))
+
+
+class RecordingRoundTripTests(SimpleTestCase):
+    '''A recorded match replays to the goals and the state of the live match, whatever engine played it'''
+
+    async def play_recorded(self, path: str, create_session, after_calculate=None, finish=None):
+        '''Play a match with random inputs and tick lengths, returns the goals and the final state and tick'''
+        rng = random.Random(3)
+        recorder = MatchRecorder("round-trip", 1, 2, path=path)
+        goals = []
+        async def on_player_scored(player_id, tick):
+            goals.append((tick, player_id))
+            recorder.record_score(tick, player_id, *(sum(1 for _, scorer in goals if scorer == player) for player in (0, 1)))
+        session = create_session(on_player_scored, recorder.record_input)
+        for _ in range(4000):
+            if rng.random() < 0.2:
+                session.update_player_direction(rng.randrange(2), rng.choice((-1, 0, 1)))
+            delta_time = rng.choice((1 / 60, 1 / 30, 0.004, 0.25))
+            await session.calculate_game_state(delta_time)
+            if after_calculate is not None:
+                after_calculate(delta_time)
+            await asyncio.sleep(0) # Lets the replies of a worker arrive in between
+        if finish is not None:
+            await finish(session)
+        state, tick = session.get_state(), session.get_tick()
+        await recorder.close(tick, 0, None)
+        session.close()
+        return goals, state, tick
+
+    def assert_replays_like_live(self, path: str, goals, state, tick) -> None:
+        recording = MatchRecording.load(path)
+        self.assertGreater(len(goals), 2)
+        self.assertGreater(len(list(recording.get_inputs())), 100)
+        result = recording.verify()
+        self.assertTrue(result["is_consistent"])
+        self.assertEqual(result["ticks"], tick)
+        self.assertEqual(recording.get_last_tick(), tick)
+        self.assertEqual(result["score"], [sum(1 for _, scorer in goals if scorer == player) for player in (0, 1)])
+        *_, (replayed_tick, replayed_state, _) = recording.replay()
+        self.assertEqual(replayed_tick, tick)
+        self.assertEqual(replayed_state[:6], state[:6]) # The collision flags cover a tick, not a step
+
+    def test_python_engine(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "match.rec")
+            result = asyncio.run(self.play_recorded(path, GameSession))
+            self.assert_replays_like_live(path, *result)
+
+    def test_batched_engine(self):
+        clock = VirtualClock() # Only keeps the engine apart from the one of the other tests
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "match.rec")
+            result = asyncio.run(self.play_recorded(path, lambda on_scored, on_input: BatchedGameSession(on_scored, on_input, clock)))
+            self.assert_replays_like_live(path, *result)
+
+    def test_worker_engine(self):
+        async def main(path):
+            pool = SimulationWorkerPool(1)
+            twin = GameSession(None) # Gets the same calls locally, to know when the worker has caught up
+            twin_goals = []
+            async def on_twin_scored(player_id, tick):
+                twin_goals.append((tick, player_id))
+            twin._on_player_scored = on_twin_scored
+            def create_session(on_scored, on_input):
+                session = RemoteGameSession(on_scored, on_input, pool=pool)
+                update = session.update_player_direction
+                calculate = session.calculate_game_state
+                def update_both(player_id, direction):
+                    update(player_id, direction)
+                    twin.update_player_direction(player_id, direction)
+                async def calculate_both(delta_time):
+                    await calculate(delta_time)
+                    await twin.calculate_game_state(delta_time)
+                session.update_player_direction = update_both
+                session.calculate_game_state = calculate_both
+                return session
+            async def finish(session):
+                await wait_until(lambda: session.get_tick() == twin.get_tick())
+                await session.calculate_game_state(0) # Reports the goals of the last snapshot
+                await wait_until(lambda: session.get_tick() == twin.get_tick())
+                self.assertEqual(session.get_state(), twin.get_state())
+            processes = pool.get_worker_processes()
+            try:
+                return await self.play_recorded(path, create_session, finish=finish)
+            finally:
+                pool.close()
+                for process in processes:
+                    process.join(10)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "match.rec")
+            result = main(path)
+            result = asyncio.run(result)
+            self.assert_replays_like_live(path, *result)
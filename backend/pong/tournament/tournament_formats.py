@@ -0,0 +1,240 @@
+import math
+from typing import Dict, List, Optional, Set, Tuple
+from django.conf import settings
+
+SWISS_ROUNDS = settings.TOURNAMENT_CONFIG['swiss_rounds']
+
+# A match of a round: user1 vs user2
+Pairing = Tuple[int, int]
+
+def get_round_robin_rounds(users: List[int]) -> List[List[Pairing]]:
+    '''Split every pairing of the users into rounds in which nobody plays twice (circle method)
+
+    The first user stays in place while the others rotate around them, each rotation is one round.
+    With an odd number of users a bye joins the rotation and its opponent sits the round out.'''
+    players: List[Optional[int]] = list(users)
+    if len(players) % 2:
+        players.append(None)
+    n = len(players)
+    rounds = []
+    for _ in range(n - 1):
+        pairs = [(players[i], players[n - 1 - i]) for i in range(n // 2)]
+        rounds.append([pair for pair in pairs if None not in pair])
+        players = [players[0], players[-1]] + players[1:-1]
+    return rounds
+
+def get_bracket_order(size: int) -> List[int]:
+    '''Get the seeds of a bracket of size (a power of two) from top to bottom, neighbours meet in the first round
+
+    The best seeds meet as late as possible and the byes go to the best seeds.'''
+    order = [0]
+    while len(order) < size:
+        order = [seed for previous in order for seed in (previous, 2 * len(order) - 1 - previous)]
+    return order
+
+
+class TournamentFormat:
+    '''Decides who plays whom, one round at a time
+
+    The TournamentSession asks for the next round once every result of the current one is in.
+    The users are passed best seed first.'''
+
+    name: str = ""
+
+    def __init__(self, users: List[int]) -> None:
+        self._users = list(users)
+        self._schedule: List[List[Pairing]] = [] # The rounds known so far, sent to the users
+        self._eliminated: Set[int] = set() # Users that are out since the last call to pop_eliminated
+
+    def next_round(self) -> List[Pairing]:
+        '''Get the matches of the next round, an empty list once the tournament is over'''
+        raise NotImplementedError
+
+    def add_result(self, user1: int, user2: int, winner: Optional[int]) -> None:
+        '''Add the result of a match of the current round, winner is None for a draw'''
+        raise NotImplementedError
+
+    def get_winner(self) -> Optional[int]:
+        '''Get the winner once the tournament is over, None if there is none'''
+        raise NotImplementedError
+
+    def get_schedule(self) -> List[List[Pairing]]:
+        '''Get the rounds known so far'''
+        return self._schedule
+
+    def pop_eliminated(self) -> Set[int]:
+        '''Get the users that are out of the tournament since the last call'''
+        eliminated, self._eliminated = self._eliminated, set()
+        return eliminated
+
+
+class RoundRobinFormat(TournamentFormat):
+    '''Everyone plays everyone, the users tied for the most wins play another round robin among them
+
+    n * (n - 1) / 2 matches in n - 1 rounds. If every user of a stage is tied, e.g. after a circle of
+    wins, a replay would end the same way, so the best seed among them wins.'''
+
+    name = "round_robin"
+
+    def __init__(self, users: List[int]) -> None:
+        super().__init__(users)
+        self._stage_users = list(users)
+        self._rounds: List[List[Pairing]] = []
+        self._wins: Dict[int, int] = {}
+        self._winner: Optional[int] = None
+        self._is_finished = False
+        self._start_stage()
+
+    def _start_stage(self) -> None:
+        '''Schedule a round robin among the users of the stage'''
+        self._rounds = get_round_robin_rounds(self._stage_users)
+        self._schedule = list(self._rounds)
+        self._wins = {user: 0 for user in self._stage_users}
+
+    def next_round(self) -> List[Pairing]:
+        if self._is_finished:
+            return []
+        if not self._rounds:
+            self._finish_stage()
+            if self._is_finished:
+                return []
+        return self._rounds.pop(0)
+
+    def _finish_stage(self) -> None:
+        '''Find the winner of the stage or start the next one with the tied users'''
+        max_wins = max(self._wins.values())
+        if max_wins == 0:
+            # No matches were won, there is no winner
+            self._is_finished = True
+            return
+        winners = [user for user, wins in self._wins.items() if wins == max_wins] # Best seed first
+        if len(winners) == 1 or len(winners) == len(self._stage_users):
+            self._winner = winners[0]
+            self._is_finished = True
+            return
+        self._eliminated.update(user for user in self._stage_users if user not in winners)
+        self._stage_users = winners
+        self._start_stage()
+
+    def add_result(self, user1: int, user2: int, winner: Optional[int]) -> None:
+        if winner is not None:
+            self._wins[winner] += 1
+
+    def get_winner(self) -> Optional[int]:
+        return self._winner
+
+
+class SingleEliminationFormat(TournamentFormat):
+    '''The winner of a match moves on, the loser is out
+
+    The bracket is filled up to a power of two with byes for the best seeds, n - 1 matches in
+    log2(n) rounds. After a draw neither user moves on and their next opponent gets a walkover.'''
+
+    name = "single_elimination"
+
+    def __init__(self, users: List[int]) -> None:
+        super().__init__(users)
+        size = 1 << (len(users) - 1).bit_length()
+        seeds: List[Optional[int]] = self._users + [None] * (size - len(users))
+        self._slots: List[Optional[int]] = [seeds[seed] for seed in get_bracket_order(size)]
+        self._next_slots: Optional[List[Optional[int]]] = None
+        self._slot_of_match: Dict[frozenset, int] = {} # Match of the current round -> its slot in the next round
+
+    def next_round(self) -> List[Pairing]:
+        while True:
+            if self._next_slots is not None:
+                self._slots, self._next_slots = self._next_slots, None
+            if len(self._slots) <= 1:
+                return []
+            matches = []
+            self._next_slots = []
+            self._slot_of_match = {}
+            for index in range(0, len(self._slots), 2):
+                user1, user2 = self._slots[index], self._slots[index + 1]
+                if user1 is None or user2 is None:
+                    # Bye or walkover
+                    self._next_slots.append(user1 if user2 is None else user2)
+                    continue
+                self._slot_of_match[frozenset((user1, user2))] = len(self._next_slots)
+                self._next_slots.append(None)
+                matches.append((user1, user2))
+            if matches:
+                self._schedule.append(matches)
+                return matches
+
+    def add_result(self, user1: int, user2: int, winner: Optional[int]) -> None:
+        slot = self._slot_of_match.pop(frozenset((user1, user2)), None)
+        if slot is None:
+            return
+        self._next_slots[slot] = winner
+        self._eliminated.update(user for user in (user1, user2) if user != winner)
+
+    def get_winner(self) -> Optional[int]:
+        return self._slots[0] if len(self._slots) == 1 else None
+
+
+class SwissFormat(TournamentFormat):
+    '''Every round pairs users with the same score who have not met yet, nobody is eliminated
+
+    A win or a bye scores 1, a draw 0.5. The users are ranked by score, then by the summed score of
+    their opponents (Buchholz), then by seed. n / 2 matches in log2(n) rounds unless configured otherwise.'''
+
+    name = "swiss"
+
+    def __init__(self, users: List[int]) -> None:
+        super().__init__(users)
+        self._rounds_left = SWISS_ROUNDS or max(math.ceil(math.log2(len(users))), 1)
+        self._seed = {user: seed for seed, user in enumerate(self._users)}
+        self._score: Dict[int, float] = {user: 0.0 for user in self._users}
+        self._opponents: Dict[int, List[int]] = {user: [] for user in self._users}
+        self._had_bye: Set[int] = set()
+
+    def next_round(self) -> List[Pairing]:
+        if self._rounds_left == 0:
+            return []
+        self._rounds_left -= 1
+
+        unpaired = self._get_standings()
+        if len(unpaired) % 2:
+            # The lowest ranked user without a bye sits out and scores a win
+            bye = next((user for user in reversed(unpaired) if user not in self._had_bye), unpaired[-1])
+            unpaired.remove(bye)
+            self._had_bye.add(bye)
+            self._score[bye] += 1
+
+        matches = []
+        while unpaired:
+            user = unpaired.pop(0)
+            # The highest ranked user they have not met yet, a rematch only if there is no one left
+            opponent = next((other for other in unpaired if other not in self._opponents[user]), unpaired[0])
+            unpaired.remove(opponent)
+            self._opponents[user].append(opponent)
+            self._opponents[opponent].append(user)
+            matches.append((user, opponent))
+        self._schedule.append(matches)
+        return matches
+
+    def add_result(self, user1: int, user2: int, winner: Optional[int]) -> None:
+        if winner is None:
+            self._score[user1] += 0.5
+            self._score[user2] += 0.5
+        else:
+            self._score[winner] += 1
+
+    def get_winner(self) -> Optional[int]:
+        if self._rounds_left > 0 or not any(self._score.values()):
+            return None
+        return self._get_standings()[0]
+
+    def _get_standings(self) -> List[int]:
+        '''Get the users from the highest to the lowest rank'''
+        def buchholz(user: int) -> float:
+            return sum(self._score[opponent] for opponent in self._opponents[user])
+        return sorted(self._users, key=lambda user: (-self._score[user], -buchholz(user), self._seed[user]))
+
+
+TOURNAMENT_FORMATS = {
+    RoundRobinFormat.name: RoundRobinFormat,
+    SingleEliminationFormat.name: SingleEliminationFormat,
+    SwissFormat.name: SwissFormat,
+}
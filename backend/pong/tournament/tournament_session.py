@@ -1,9 +1,14 @@
 import logging
 import asyncio
 from channels.layers import get_channel_layer
-from typing import Set, List, Tuple, Optional, Callable
+from typing import Awaitable, Set, List, Tuple, Optional, Callable
 from ..match.match_session import MatchSession
+from ..match.clock import Clock, get_clock
 from ..data_managment.matches import Matches
+from ..rating.ratings import get_rating
+from .tournament_formats import TOURNAMENT_FORMATS, TournamentFormat
+from .tournament_store import StoredTournament, TournamentStore
+from asgiref.sync import sync_to_async
 from uuid import uuid4
 from typing import Dict
 from django.conf import settings
@@ -13,20 +18,26 @@ logger = logging.getLogger("tournament")
 TIME_BETWEEN_MATCHES = settings.TOURNAMENT_CONFIG['time_between_matches']
 
 class TournamentSession:
-    def __init__(self, owner_user_id: int, name: str, size: int, on_finished: Callable[[str], None]):
-        self._id: str = uuid4().hex
+    def __init__(self, owner_user_id: int, name: str, size: int, on_finished: Callable[[str], Awaitable[bool]], tournament_format: str, tournament_id: Optional[str] = None,
+                 clock: Optional[Clock] = None):
+        self._id: str = tournament_id or uuid4().hex
         self._name: str = name
         self._owner_user_id: int = owner_user_id
         self._max_players: int = size
+        self._format_name: str = tournament_format
+        self._format: Optional[TournamentFormat] = None # Created with the users when the tournament starts
         self._assigned_users: Set[str] = set() # Users that are assigned to the tournament
         self._active_users: Set[str] = set() # Users that are still in the tournament
         self._matches: List[Tuple[str, str]] = [] # List of matches, user1 vs user2 and so on
-        self._results: List[Optional[str]] = []
+        self._rounds: List[List[Tuple[str, str]]] = [] # The matches split into rounds, the matches of a round run at the same time
+        self._running_matches: Dict[str, Tuple[int, str, str]] = {} # Round and users of the matches that did not finish yet, by id
+        self._store: TournamentStore = TournamentStore.get_instance()
         self._user_wins: Dict[str, int] = {} # Number of wins for each user
         self._winner: Optional[str] = None
         self._running: bool = False
         self._condition: asyncio.Condition = asyncio.Condition()
-        self._on_finished: Callable[[str], None] = on_finished
+        self._on_finished: Callable[[str], Awaitable[bool]] = on_finished
+        self._clock: Clock = get_clock(clock) # The pauses between the rounds and the matches run on it
 
         self.add_user(owner_user_id)
         self._channel_layer = get_channel_layer()
@@ -35,105 +46,109 @@ class TournamentSession:
     def __del__(self):
         logger.debug(f"Deleted tournament session {self}")
 
-    async def start(self) -> None:
+    async def start(self, stored: Optional[StoredTournament] = None) -> None:
+        '''Run the tournament, a stored one continues with its next pending match'''
         self._running = True
         self._active_users = self._assigned_users.copy()
+        if stored is None:
+            seeded_users = await self._get_seeded_users()
+            self._store.tournament_started(self._id, self._name, self._owner_user_id, self._format_name, self._max_players, seeded_users)
+            stored_rounds, notified_users = [], set()
+        else:
+            seeded_users, stored_rounds, notified_users = stored.seeded_users, stored.rounds, stored.eliminated_users
+        self._format = TOURNAMENT_FORMATS[self._format_name](seeded_users)
+
+        round_number = 0
         while self._running:
-            self._reset_tracking_variables()
-            self._generate_round_robin_schedule()
-            await self._send_tournament_schedule()
-            await self._start_matches()
-            await self._determine_winner()
-            
-            if self._winner is not None:
-                logger.info(f"Tournament {self._id} finished with winner {self._winner}")
-                self._running = False
+            round_matches = self._format.next_round()
+            eliminated = self._format.pop_eliminated()
+            self._active_users -= eliminated
+            if eliminated - notified_users:
+                self._store.users_eliminated(self._id, list(eliminated - notified_users))
+                for user in eliminated - notified_users:
+                    await self._send_drop_out_message(user)
+            if not round_matches:
+                break
+            if self._format.get_schedule() != self._rounds:
+                self._rounds = list(self._format.get_schedule())
+                self._matches = [match for scheduled in self._rounds for match in scheduled]
+                await self._send_tournament_schedule()
+
+            # The pairings only depend on the seeds and the results, so a stored round is decided again the same way
+            if round_number < len(stored_rounds):
+                results = stored_rounds[round_number]
+            else:
+                results = {}
+                self._store.round_scheduled(self._id, round_number, round_matches)
+            pending_matches = []
+            for user1, user2 in round_matches:
+                if frozenset((user1, user2)) in results:
+                    self._add_result(user1, user2, results[frozenset((user1, user2))])
+                else:
+                    pending_matches.append((user1, user2))
+            if pending_matches:
+                await self._play_round(round_number, pending_matches)
+            round_number += 1
+
+        self._running = False
+        self._winner = self._format.get_winner()
+        self._store.tournament_finished(self._id, self._winner)
         if self._winner is not None:
+            logger.info(f"Tournament {self._id} finished with winner {self._winner}")
             await self._tournament_finished_message()
-        self._on_finished(self._id)
-
-    def _generate_round_robin_schedule(self) -> None:
-        users = list(self._active_users)
-        n = len(users)
-        for i in range(n):
-            for j in range(i + 1, n):
-                self._matches.append((users[i], users[j]))
-
-    async def _determine_winner(self) -> None:
-        # Initialize the score dictionary
-        score = {user: 0 for user in self._active_users}
-
-        # Calculate the scores based on the results
-        for result in self._results:
-            if result is not None:
-                score[result] += 1
-
-        # Log the number of wins for each user
-        for user, points in score.items():
-            logger.debug(f"User {user} has {points} wins.")
-
-        # Determine the maximum score
-        max_score = max(score.values())
-
-        # If no matches were played, there is no winner
-        if max_score == 0:
-            self._winner = None
-            self._running = False
+        else:
             logger.info("No winner found, maybe no matches were played")
-            return
+        # Written before the tournament is unregistered, else this node could resume it as unfinished
+        await self._store.flush()
+        await self._on_finished(self._id)
 
-        # Find the users with the maximum score
-        winners = [user for user, points in score.items() if points == max_score]
+    async def _get_seeded_users(self) -> List[int]:
+        '''Get the users from the highest to the lowest rating'''
+        ratings = {user: await sync_to_async(get_rating)(user) for user in self._active_users}
+        return sorted(ratings, key=lambda user: -ratings[user])
 
-        # Determine the winner or if it's a draw
-        if len(winners) == 1:
-            self._winner = winners[0]
-            return  # Early return if a winner is found
-        else:
-            self._winner = None  # It's a draw
-
-        # Filter users with the maximum score
-        for user in score:
-            if score[user] != max_score:
-                self._active_users.discard(user)
-                await self._send_drop_out_message(user)
-
-    def _reset_tracking_variables(self) -> None:
-        '''Reset the tracking variables for a new round'''
-        self._matches = []
-        self._results = []
-        self._winner = None
-
-    async def _start_matches(self) -> None:
-        for match in self._matches:
-            async with self._condition:
-                await self._send_upcoming_match_message(match[0])
-                await self._send_upcoming_match_message(match[1])
-                # Wait for the specified number of seconds before starting the next match
-                await asyncio.sleep(TIME_BETWEEN_MATCHES)
-                # Create a new match session
-                await self._create_match(match[0], match[1])
-                # Wait until the match is finished
-                await self._condition.wait()
+    async def _play_round(self, round_number: int, round_matches: List[Tuple[str, str]]) -> None:
+        '''Play the matches of a round at the same time, nobody plays twice in a round'''
+        async with self._condition:
+            for user1, user2 in round_matches:
+                await self._send_upcoming_match_message(user1)
+                await self._send_upcoming_match_message(user2)
+            # Wait for the specified number of seconds before starting the next round
+            await self._clock.sleep(TIME_BETWEEN_MATCHES)
+            for user1, user2 in round_matches:
+                match_id = await self._create_match(user1, user2)
+                self._running_matches[match_id] = (round_number, user1, user2)
+                self._store.match_started(self._id, round_number, user1, user2, match_id)
+            # Wait until the last match of the round is finished
+            await self._condition.wait_for(lambda: not self._running_matches)
 
     async def match_finished_callback(self, match_id: str, winner: int) -> None:
-        self._results.append(winner)
-        if winner is not None:
-            winner = str(winner)  # Ensure winner is a string
-            if winner not in self._user_wins:
-                self._user_wins[winner] = 0  # Initialize if not present
-            self._user_wins[winner] += 1
-        Matches.remove_match(match_id)
+        await Matches.remove_match(match_id)
         # Notify the condition variable that the match is finished
         async with self._condition:
+            match = self._running_matches.pop(match_id, None)
+            if match is not None:
+                round_number, user1, user2 = match
+                self._add_result(user1, user2, winner)
+                self._store.match_finished(self._id, round_number, user1, user2, winner)
             self._condition.notify_all()
 
-    async def _create_match(self, user1: int, user2: int) -> None:
-        '''Create a match between two users'''
+    def _add_result(self, user1: int, user2: int, winner: Optional[int]) -> None:
+        '''Count the result of a match'''
+        if winner is not None:
+            winner_key = str(winner)  # Ensure winner is a string
+            if winner_key not in self._user_wins:
+                self._user_wins[winner_key] = 0  # Initialize if not present
+            self._user_wins[winner_key] += 1
+        self._format.add_result(user1, user2, winner)
+
+    async def _create_match(self, user1: int, user2: int) -> str:
+        '''Create a match between two users, returns its id'''
         
-        match_session = MatchSession(user1, user2, self.match_finished_callback)
-        Matches.add_match(match_session)
+        match_session = MatchSession(user1, user2, self.match_finished_callback, self._clock)
+        await Matches.add_match(match_session)
         await self._send_match_ready_message(match_session.get_id(), user1, user2)
+        return match_session.get_id()
 
     async def _send_tournament_schedule(self) -> None:
         '''Send the tournament schedule to the users'''
@@ -144,6 +159,7 @@ class TournamentSession:
                     'type': 'tournament_schedule',
                     'tournament_name': self._name,
                     'matches': self._matches,
+                    'rounds': self._rounds,
                 }
             )
 
@@ -220,6 +236,9 @@ class TournamentSession:
     def get_max_players(self) -> int:
         return self._max_players
 
+    def get_format(self) -> str:
+        return self._format_name
+
     def get_users(self) -> Set[str]:
         return self._assigned_users
 
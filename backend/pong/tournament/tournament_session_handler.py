@@ -1,22 +1,31 @@
+import asyncio
 import logging
+from typing import Optional
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from ..tournament.tournament_session import TournamentSession
+from ..tournament.tournament_formats import TOURNAMENT_FORMATS
+from ..tournament.tournament_store import StoredTournament, TournamentStore
 from ..data_managment.tournaments import Tournaments
 from ..data_managment.user import User
 from ..data_managment.matches import Matches
 from ..data_managment.matchmaking_queue import MatchmakingQueue
+from ..data_managment.registry_backend import NODE_ID, is_node_alive
 from channels.layers import get_channel_layer
 
 logger = logging.getLogger("tournament")
 
 MIN_PLAYERS = settings.TOURNAMENT_CONFIG['min_players']
-MAX_PLAYERS = settings.TOURNAMENT_CONFIG['max_players']
+MAX_PLAYERS = settings.TOURNAMENT_CONFIG['max_players'] # Per format
+DEFAULT_FORMAT = settings.TOURNAMENT_CONFIG['default_format']
+RESUME_CHECK_INTERVAL = settings.REGISTRY_CONFIG['node_timeout'] # Tournaments of a node are taken over once it is gone that long
 
 class TournamentSessionHandler:
     _channel_layer = get_channel_layer()
+    _resume_task: Optional[asyncio.Task] = None
 
     @classmethod
-    def create_online_tournament_session(cls, owner_user_id: int, tournament_name: str, size: int) -> TournamentSession:
+    async def create_online_tournament_session(cls, owner_user_id: int, tournament_name: str, size: int, tournament_format: str = DEFAULT_FORMAT) -> TournamentSession:
         '''Create an online tournament session'''
         if not owner_user_id:
             raise ValueError("Owner user id is required")
@@ -24,15 +33,17 @@ class TournamentSessionHandler:
             raise ValueError("Tournament name is required")
         if not size:
             raise ValueError("Tournament size is required")
+        if tournament_format not in TOURNAMENT_FORMATS:
+            raise ValueError("unknown tournament format")
         if size < MIN_PLAYERS:
             raise ValueError("tournament size is too small")
-        if size > MAX_PLAYERS:
+        if size > MAX_PLAYERS[tournament_format]:
             raise ValueError("tournament size is too large")
-        User.check_if_user_is_registered_somewhere(owner_user_id)
-        if Tournaments.get_by_name(tournament_name):
+        await User.check_if_user_is_registered_somewhere(owner_user_id)
+        if await Tournaments.is_name_registered(tournament_name):
             raise ValueError(f"tournament with name exists")
-        tournament_session = TournamentSession(owner_user_id, tournament_name, size, Tournaments.remove)
-        Tournaments.add(tournament_session)
+        tournament_session = TournamentSession(owner_user_id, tournament_name, size, Tournaments.remove, tournament_format)
+        await Tournaments.add(tournament_session)
         return tournament_session
 
     @classmethod
@@ -41,7 +52,7 @@ class TournamentSessionHandler:
         return Tournaments.get(tournament_id)
 
     @classmethod
-    def add_user_to_tournament(cls, tournament_id: str, user_id: int) -> None:
+    async def add_user_to_tournament(cls, tournament_id: str, user_id: int) -> None:
         '''Add a user to a tournament'''
         if not tournament_id:
             raise ValueError("Tournament id is required")
@@ -53,14 +64,14 @@ class TournamentSessionHandler:
         if not tournament:
             raise ValueError(f"tournament does not exist")
         
-        User.check_if_user_is_registered_somewhere(user_id)
+        await User.check_if_user_is_registered_somewhere(user_id)
 
         if tournament.is_full():
             raise ValueError(f"is full")
         elif tournament.is_running() or tournament.is_finished():
             raise ValueError(f"already started")
 
-        tournament.add_user(user_id)
+        await Tournaments.add_user(tournament_id, user_id)
         logger.debug(f"User {user_id} added to tournament {tournament_id}")
 
     @classmethod
@@ -83,20 +94,20 @@ class TournamentSessionHandler:
         if user_id == tournament.get_owner_user_id():
             await cls.cancel_tournament(tournament_id)
         else:
-            tournament.remove_user(user_id)
+            await Tournaments.remove_user(tournament_id, user_id)
         logger.debug(f"User {user_id} removed from tournament {tournament_id}")
 
     @classmethod
     async def remove_user_from_all_inactive_tournaments(cls, user_id: int) -> None:
         '''Remove a user from all tournaments if they are not running or finished'''
-        tournaments = list(Tournaments.get_all().values())
-        for tournament in tournaments:
-            if not tournament.is_running() and not tournament.is_finished():
-                logger.debug(f"Removing user {user_id} from tournament {tournament.get_id()}")
-                try:
-                    await cls.remove_user_from_tournament(tournament.get_id(), user_id)
-                except Exception as e:
-                    logger.error(f"Failed to remove user {user_id} from tournament {tournament.get_id()}: {e}")
+        # A user is registered to one tournament at most
+        tournament = Tournaments.get(await Tournaments.get_user_tournament_id(user_id))
+        if tournament is not None and not tournament.is_running() and not tournament.is_finished():
+            logger.debug(f"Removing user {user_id} from tournament {tournament.get_id()}")
+            try:
+                await cls.remove_user_from_tournament(tournament.get_id(), user_id)
+            except Exception as e:
+                logger.error(f"Failed to remove user {user_id} from tournament {tournament.get_id()}: {e}")
 
     @classmethod
     async def start_tournament(cls, user_id, tournament_id: str) -> None:
@@ -160,6 +171,51 @@ class TournamentSessionHandler:
                     });
                 except Exception as e:
                     logger.error(f"Failed to send cancellation message to user {user}: {e}")
-            Tournaments.remove(tournament_id)
+            await Tournaments.remove(tournament_id)
         else:
-            logger.error(f"Tournament {tournament_id} not found")
\ No newline at end of file
+            logger.error(f"Tournament {tournament_id} not found")
+
+    ##############################
+    #           Resume           #
+    ##############################
+
+    @classmethod
+    def start_resume_loop(cls) -> None:
+        '''Resume the unfinished tournaments on startup, then again every check interval for the nodes that go down later'''
+        if cls._resume_task is None or cls._resume_task.done():
+            cls._resume_task = asyncio.get_running_loop().create_task(cls._resume_loop())
+
+    @classmethod
+    async def _resume_loop(cls) -> None:
+        '''Look for tournaments to resume every check interval'''
+        while True:
+            await cls.resume_unfinished_tournaments()
+            await asyncio.sleep(RESUME_CHECK_INTERVAL)
+
+    @classmethod
+    async def resume_unfinished_tournaments(cls) -> None:
+        '''Continue the stored tournaments that no running node owns'''
+        try:
+            running_ids = list(Tournaments.get_all()) + TournamentStore.get_instance().get_unwritten_finished()
+            owners = await sync_to_async(TournamentStore.get_unfinished_owners)(running_ids)
+            orphaned = {tournament_id: node_id for tournament_id, node_id in owners.items() if node_id == NODE_ID or not await is_node_alive(node_id)}
+            stored_tournaments = await sync_to_async(TournamentStore.claim)(orphaned)
+        except Exception as e:
+            logger.error(f"Failed to load the unfinished tournaments: {e}")
+            return
+        for stored in stored_tournaments:
+            try:
+                await cls._resume_tournament(stored)
+            except Exception as e:
+                logger.error(f"Failed to resume tournament {stored.id}: {e}")
+
+    @classmethod
+    async def _resume_tournament(cls, stored: StoredTournament) -> None:
+        '''Register a stored tournament again and continue it with its next pending match'''
+        tournament = TournamentSession(stored.owner_user_id, stored.name, stored.max_players, Tournaments.remove, stored.format, stored.id)
+        for user_id in stored.seeded_users:
+            if user_id != stored.owner_user_id:
+                tournament.add_user(user_id)
+        await Tournaments.add(tournament)
+        logger.info(f"Resuming tournament {stored.id} after {len(stored.rounds)} scheduled rounds")
+        asyncio.create_task(tournament.start(stored))
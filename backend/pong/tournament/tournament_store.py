@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from ..data_managment.registry_backend import NODE_ID
+from ..models import Tournament, TournamentMatch, TournamentPlayer
+
+logger = logging.getLogger("tournament")
+
+FLUSH_INTERVAL = settings.TOURNAMENT_CONFIG['store_flush_interval']
+
+class StoredTournament:
+    '''State of an unfinished tournament as it was written to the database'''
+
+    def __init__(self, tournament: Tournament) -> None:
+        self.id: str = tournament.id
+        self.name: str = tournament.name
+        self.owner_user_id: Optional[int] = tournament.owner_id
+        self.format: str = tournament.format
+        self.max_players: int = tournament.max_players
+        players = list(tournament.players.all())
+        self.seeded_users: List[int] = [player.user_id for player in players]
+        self.eliminated_users = {player.user_id for player in players if player.is_eliminated}
+        self.rounds: List[Dict[frozenset, Optional[int]]] = [] # Per scheduled round: match -> winner, only finished matches
+        for match in tournament.matches.all():
+            while len(self.rounds) <= match.round:
+                self.rounds.append({})
+            if match.status == TournamentMatch.FINISHED:
+                self.rounds[match.round][frozenset((match.user1_id, match.user2_id))] = match.winner_id
+
+
+class TournamentStore:
+    '''Write-behind store of the tournament state
+
+    The sessions only queue their state transitions, so no database write happens on the match path.
+    The queue is written every flush interval in one transaction. Later transitions build on the earlier
+    ones, so none is ever skipped: if any of them fails the whole batch is rolled back and retried in
+    order with the next flush.'''
+
+    _instance: Optional['TournamentStore'] = None
+
+    def __init__(self) -> None:
+        self._pending: List[Tuple[Callable, tuple]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._unwritten_finished: Set[str] = set() # Over, but still running in the database until their write succeeds
+
+    @classmethod
+    def get_instance(cls) -> 'TournamentStore':
+        '''Get the store of this process'''
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    #############################
+    #    State transitions      #
+    #############################
+
+    def tournament_started(self, tournament_id: str, name: str, owner_user_id: int, tournament_format: str, max_players: int, seeded_users: List[int]) -> None:
+        '''A tournament started with its users, best seed first'''
+        self._put(self._write_tournament_started, tournament_id, name, owner_user_id, tournament_format, max_players, seeded_users)
+
+    def round_scheduled(self, tournament_id: str, round_number: int, matches: List[Tuple[int, int]]) -> None:
+        '''The matches of a round were decided'''
+        self._put(self._write_round_scheduled, tournament_id, round_number, matches)
+
+    def match_started(self, tournament_id: str, round_number: int, user1: int, user2: int, match_id: str) -> None:
+        '''A match of a round was created'''
+        self._put(self._write_match_started, tournament_id, round_number, user1, user2, match_id)
+
+    def match_finished(self, tournament_id: str, round_number: int, user1: int, user2: int, winner: Optional[int]) -> None:
+        '''A match of a round is over, winner is None for a draw'''
+        self._put(self._write_match_finished, tournament_id, round_number, user1, user2, winner)
+
+    def users_eliminated(self, tournament_id: str, user_ids: List[int]) -> None:
+        '''Users are out of a tournament'''
+        self._put(self._write_users_eliminated, tournament_id, user_ids)
+
+    def tournament_finished(self, tournament_id: str, winner: Optional[int]) -> None:
+        '''A tournament is over, winner is None if there is none'''
+        self._unwritten_finished.add(tournament_id)
+        self._put(self._write_tournament_finished, tournament_id, winner)
+
+    #############################
+    #          Writes           #
+    #############################
+
+    def _put(self, write: Callable, *args) -> None:
+        '''Queue a write for the next flush'''
+        self._pending.append((write, args))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        '''Flush the queue every flush interval while there are writes'''
+        try:
+            while self._pending:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                await self.flush()
+        finally:
+            self._flush_task = None
+
+    async def flush(self) -> None:
+        '''Write every queued transition now'''
+        writes, self._pending = self._pending, []
+        if not writes:
+            return
+        try:
+            await sync_to_async(self._write)(writes)
+        except Exception as e:
+            logger.error(f"Failed to write {len(writes)} tournament transitions, retrying: {e}")
+            self._pending = writes + self._pending
+            return
+        self._unwritten_finished.difference_update(args[0] for write, args in writes if write is self._write_tournament_finished)
+
+    def get_unwritten_finished(self) -> List[str]:
+        '''Get the tournaments that are over but not yet written as finished, they must not be resumed'''
+        return list(self._unwritten_finished)
+
+    @staticmethod
+    def _write(writes: List[Tuple[Callable, tuple]]) -> None:
+        '''Write the transitions in order in one transaction, nothing is written if one of them fails'''
+        with transaction.atomic():
+            for write, args in writes:
+                write(*args)
+
+    @staticmethod
+    def _write_tournament_started(tournament_id: str, name: str, owner_user_id: int, tournament_format: str, max_players: int, seeded_users: List[int]) -> None:
+        Tournament.objects.create(id=tournament_id, name=name, owner_id=owner_user_id, format=tournament_format, max_players=max_players, node_id=NODE_ID)
+        TournamentPlayer.objects.bulk_create([
+            TournamentPlayer(tournament_id=tournament_id, user_id=user_id, seed=seed) for seed, user_id in enumerate(seeded_users)
+        ])
+
+    @staticmethod
+    def _write_round_scheduled(tournament_id: str, round_number: int, matches: List[Tuple[int, int]]) -> None:
+        TournamentMatch.objects.bulk_create([
+            TournamentMatch(tournament_id=tournament_id, round=round_number, user1_id=user1, user2_id=user2) for user1, user2 in matches
+        ], ignore_conflicts=True)
+
+    @staticmethod
+    def _write_match_started(tournament_id: str, round_number: int, user1: int, user2: int, match_id: str) -> None:
+        TournamentMatch.objects.filter(tournament_id=tournament_id, round=round_number, user1_id=user1, user2_id=user2).update(
+            status=TournamentMatch.RUNNING, match_id=match_id)
+
+    @staticmethod
+    def _write_match_finished(tournament_id: str, round_number: int, user1: int, user2: int, winner: Optional[int]) -> None:
+        TournamentMatch.objects.filter(tournament_id=tournament_id, round=round_number, user1_id=user1, user2_id=user2).update(
+            status=TournamentMatch.FINISHED, winner_id=winner, match_id=None, finished_at=timezone.now())
+
+    @staticmethod
+    def _write_users_eliminated(tournament_id: str, user_ids: List[int]) -> None:
+        TournamentPlayer.objects.filter(tournament_id=tournament_id, user_id__in=user_ids).update(is_eliminated=True)
+
+    @staticmethod
+    def _write_tournament_finished(tournament_id: str, winner: Optional[int]) -> None:
+        Tournament.objects.filter(id=tournament_id).update(status=Tournament.FINISHED, winner_id=winner, updated_at=timezone.now())
+
+    #############################
+    #          Resume           #
+    #############################
+
+    @staticmethod
+    def get_unfinished_owners(running_ids: List[str]) -> Dict[str, Optional[str]]:
+        '''Get the node of every unfinished tournament, except running_ids, the ones this node runs or ended'''
+        return dict(Tournament.objects.filter(status=Tournament.RUNNING).exclude(id__in=running_ids).values_list('id', 'node_id'))
+
+    @staticmethod
+    def claim(owners: Dict[str, Optional[str]]) -> List[StoredTournament]:
+        '''Take over tournaments from the nodes they were read with, the caller checked that those nodes are gone'''
+        claimed = []
+        for tournament_id, node_id in owners.items():
+            # Only one node wins the update if several try to take over at once
+            if Tournament.objects.filter(id=tournament_id, node_id=node_id, status=Tournament.RUNNING).update(node_id=NODE_ID, updated_at=timezone.now()) == 1:
+                claimed.append(StoredTournament(Tournament.objects.get(id=tournament_id)))
+        return claimed
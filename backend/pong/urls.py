@@ -1,4 +1,6 @@
 from django.urls import path
 from pong import views
 
-urlpatterns = []
\ No newline at end of file
+urlpatterns = [
+    path('replays/<str:match_id>/verify/', views.ReplayVerifyView.as_view(), name='replay-verify'),
+]
@@ -1,3 +1,131 @@
-from django.shortcuts import render
+from uuid import UUID
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
+from usermanagement.models import CustomUser
+from usermanagement.permissions import Check2FA
+from .match.match_recorder import MatchRecording, get_recording_path
+from .rating.leaderboard import Leaderboard
 
-# Create your views here.
+PAGE_SIZE = settings.LEADERBOARD_CONFIG['page_size']
+MAX_PAGE_SIZE = settings.LEADERBOARD_CONFIG['max_page_size']
+NEIGHBOURS = settings.LEADERBOARD_CONFIG['neighbours']
+MAX_VERIFY_TICKS = settings.MATCH_CONFIG['max_verify_ticks']
+
+
+def load_recording(match_id: str) -> MatchRecording:
+    '''Load the recording of a match, raises NotFound if there is none'''
+    try:
+        UUID(match_id)
+        return MatchRecording.load(get_recording_path(match_id))
+    except (ValueError, OSError):
+        raise NotFound({'message': 'No recording for this match.'})
+
+
+def get_query_int(request, name: str, default: int, minimum: int, maximum: int) -> int:
+    '''Get an integer query parameter, raises ValidationError if it is not one or out of range'''
+    value = request.query_params.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'message': f'{name} must be an integer.'})
+    if not minimum <= value <= maximum:
+        raise ValidationError({'message': f'{name} must be between {minimum} and {maximum}.'})
+    return value
+
+
+def add_displaynames(entries: list) -> list:
+    '''Add the displayname of every user to their leaderboard entries'''
+    displaynames = dict(CustomUser.objects.filter(id__in=[entry['user_id'] for entry in entries]).values_list('id', 'displayname'))
+    for entry in entries:
+        entry['displayname'] = displaynames.get(entry['user_id'])
+    return entries
+
+
+class ReplayVerifyView(APIView):
+    permission_classes = [IsAuthenticated, Check2FA]
+
+    @extend_schema(
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(description="Result of the replay: ticks, simulated and recorded score, end reason, winner and whether they are consistent"),
+            status.HTTP_401_UNAUTHORIZED: OpenApiResponse(description="Please login"),
+            status.HTTP_403_FORBIDDEN: OpenApiResponse(description="Only the players of the match can verify it"),
+            status.HTTP_404_NOT_FOUND: OpenApiResponse(description="No recording for this match."),
+            status.HTTP_409_CONFLICT: OpenApiResponse(description="The recording was made with different simulation settings"),
+            status.HTTP_422_UNPROCESSABLE_ENTITY: OpenApiResponse(description="The match is too long to verify on request")
+        },
+        description="Re-simulate a recorded match from its inputs and check the recorded score."
+    )
+
+    def get(self, request, match_id):
+        recording = load_recording(match_id)
+        if not recording.is_viewable_by(request.user):
+            raise PermissionDenied({'message': 'Only the players of the match can verify it.'})
+        # The replay runs in the request, a longer match is verified with the replay_match command
+        if recording.get_last_tick() > MAX_VERIFY_TICKS:
+            return Response({'message': 'The match is too long to verify on request.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        try:
+            result = recording.verify()
+        except ValueError as e:
+            return Response({'message': str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(result)
+
+
+class LeaderboardView(APIView):
+    permission_classes = [IsAuthenticated, Check2FA]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='page', type=int, description="Page number, page 1 starts at the highest rating"),
+            OpenApiParameter(name='page_size', type=int, description=f"Users per page, at most {MAX_PAGE_SIZE}"),
+        ],
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(description="Number of ranked users and the entries of the page: rank, user_id, displayname, rating, wins, losses, draws"),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(description="Invalid page or page_size"),
+            status.HTTP_401_UNAUTHORIZED: OpenApiResponse(description="Please login")
+        },
+        description="Retrieve a page of the users ranked by rating."
+    )
+
+    def get(self, request):
+        page = get_query_int(request, 'page', 1, 1, 1_000_000)
+        page_size = get_query_int(request, 'page_size', PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        return Response({
+            'count': Leaderboard.get_size(),
+            'page': page,
+            'page_size': page_size,
+            'results': add_displaynames(Leaderboard.get_page(page, page_size))
+        })
+
+
+class LeaderboardUserView(APIView):
+    permission_classes = [IsAuthenticated, Check2FA]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='neighbours', type=int, description=f"Users shown above and below the user, at most {MAX_PAGE_SIZE}"),
+        ],
+        responses={
+            status.HTTP_200_OK: OpenApiResponse(description="Rank of the user and the entries around it: rank, user_id, displayname, rating, wins, losses, draws"),
+            status.HTTP_400_BAD_REQUEST: OpenApiResponse(description="Invalid neighbours"),
+            status.HTTP_401_UNAUTHORIZED: OpenApiResponse(description="Please login"),
+            status.HTTP_404_NOT_FOUND: OpenApiResponse(description="User is not ranked.")
+        },
+        description="Retrieve the rank of a user and the users ranked next to them."
+    )
+
+    def get(self, request, id):
+        neighbours = get_query_int(request, 'neighbours', NEIGHBOURS, 0, MAX_PAGE_SIZE)
+        entries = Leaderboard.get_neighbourhood(id, neighbours)
+        if entries is None:
+            raise NotFound({'message': 'User is not ranked.'})
+        rank = next(entry['rank'] for entry in entries if entry['user_id'] == id)
+        return Response({
+            'count': Leaderboard.get_size(),
+            'rank': rank,
+            'results': add_displaynames(entries)
+        })
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import CustomUser, Games
+from .models import CustomUser, Games, PlayerRating
 
 # Register your models here.
 
 admin.site.register(CustomUser)
 admin.site.register(Games)
+admin.site.register(PlayerRating)
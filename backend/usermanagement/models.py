@@ -58,4 +58,13 @@ class Games(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Game {self.id} Home: {self.home_id} Visitor: {self.visitor_id}"
\ No newline at end of file
+        return f"Game {self.id} Home: {self.home_id} Visitor: {self.visitor_id}"
+
+class PlayerRating(models.Model):
+    user = models.OneToOneField(CustomUser, related_name='rating', on_delete=models.CASCADE, primary_key=True)
+    rating = models.FloatField(db_index=True)
+    games_played = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rating of {self.user_id}: {self.rating:.0f} after {self.games_played} games"
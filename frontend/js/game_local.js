@@ -1,5 +1,7 @@
 import { api } from "./api.js";
 import { hubSocket, router, showAlert } from "./app.js";
+import { decodeFrame, isNewerSequence, MessageType } from "./match_protocol.js";
+import { StateInterpolator } from "./match_interpolation.js";
 
 const r = await api.get("/profile/");
 
@@ -21,6 +23,8 @@ function start_game(match_id) {
 
   let leftPlayerScore = 0;
   let rightPlayerScore = 0;
+  let lastStateSequence = null;
+  const interpolator = new StateInterpolator();
 
   const matchSocket = new WebSocket(
     "wss://" + window.location.host + "/wss/pong/match/" + match_id + "/"
@@ -44,75 +48,60 @@ function start_game(match_id) {
   matchSocket.onmessage = function (e) {
     const data = e.data;
 
-    if (typeof data === "string") {
-      // Handle JSON data
+    if (!(data instanceof ArrayBuffer)) {
+      console.error("Unsupported data type:", typeof data);
+      return;
+    }
+    const frame = decodeFrame(data);
+    if (frame === null) {
+      return;
+    }
+
+    if (frame.type === MessageType.START_TIMER) {
+      timerValue = frame.startTimer;
+      console.log("Received timer update:", timerValue);
+    } else if (frame.type === MessageType.PLAYER_SCORES) {
+      leftPlayerScore = frame.player1;
+      rightPlayerScore = frame.player2;
       try {
-        const jsonData = JSON.parse(data);
-        // Process JSON data
-        console.log("Received JSON data:", jsonData);
-
-        if (jsonData.type === "start_timer_update") {
-          timerValue = jsonData.start_timer;
-          console.log("Received timer update:", timerValue);
-        } else if (jsonData.type === "player_scores") {
-          leftPlayerScore = jsonData.player1;
-          rightPlayerScore = jsonData.player2;
-          try {
-            document.getElementById("left-score").innerHTML = leftPlayerScore;
-            document.getElementById("right-score").innerHTML = rightPlayerScore;
-          } catch (error) {}
-        } else if (jsonData.type === "game_over") {
-          matchSocket.close();
-          document.removeEventListener("keydown", key_down, false);
-          document.removeEventListener("keyup", key_up, false);
-          localStorage.setItem("local", true);
-          router.navigate("/endscreen");
-        } else if (jsonData.type === "user_mapping") {
-          is_local_match = jsonData.is_local_match;
-          user_id_p1 = jsonData.player1;
-          console.log("is_local_match:", is_local_match);
-          console.log("user_id_p1:", user_id_p1);
-          if (!is_local_match) {
-            user_id_p2 = jsonData.player2;
-            console.log("user_id_p2:", user_id_p2);
-          }
-        }
-      } catch (error) {
-        console.error("Failed to parse JSON data:", error);
+        document.getElementById("left-score").innerHTML = leftPlayerScore;
+        document.getElementById("right-score").innerHTML = rightPlayerScore;
+      } catch (error) {}
+    } else if (frame.type === MessageType.GAME_OVER) {
+      matchSocket.close();
+      document.removeEventListener("keydown", key_down, false);
+      document.removeEventListener("keyup", key_up, false);
+      localStorage.setItem("local", true);
+      router.navigate("/endscreen");
+    } else if (frame.type === MessageType.USER_MAPPING) {
+      interpolator.setTickRate(frame.tickRate);
+      is_local_match = frame.isLocalMatch;
+      user_id_p1 = frame.player1;
+      console.log("is_local_match:", is_local_match);
+      console.log("user_id_p1:", user_id_p1);
+      if (!is_local_match) {
+        user_id_p2 = frame.player2;
+        console.log("user_id_p2:", user_id_p2);
+      }
+    } else if (frame.type === MessageType.STATE || frame.type === MessageType.STATE_DELTA) {
+      // Frames can be overtaken by newer ones, never go back to an older state
+      if (lastStateSequence !== null && !isNewerSequence(frame.sequence, lastStateSequence)) {
+        return;
       }
-    } else if (data instanceof ArrayBuffer) {
-      // Handle binary data
-      const view = new DataView(data);
-
-      // Read the six floats from the DataView
-      // Assuming the data is little-endian; if not, set the second argument to false
-      const player1PosX = view.getFloat32(0, true) * 100;
-      const player1PosY = view.getFloat32(4, true) * 100;
-      const player2PosX = view.getFloat32(8, true) * 100;
-      const player2PosY = view.getFloat32(12, true) * 100;
-      const ballPosX = view.getFloat32(16, true) * 100;
-      const ballPosY = view.getFloat32(20, true) * 100;
-      const wallCollisionByte = view.getUint8(24);
-      const paddleCollisionByte = view.getUint8(25);
-
-      const wallCollision = wallCollisionByte === 1;
-      const paddleCollision = paddleCollisionByte === 1;
-
-      if (wallCollision) {
+      // Deltas can only be applied once a keyframe has been received
+      if (frame.type === MessageType.STATE_DELTA && lastStateSequence === null) {
+        return;
+      }
+      lastStateSequence = frame.sequence;
+
+      if (frame.wallCollision) {
         playWallCollisionSound();
-      } else if (paddleCollision) {
+      } else if (frame.paddleCollision) {
         playPaddleCollisionSound();
       }
 
-      // Update the paddles and ball
-      leftPaddle.x = player1PosX;
-      leftPaddle.y = player1PosY;
-      rightPaddle.x = player2PosX;
-      rightPaddle.y = player2PosY;
-      ball.x = ballPosX;
-      ball.y = ballPosY;
-    } else {
-      console.error("Unsupported data type:", typeof data);
+      // Store the paddles and ball, draw() interpolates between the frames
+      interpolator.push(frame, 100);
     }
   };
 
@@ -302,6 +291,12 @@ function start_game(match_id) {
   const countdownElement = document.getElementById("countdown");
 
   function draw() {
+    // Positions interpolated between the last two state frames
+    const positions = interpolator.getPositions(performance.now());
+    if (positions !== null) {
+      [leftPaddle.x, leftPaddle.y, rightPaddle.x, rightPaddle.y, ball.x, ball.y] = positions;
+    }
+
     // Draw ball and paddles
     moveElement("ball", "ball-filter", ball.x, ball.y);
     moveElement("left-pad", "left-pad-filter", leftPaddle.x, leftPaddle.y);
@@ -0,0 +1,64 @@
+// Smooths the rendering of the match state by interpolating between the last two state frames
+//
+// The server sends state at its send rate, which can be lower than the display refresh rate.
+// The positions are drawn one frame interval behind the server, moving from the previous to the
+// current frame over the time that passed between their ticks on the server.
+
+// Jumps larger than this (in pixels) are not interpolated, e.g. the ball reset after a goal
+const MAX_INTERPOLATION_DISTANCE = 300;
+// Ticks per second until the user mapping tells the one of the match
+const DEFAULT_TICK_RATE = 64;
+
+export class StateInterpolator {
+  constructor() {
+    this.previous = null;
+    this.current = null;
+    this.tickRate = DEFAULT_TICK_RATE;
+  }
+
+  // Set the number of ticks per second sent in the user mapping
+  setTickRate(tickRate) {
+    if (tickRate > 0) {
+      this.tickRate = tickRate;
+    }
+  }
+
+  // Store the positions of a decoded state frame, unchanged positions of a delta are null
+  push(frame, scale) {
+    const positions = this.current ? this.current.positions.slice() : new Array(frame.positions.length);
+    frame.positions.forEach((value, index) => {
+      if (value !== null) {
+        positions[index] = value * scale;
+      }
+    });
+    this.previous = this.current;
+    this.current = {
+      positions: positions,
+      tick: frame.tick,
+      receivedAt: performance.now(),
+    };
+  }
+
+  // Get the positions to draw now or null if no state was received yet
+  getPositions(now) {
+    if (this.current === null) {
+      return null;
+    }
+    if (this.previous === null) {
+      return this.current.positions;
+    }
+    // The tick is a wrapping uint32
+    const interval = (((this.current.tick - this.previous.tick) >>> 0) * 1000) / this.tickRate;
+    if (interval === 0) {
+      return this.current.positions;
+    }
+    const alpha = Math.min((now - this.current.receivedAt) / interval, 1);
+    return this.current.positions.map((value, index) => {
+      const previousValue = this.previous.positions[index];
+      if (Math.abs(value - previousValue) > MAX_INTERPOLATION_DISTANCE) {
+        return value;
+      }
+      return previousValue + (value - previousValue) * alpha;
+    });
+  }
+}
@@ -0,0 +1,125 @@
+// Decoder for the binary match protocol, mirrors backend/pong/match/protocol.py
+//
+// Every frame starts with the little-endian header:
+//   version (uint8), message type (uint8), sequence (uint16), tick (uint32)
+// The tick is the simulation step of the frame, the user mapping carries the ticks per second.
+// Positions are 16-bit fixed point values scaled to the world size.
+// State frames are keyframes, delta frames only carry the positions that changed since the previous frame.
+
+export const PROTOCOL_VERSION = 4;
+
+export const MessageType = {
+  STATE: 1,
+  USER_MAPPING: 2,
+  PLAYER_SCORES: 3,
+  START_TIMER: 4,
+  USER_DISCONNECTED: 5,
+  GAME_OVER: 6,
+  STATE_DELTA: 7,
+};
+
+const WALL_COLLISION = 1;
+const PADDLE_COLLISION = 2;
+const NO_PLAYER = 255;
+const NO_USER = 0;
+const QUANTIZATION_STEPS = 0xffff;
+const HEADER_SIZE = 8;
+const POSITION_COUNT = 6;
+
+// Default world size, replaced by the one sent in the user mapping
+let worldSize = { x: 16.0, y: 9.0 };
+
+function dequantize(value, size) {
+  return (value / QUANTIZATION_STEPS) * size;
+}
+
+// Positions are ordered left paddle x/y, right paddle x/y, ball x/y
+function dequantizePosition(view, offset, index) {
+  const size = index % 2 === 0 ? worldSize.x : worldSize.y;
+  return dequantize(view.getUint16(offset, true), size);
+}
+
+// Returns the decoded frame or null if the frame uses another protocol version
+export function decodeFrame(buffer) {
+  const view = new DataView(buffer);
+  const version = view.getUint8(0);
+  if (version !== PROTOCOL_VERSION) {
+    console.error("Unsupported protocol version:", version);
+    return null;
+  }
+  const frame = {
+    type: view.getUint8(1),
+    sequence: view.getUint16(2, true),
+    tick: view.getUint32(4, true),
+  };
+  const offset = HEADER_SIZE;
+
+  switch (frame.type) {
+    case MessageType.STATE: {
+      const flags = view.getUint8(offset + 2 * POSITION_COUNT);
+      frame.positions = [];
+      for (let index = 0; index < POSITION_COUNT; index++) {
+        frame.positions.push(dequantizePosition(view, offset + 2 * index, index));
+      }
+      frame.wallCollision = (flags & WALL_COLLISION) !== 0;
+      frame.paddleCollision = (flags & PADDLE_COLLISION) !== 0;
+      break;
+    }
+    case MessageType.STATE_DELTA: {
+      // Unchanged positions are null
+      const mask = view.getUint8(offset);
+      const flags = view.getUint8(offset + 1);
+      let positionOffset = offset + 2;
+      frame.positions = [];
+      for (let index = 0; index < POSITION_COUNT; index++) {
+        if (mask & (1 << index)) {
+          frame.positions.push(dequantizePosition(view, positionOffset, index));
+          positionOffset += 2;
+        } else {
+          frame.positions.push(null);
+        }
+      }
+      frame.wallCollision = (flags & WALL_COLLISION) !== 0;
+      frame.paddleCollision = (flags & PADDLE_COLLISION) !== 0;
+      break;
+    }
+    case MessageType.USER_MAPPING: {
+      frame.isLocalMatch = view.getUint8(offset) === 1;
+      frame.player1 = view.getUint32(offset + 1, true);
+      const player2 = view.getUint32(offset + 5, true);
+      frame.player2 = player2 === NO_USER ? null : player2;
+      worldSize = {
+        x: view.getFloat32(offset + 9, true),
+        y: view.getFloat32(offset + 13, true),
+      };
+      frame.tickRate = view.getFloat32(offset + 17, true);
+      break;
+    }
+    case MessageType.PLAYER_SCORES:
+      frame.player1 = view.getUint8(offset);
+      frame.player2 = view.getUint8(offset + 1);
+      break;
+    case MessageType.START_TIMER:
+      frame.startTimer = view.getUint8(offset);
+      break;
+    case MessageType.USER_DISCONNECTED:
+      frame.userId = view.getUint32(offset, true);
+      break;
+    case MessageType.GAME_OVER: {
+      const winner = view.getUint8(offset);
+      const loser = view.getUint8(offset + 1);
+      frame.winner = winner === NO_PLAYER ? null : winner;
+      frame.loser = loser === NO_PLAYER ? null : loser;
+      break;
+    }
+    default:
+      console.error("Unknown message type:", frame.type);
+      return null;
+  }
+  return frame;
+}
+
+// True if sequence a is newer than b, taking the 16-bit wrap around into account
+export function isNewerSequence(a, b) {
+  return a !== b && ((a - b) & 0xffff) < 0x8000;
+}